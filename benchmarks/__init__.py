@@ -0,0 +1,5 @@
+"""Benchmarks of the Smart Thermostat controller hot paths.
+
+Run with `python -m benchmarks` from the root of the repository. Results are written as
+pytest-benchmark style JSON so regressions can be compared between releases.
+"""
@@ -0,0 +1,35 @@
+"""Command line entry point: python -m benchmarks --help"""
+import argparse
+import fnmatch
+import sys
+
+from . import (  # noqa: F401 register benchmarks
+    bench_autotune, bench_identification, bench_pid, bench_thermostat)
+from .runner import compare, registered, run, save
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the controller hot paths.')
+    parser.add_argument('-k', '--filter', default='*',
+                        help='only run benchmarks whose name or group matches this glob')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.05,
+                        help='minimum duration of a round in seconds')
+    parser.add_argument('-o', '--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare with the results of a previous JSON file')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown ratio reported as a regression by --compare')
+    args = parser.parse_args()
+
+    benchmarks = [bench for bench in registered()
+                  if fnmatch.fnmatch(bench.name, args.filter)
+                  or fnmatch.fnmatch(bench.group, args.filter)]
+    results = run(benchmarks, args.rounds, args.min_time)
+    if args.output:
+        save(results, args.output)
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
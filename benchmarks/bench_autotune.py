@@ -0,0 +1,38 @@
+"""Autotune cost as the lookback buffer grows."""
+import itertools
+import random
+
+from custom_components.smart_thermostat import pid_controller
+
+from .runner import benchmark
+
+_SAMPLE_TIME = 60
+_RATIOS = [{'ratio': ratio} for ratio in (60, 240, 1440, 7200)]
+
+
+def _filled_autotune(ratio):
+    """Return an autotune with a full lookback buffer of `ratio` samples, and its feeder."""
+    generator = random.Random(ratio)
+    noise = [20 + generator.gauss(0, 0.02) for _ in range(4096)]
+    autotune = pid_controller.PIDAutotune(100, ratio * _SAMPLE_TIME, 0, 100, 0.5,
+                                          time_func=lambda: 0)
+    counter = itertools.count(1)
+
+    def feed():
+        i = next(counter)
+        autotune.run(noise[i % 4096], 20, i * _SAMPLE_TIME)
+    for _ in range(ratio + 20):
+        feed()
+    return autotune, feed
+
+
+@benchmark('autotune_run', params=_RATIOS)
+def autotune_run(ratio):
+    _, feed = _filled_autotune(ratio)
+    return feed
+
+
+@benchmark('autotune_analysis', params=_RATIOS)
+def autotune_analysis(ratio):
+    autotune, _ = _filled_autotune(ratio)
+    return autotune.analysis
@@ -0,0 +1,41 @@
+"""Process model identification cost as the history grows."""
+import math
+import random
+
+from .runner import Skip, benchmark
+
+_SAMPLE_TIME = 60
+
+
+def _history(days, seed=0):
+    """Return the temperatures, outputs and outdoor temperatures of a simulated room."""
+    generator = random.Random(seed)
+    samples = days * 86400 // _SAMPLE_TIME
+    decay = math.exp(-_SAMPLE_TIME / 7200)
+    delay = 300 // _SAMPLE_TIME
+    temperatures, outputs, outdoor = [], [], []
+    temperature, output = 19.0, 50.0
+    for i in range(samples):
+        if i % 30 == 0:
+            output = generator.choice([0.0, 25.0, 50.0, 75.0, 100.0])
+        ext = 5 + 4 * math.sin(2 * math.pi * i * _SAMPLE_TIME / 86400)
+        temperatures.append(temperature + generator.gauss(0, 0.02))
+        outputs.append(output)
+        outdoor.append(ext)
+        delayed = outputs[i - delay] if i >= delay else 0.0
+        temperature = ext + 0.2 * delayed + (temperature - ext - 0.2 * delayed) * decay
+    return temperatures, outputs, outdoor
+
+
+@benchmark('identification_fit', params=[{'days': days} for days in (7, 30, 365)])
+def identification_fit(days):
+    try:
+        import numpy as np
+        from custom_components.smart_thermostat.pid_controller import identification
+    except ImportError as ex:
+        raise Skip(ex)
+    temperatures, outputs, outdoor = (np.array(signal) for signal in _history(days))
+
+    def fit():
+        identification.fit_fopdt(temperatures, outputs, outdoor, _SAMPLE_TIME, 7200)
+    return fit
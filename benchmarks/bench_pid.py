@@ -0,0 +1,63 @@
+"""PID controller throughput."""
+import itertools
+import random
+
+from custom_components.smart_thermostat import pid_controller
+
+from .runner import Skip, benchmark
+
+_SAMPLES = 1024
+
+
+def _temperatures(seed=0):
+    generator = random.Random(seed)
+    return [round(20 + generator.gauss(0, 0.5), 1) for _ in range(_SAMPLES)]
+
+
+@benchmark('pid_calc', params=[{'mode': mode, 'ext_temp': ext_temp}
+                               for mode in ('auto', 'off') for ext_temp in (False, True)])
+def pid_calc(mode, ext_temp):
+    pid = pid_controller.PID(30, 0.005, 5000, 0.6, 0, 100)
+    pid.mode = mode
+    temperatures = _temperatures()
+    ext = 5.0 if ext_temp else None
+    counter = itertools.count(1)
+
+    def step():
+        i = next(counter)
+        pid.calc(temperatures[i % _SAMPLES], 20.0, i * 60.0, (i - 1) * 60.0, ext)
+    return step
+
+
+@benchmark('pid_fleet', params=[{'engine': engine, 'zones': zones}
+                                for engine in ('pid', 'bank')
+                                for zones in (1, 10, 50, 100, 1000)])
+def pid_fleet(engine, zones):
+    """One control step of `zones` controllers, with scalar PIDs or a PIDBank."""
+    temperatures = _temperatures()
+    counter = itertools.count(1)
+    if engine == 'pid':
+        pids = [pid_controller.PID(30, 0.005, 5000, 0.6, 0, 100) for _ in range(zones)]
+
+        def step():
+            i = next(counter)
+            for zone, pid in enumerate(pids):
+                pid.calc(temperatures[(i + zone) % _SAMPLES], 20.0, i * 60.0, (i - 1) * 60.0,
+                         5.0)
+        return step
+
+    try:
+        import numpy as np
+        from custom_components.smart_thermostat.pid_controller.bank import PIDBank
+    except ImportError as ex:
+        raise Skip(ex)
+    bank = PIDBank()
+    for _ in range(zones):
+        bank.add(30, 0.005, 5000, 0.6, 0, 100)
+    table = np.array(temperatures)
+    offsets = np.arange(zones)
+
+    def step():
+        i = next(counter)
+        bank.calc(table[(i + offsets) % _SAMPLES], 20.0, i * 60.0, (i - 1) * 60.0, 5.0)
+    return step
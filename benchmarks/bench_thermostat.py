@@ -0,0 +1,80 @@
+"""End to end control cycle latency of SmartThermostat."""
+import datetime
+import itertools
+import random
+
+from .hass import StandInHass
+from .runner import Skip, benchmark
+
+
+def _thermostat_class():
+    try:
+        from homeassistant.components.climate import HVACMode
+        from custom_components.smart_thermostat.climate import SmartThermostat
+        from custom_components.smart_thermostat.publisher import StatePublisher
+    except ImportError as ex:
+        raise Skip(ex)
+    return SmartThermostat, HVACMode, StatePublisher
+
+
+def _make_thermostat(hass, zone, pwm, clock):
+    smart_thermostat, hvac_mode, state_publisher = _thermostat_class()
+    heater = f'switch.heater_{zone}' if pwm else f'number.valve_{zone}'
+    hass.states.async_set(heater, 'off' if pwm else 0)
+    thermostat = smart_thermostat(
+        name=f'zone {zone}', unique_id=f'zone_{zone}', heater_entity_id=[heater],
+        cooler_entity_id=None, invert_heater=False, sensor_entity_id=f'sensor.zone_{zone}',
+        ext_sensor_entity_id='sensor.outdoor', min_temp=7, max_temp=35, target_temp=20.0,
+        hot_tolerance=0.3, cold_tolerance=0.3, ac_mode=False, force_off_state=True,
+        min_cycle_duration=datetime.timedelta(), min_off_cycle_duration=None,
+        min_cycle_duration_pid_off=None, min_off_cycle_duration_pid_off=None,
+        keep_alive=datetime.timedelta(seconds=60), sampling_period=datetime.timedelta(),
+        sensor_stall=datetime.timedelta(hours=6), output_safety=5.0,
+        min_publish_interval=datetime.timedelta(),
+        initial_hvac_mode=hvac_mode.HEAT, preset_sync_mode='none', away_temp=16.0,
+        eco_temp=None, boost_temp=None, comfort_temp=None, home_temp=None, sleep_temp=None,
+        activity_temp=None, precision=None, target_temp_step=None, unit='°C',
+        output_precision=1, output_min=0, output_max=100, output_clamp_low=0,
+        output_clamp_high=100, kp=30, ki=0.005, kd=5000, ke=0.6,
+        pwm=datetime.timedelta(seconds=pwm), boost_pid_off=False, autotune='none',
+        noiseband=0.5, lookback=datetime.timedelta(hours=2), debug=False, time_func=clock)
+    thermostat.hass = hass
+    thermostat.entity_id = f'climate.zone_{zone}'
+    thermostat._hvac_mode = hvac_mode.HEAT
+    thermostat._ext_temp = 5.0
+
+    def write_state():
+        # what Home Assistant reads on each state write
+        hass.states.async_set(thermostat.entity_id, thermostat.state,
+                              dict(thermostat.extra_state_attributes))
+    thermostat.async_write_ha_state = write_state
+    thermostat._publisher = state_publisher(hass, write_state, 0, clock)
+    hass.states.listen(heater, thermostat._async_switch_changed)
+    return thermostat
+
+
+@benchmark('thermostat_control', params=[{'pwm': pwm, 'zones': zones}
+                                         for pwm in (900, 0) for zones in (1, 10, 50)])
+def thermostat_control(pwm, zones):
+    """One sensor-triggered control cycle of `zones` thermostats."""
+    hass = StandInHass()
+    now = [1.7e9]
+    thermostats = [_make_thermostat(hass, zone, pwm, lambda: now[0]) for zone in range(zones)]
+    generator = random.Random(zones)
+    temperatures = [round(20 + generator.gauss(0, 0.5), 1) for _ in range(1024)]
+    counter = itertools.count(1)
+
+    async def cycle(i):
+        for zone, thermostat in enumerate(thermostats):
+            thermostat._previous_temp_time = thermostat._cur_temp_time
+            thermostat._cur_temp_time = now[0]
+            thermostat._current_temp = temperatures[(i + zone) % 1024]
+            thermostat._trigger_source = 'sensor'
+            await thermostat._async_control_heating(calc_pid=True)
+        await hass.async_block_till_done()
+
+    def step():
+        i = next(counter)
+        now[0] += 60
+        hass.loop.run_until_complete(cycle(i))
+    return step
@@ -0,0 +1,86 @@
+"""Lightweight stand-in for the parts of Home Assistant used by the control loop."""
+import asyncio
+
+
+class StandInState:
+    def __init__(self, entity_id, state, attributes=None):
+        self.entity_id = entity_id
+        self.state = state
+        self.attributes = attributes or {}
+
+
+class StandInEvent:
+    def __init__(self, data):
+        self.data = data
+
+
+class StandInStates:
+    """Minimal state machine: get, is_state and set, calling listeners on state changes."""
+
+    def __init__(self):
+        self._states = {}
+        self._listeners = {}
+
+    def listen(self, entity_id, listener):
+        """Call `listener` with a state changed event when the state of `entity_id` changes."""
+        self._listeners.setdefault(entity_id, []).append(listener)
+
+    def get(self, entity_id):
+        return self._states.get(entity_id)
+
+    def is_state(self, entity_id, state):
+        current = self._states.get(entity_id)
+        return current is not None and current.state == state
+
+    def async_set(self, entity_id, state, attributes=None):
+        old_state = self._states.get(entity_id)
+        new_state = self._states[entity_id] = StandInState(entity_id, str(state), attributes)
+        if old_state is not None and old_state.state == new_state.state:
+            return
+        event = StandInEvent({'entity_id': entity_id, 'old_state': old_state,
+                              'new_state': new_state})
+        for listener in self._listeners.get(entity_id, []):
+            listener(event)
+
+
+class StandInServices:
+    """Service registry applying turn_on, turn_off and set_value calls to the states."""
+
+    def __init__(self, states):
+        self._states = states
+        self.calls = 0
+
+    async def async_call(self, domain, service, service_data=None, blocking=False, **kwargs):
+        self.calls += 1
+        service_data = service_data or {}
+        entity_ids = service_data.get('entity_id', [])
+        if isinstance(entity_ids, str):
+            entity_ids = [entity_ids]
+        for entity_id in entity_ids:
+            if service == 'turn_on':
+                self._states.async_set(entity_id, 'on')
+            elif service == 'turn_off':
+                self._states.async_set(entity_id, 'off')
+            else:
+                value = service_data.get('value', service_data.get('position'))
+                self._states.async_set(entity_id, value)
+
+
+class StandInHass:
+    """Holds the states, services and event loop used by `SmartThermostat`."""
+
+    def __init__(self, loop=None):
+        self.loop = loop or asyncio.new_event_loop()
+        self.states = StandInStates()
+        self.services = StandInServices(self.states)
+        self.data = {}
+
+    def async_create_background_task(self, target, name):
+        return self.loop.create_task(target, name=name)
+
+    async def async_block_till_done(self):
+        """Wait for the background tasks, ie the commands sent to the actuators."""
+        current = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks(self.loop) if task is not current]
+        if tasks:
+            await asyncio.gather(*tasks)
@@ -0,0 +1,137 @@
+"""Minimal benchmark runner writing pytest-benchmark compatible JSON."""
+import datetime
+import gc
+import json
+import platform
+import statistics
+import time
+from collections import namedtuple
+
+Benchmark = namedtuple('Benchmark', ['name', 'group', 'func', 'setup', 'params'])
+
+_REGISTRY = []
+
+
+class Skip(Exception):
+    """Raised by a benchmark setup when it can not run in this environment."""
+
+
+def benchmark(group, params=None):
+    """Register a benchmark.
+
+    The decorated function is a setup function receiving the benchmark parameters and
+    returning the callable to time. Each parameter set registers a separate benchmark.
+
+    Args:
+        group (str): Name of the group the benchmark belongs to.
+        params (list): List of dict of parameters, one benchmark per dict.
+    """
+    def decorator(setup):
+        for param in params or [{}]:
+            suffix = ','.join(f'{key}={value}' for key, value in param.items())
+            name = f'{setup.__name__}[{suffix}]' if suffix else setup.__name__
+            _REGISTRY.append(Benchmark(name, group, None, setup, param))
+        return setup
+    return decorator
+
+
+def registered():
+    """Get all registered benchmarks."""
+    return list(_REGISTRY)
+
+
+def _time_rounds(func, rounds, min_time):
+    # calibrate the number of iterations so a round lasts at least `min_time`
+    iterations = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time or iterations >= 1 << 20:
+            break
+        iterations *= 10 if elapsed < min_time / 10 else 2
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        timings.append((time.perf_counter() - started) / iterations)
+    return timings, iterations
+
+
+def run(benchmarks, rounds=5, min_time=0.05, report=print):
+    """Run benchmarks and return the results as a pytest-benchmark style dict."""
+    results = []
+    for bench in benchmarks:
+        try:
+            func = bench.setup(**bench.params)
+        except Skip as ex:
+            report(f'{bench.name}: skipped ({ex})')
+            continue
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            timings, iterations = _time_rounds(func, rounds, min_time)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        mean = statistics.fmean(timings)
+        stats = {
+            'min': min(timings),
+            'max': max(timings),
+            'mean': mean,
+            'stddev': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+            'median': statistics.median(timings),
+            'rounds': rounds,
+            'iterations': iterations,
+            'ops': 1 / mean if mean else 0.0,
+        }
+        results.append({
+            'group': bench.group,
+            'name': bench.name,
+            'fullname': f'{bench.group}::{bench.name}',
+            'params': bench.params,
+            'stats': stats,
+        })
+        report(f'{bench.name}: {mean * 1e6:.2f} us (± {stats["stddev"] * 1e6:.2f})')
+    return {
+        'machine_info': {
+            'node': platform.node(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'python_implementation': platform.python_implementation(),
+            'python_version': platform.python_version(),
+            'system': platform.system(),
+            'release': platform.release(),
+        },
+        'datetime': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'benchmarks': results,
+    }
+
+
+def save(results, path):
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=2)
+
+
+def compare(results, path, threshold=0.1, report=print):
+    """Compare results with a previous JSON file and report the changes of mean time.
+
+    Returns:
+        The list of the names of the benchmarks slower than `threshold` (ie 10%).
+    """
+    with open(path) as file:
+        previous = {bench['fullname']: bench['stats'] for bench in json.load(file)['benchmarks']}
+    regressions = []
+    for bench in results['benchmarks']:
+        old = previous.get(bench['fullname'])
+        if old is None:
+            continue
+        ratio = bench['stats']['mean'] / old['mean']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = ' REGRESSION'
+            regressions.append(bench['fullname'])
+        report(f'{bench["fullname"]}: {ratio:.2f}x{flag}')
+    return regressions
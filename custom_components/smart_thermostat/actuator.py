@@ -0,0 +1,343 @@
+"""Drivers sending the commands of the thermostat to its heater or cooler entities."""
+import asyncio
+import logging
+
+from homeassistant.components.input_boolean import DOMAIN as INPUT_BOOLEAN_DOMAIN
+from homeassistant.components.input_number import DOMAIN as INPUT_NUMBER_DOMAIN
+from homeassistant.components.light import ATTR_BRIGHTNESS_PCT, DOMAIN as LIGHT_DOMAIN
+from homeassistant.components.number.const import (
+    ATTR_VALUE,
+    DOMAIN as NUMBER_DOMAIN,
+    SERVICE_SET_VALUE,
+)
+from homeassistant.components.switch import DOMAIN as SWITCH_DOMAIN
+from homeassistant.components.valve import (
+    ATTR_POSITION,
+    DOMAIN as VALVE_DOMAIN,
+    SERVICE_SET_VALVE_POSITION,
+)
+from homeassistant.const import ATTR_ENTITY_ID, SERVICE_TURN_OFF, SERVICE_TURN_ON
+from homeassistant.core import DOMAIN as HA_DOMAIN, HomeAssistant, callback, split_entity_id
+
+from .pid_controller import default_clock
+
+_LOGGER = logging.getLogger(__name__)
+
+# Delay before the first retry of a failed command, doubled on each retry up to the maximum
+RETRY_DELAY = 2
+RETRY_MAX_DELAY = 120
+
+# Domains having their own turn_on and turn_off services, others use the generic ones
+TOGGLE_DOMAINS = (SWITCH_DOMAIN, LIGHT_DOMAIN, INPUT_BOOLEAN_DOMAIN)
+
+
+def needs_refresh(reported, entities, active, last_command, now, refresh):
+    """Return if the state of toggled entities must be sent again to refresh it.
+
+    Args:
+        reported (dict): The activity last reported by each entity.
+        entities (list): The entities expected in the commanded state.
+        active (bool): The commanded state.
+        last_command (float): The time of the last command in seconds, None if unknown.
+        now (float): The current time in seconds.
+        refresh (float): The age in seconds of the last command after which the state is sent
+            again even if the entities report it, 0 to always send it.
+    """
+    if not refresh or last_command is None:
+        return True
+    if any(reported.get(entity) != active for entity in entities):
+        return True
+    return now - last_command >= refresh
+
+
+class ActuatorDriver:
+    """Builds the service calls controlling one entity, resolved once from its domain.
+
+    A command is a `(domain, service, data)` tuple, `data` being a tuple of items so that
+    identical commands of several entities can be grouped in one service call.
+    """
+
+    def __init__(self, entity_id):
+        self.entity_id = entity_id
+        # Last value commanded and when, None until a value is sent
+        self.value = None
+        self.value_time = None
+        # Command waiting to be sent, replaced by newer commands, and its failed attempts
+        self.pending = None
+        self.attempts = 0
+        self.retry_at = 0
+        # Token bucket of the rate limit, None until the first command is sent
+        self.tokens = None
+        self.tokens_time = None
+        self.rate_limited = False
+        domain = split_entity_id(entity_id)[0]
+        self._toggle_domain = domain if domain in TOGGLE_DOMAINS else HA_DOMAIN
+        if domain == LIGHT_DOMAIN:
+            self._value_service = (LIGHT_DOMAIN, SERVICE_TURN_ON, ATTR_BRIGHTNESS_PCT)
+        elif domain == VALVE_DOMAIN:
+            self._value_service = (VALVE_DOMAIN, SERVICE_SET_VALVE_POSITION, ATTR_POSITION)
+        elif domain == INPUT_NUMBER_DOMAIN:
+            self._value_service = (INPUT_NUMBER_DOMAIN, SERVICE_SET_VALUE, ATTR_VALUE)
+        else:
+            self._value_service = (NUMBER_DOMAIN, SERVICE_SET_VALUE, ATTR_VALUE)
+
+    def turn_on(self):
+        return self._toggle_domain, SERVICE_TURN_ON, ()
+
+    def turn_off(self):
+        return self._toggle_domain, SERVICE_TURN_OFF, ()
+
+    def set_value(self, value):
+        domain, service, attribute = self._value_service
+        return domain, service, ((attribute, value),)
+
+
+class ActuatorGroup:
+    """The drivers of the entities controlled together, heaters or coolers.
+
+    The commands are sent in the background so that the control loop never waits for the
+    devices: each entity has a single pending command, replaced by the newer ones, sent by a
+    worker task of the group. Identical pending commands are merged in a single service call
+    per domain with the list of the entities, and the calls of different domains are sent
+    concurrently. A call not completed within the timeout or failing is retried with an
+    exponential backoff, unless a newer command has been posted meanwhile.
+
+    The commands sent to each entity can be limited with a token bucket: `rate_limit` commands
+    per `rate_period`, and up to `burst` commands in a row. A command exceeding the budget
+    waits for a token, the commands posted meanwhile replacing it.
+
+    Values are quantized to the resolution of the actuators and only sent to an entity when
+    they differ from the last value commanded to it by at least the deadband, or when the last
+    command is older than the refresh period. A value reaching one of the limits is sent as
+    soon as it changes, so that a valve can always be fully closed or opened. A failed command
+    forgets the value commanded, so the next value is sent even if unchanged, unless the same
+    value is already waiting for its retry.
+
+    Args:
+        entity_ids (list): The entities controlled.
+        resolution (float): The step of the values accepted by the actuators, 0 to send the
+            values unchanged.
+        deadband (float): The smallest change of value sent to an actuator.
+        refresh (float): The maximum age in seconds of the last command after which an
+            unchanged value is sent again, 0 to never send it again.
+        limits (tuple): The values always sent when changed, the ends of the output range.
+        timeout (float): The time in seconds given to a device to complete a command.
+        retries (int): The number of times a failed command is sent again.
+        rate_limit (int): The number of commands allowed per period for each entity, 0 for no
+            limit.
+        rate_period (float): The period of the rate limit in seconds.
+        burst (int): The number of commands which can be sent in a row to an entity, defaults
+            to `rate_limit`.
+        time_func (function): A function which returns the current time in seconds.
+    """
+
+    def __init__(self, entity_ids, resolution=0, deadband=0, refresh=0, limits=(),
+                 timeout=10, retries=3, rate_limit=0, rate_period=600, burst=None,
+                 time_func=default_clock):
+        self.entity_ids = list(dict.fromkeys(entity_ids or []))
+        self._drivers = [ActuatorDriver(entity_id) for entity_id in self.entity_ids]
+        self._resolution = resolution
+        self._deadband = deadband
+        self._refresh = refresh
+        self._limits = set(limits) | {0}
+        self._timeout = timeout
+        self._retries = retries
+        self._rate = rate_limit / rate_period if rate_limit else 0
+        self._burst = max(burst or rate_limit, 1)
+        self._time = time_func
+        self._worker = None
+        self._wakeup = asyncio.Event()
+        self._sent = 0
+        self._suppressed = 0
+        self._superseded = 0
+        self._rate_limited = 0
+        self._failed = 0
+
+    @property
+    def sent(self):
+        """Get the number of values commanded to an entity."""
+        return self._sent
+
+    @property
+    def suppressed(self):
+        """Get the number of values not sent because they were not changed enough."""
+        return self._suppressed
+
+    @property
+    def superseded(self):
+        """Get the number of commands replaced by a newer one before being sent."""
+        return self._superseded
+
+    @property
+    def rate_limited(self):
+        """Get the number of commands dropped while waiting for the rate limit."""
+        return self._rate_limited
+
+    @property
+    def failed(self):
+        """Get the number of commands given up after all their retries."""
+        return self._failed
+
+    @property
+    def values(self):
+        """Get the last value commanded to each entity, unless unknown or failed."""
+        return {driver.entity_id: driver.value for driver in self._drivers
+                if driver.value is not None}
+
+    def __bool__(self):
+        return bool(self._drivers)
+
+    @callback
+    def async_turn_on(self, hass: HomeAssistant):
+        self.invalidate()
+        self._async_post(hass, [(driver, driver.turn_on()) for driver in self._drivers])
+
+    @callback
+    def async_turn_off(self, hass: HomeAssistant):
+        self.invalidate()
+        self._async_post(hass, [(driver, driver.turn_off()) for driver in self._drivers])
+
+    @callback
+    def async_set_value(self, hass: HomeAssistant, value: float, force=False):
+        """Send a value to the entities which need it, all of them if forced.
+
+        Returns:
+            The value sent after quantization.
+        """
+        if self._resolution:
+            value = round(round(value / self._resolution) * self._resolution, 9)
+        now = self._time()
+        drivers = [driver for driver in self._drivers
+                   if force or self._needs_value(driver, value, now)]
+        self._suppressed += len(self._drivers) - len(drivers)
+        self._sent += len(drivers)
+        for driver in drivers:
+            driver.value = value
+            driver.value_time = now
+        self._async_post(hass, [(driver, driver.set_value(value)) for driver in drivers])
+        return value
+
+    def invalidate(self, entity_id=None):
+        """Forget the values commanded to an entity, or to all of them if not specified."""
+        for driver in self._drivers:
+            if entity_id is not None and driver.entity_id != entity_id:
+                continue
+            driver.value = None
+            driver.value_time = None
+
+    def _needs_value(self, driver, value, now):
+        if driver.value is None:
+            # Unless the same value is already waiting for a retry
+            return driver.pending != driver.set_value(value)
+        if value != driver.value and \
+                (value in self._limits or abs(value - driver.value) >= self._deadband):
+            return True
+        return bool(self._refresh) and now - driver.value_time >= self._refresh
+
+    @callback
+    def async_cancel(self):
+        """Stop sending the pending commands."""
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        for driver in self._drivers:
+            driver.pending = None
+
+    @callback
+    def _async_post(self, hass, commands):
+        for driver, command in commands:
+            if driver.pending is not None:
+                if driver.rate_limited:
+                    self._rate_limited += 1
+                else:
+                    self._superseded += 1
+            driver.pending = command
+            driver.attempts = 0
+            driver.retry_at = 0
+        if not commands:
+            return
+        if self._worker is None:
+            self._worker = hass.async_create_background_task(
+                self._async_work(hass), f"smart_thermostat actuators {self.entity_ids}")
+        else:
+            self._wakeup.set()
+
+    async def _async_work(self, hass):
+        try:
+            while True:
+                now = hass.loop.time()
+                pending = [driver for driver in self._drivers if driver.pending is not None]
+                if not pending:
+                    return
+                ready = []
+                wake_times = []
+                for driver in pending:
+                    if driver.retry_at > now:
+                        wake_times.append(driver.retry_at)
+                        continue
+                    token_delay = self._token_delay(driver, now)
+                    if token_delay > 0:
+                        driver.rate_limited = True
+                        wake_times.append(now + token_delay)
+                    else:
+                        ready.append(driver)
+                if not ready:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), min(wake_times) - now)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                for driver in ready:
+                    driver.rate_limited = False
+                    if self._rate:
+                        driver.tokens -= 1
+                await self._async_send(hass, ready)
+        finally:
+            if self._worker is asyncio.current_task():
+                self._worker = None
+
+    def _token_delay(self, driver, now):
+        """Refill the token bucket of an entity, return the time to wait for a token."""
+        if not self._rate:
+            return 0
+        if driver.tokens is None:
+            driver.tokens = self._burst
+        else:
+            driver.tokens = min(self._burst,
+                                driver.tokens + (now - driver.tokens_time) * self._rate)
+        driver.tokens_time = now
+        return 0 if driver.tokens >= 1 else (1 - driver.tokens) / self._rate
+
+    async def _async_send(self, hass, drivers):
+        batches = {}
+        for driver in drivers:
+            batches.setdefault(driver.pending, []).append(driver)
+            driver.pending = None
+        results = await asyncio.gather(*[
+            asyncio.wait_for(hass.services.async_call(
+                domain, service, {ATTR_ENTITY_ID: [driver.entity_id for driver in batch],
+                                  **dict(data)}, blocking=True), self._timeout)
+            for (domain, service, data), batch in batches.items()
+        ], return_exceptions=True)
+        for (command, batch), result in zip(batches.items(), results):
+            if not isinstance(result, Exception):
+                continue
+            for driver in batch:
+                if driver.pending is not None:
+                    continue  # Superseded by a newer command
+                # The device did not accept the value, never suppress it as unchanged
+                driver.value = None
+                driver.attempts += 1
+                if driver.attempts > self._retries:
+                    _LOGGER.error("Unable to send %s.%s to %s after %s attempts: %r",
+                                  command[0], command[1], driver.entity_id, driver.attempts,
+                                  result)
+                    self._failed += 1
+                    driver.attempts = 0
+                    continue
+                delay = min(RETRY_DELAY * 2 ** (driver.attempts - 1), RETRY_MAX_DELAY)
+                _LOGGER.warning("Failed to send %s.%s to %s, retrying in %s s: %r",
+                                command[0], command[1], driver.entity_id, delay, result)
+                driver.pending = command
+                driver.retry_at = hass.loop.time() + delay
@@ -0,0 +1,64 @@
+"""Aggregation of the temperature samples received between two control cycles."""
+import math
+
+
+class SampleAggregator:
+    """Aggregates the samples received during a window into a single sample.
+
+    Args:
+        method (str): How the values of a window are combined, one of `methods`: 'mean' and
+            'median' give the time at the center of the samples, 'last' the time of the last
+            sample.
+    """
+    methods = ('mean', 'median', 'last')
+
+    def __init__(self, method='mean'):
+        if method not in self.methods:
+            raise ValueError(f'method must be one of {self.methods}')
+        self._method = method
+        self._values = []
+        self._times = []
+
+    @property
+    def count(self):
+        """Get the number of samples of the current window."""
+        return len(self._times)
+
+    def add(self, value, timestamp):
+        """Add a sample to the current window.
+
+        Returns:
+            True if it is the first sample of the window.
+        """
+        if self._method == 'last':
+            self._values[:] = [value]
+        else:
+            self._values.append(value)
+        self._times.append(timestamp)
+        return len(self._times) == 1
+
+    def flush(self):
+        """Close the current window.
+
+        Returns:
+            The `(value, timestamp)` aggregate of the window, None if it has no sample.
+        """
+        if not self._times:
+            return None
+        if self._method == 'mean':
+            sample = (math.fsum(self._values) / len(self._values),
+                      math.fsum(self._times) / len(self._times))
+        elif self._method == 'median':
+            values = sorted(self._values)
+            middle = len(values) // 2
+            value = values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+            sample = (value, (self._times[0] + self._times[-1]) / 2)
+        else:
+            sample = (self._values[0], self._times[-1])
+        self.clear()
+        return sample
+
+    def clear(self):
+        """Drop the samples of the current window."""
+        self._values = []
+        self._times = []
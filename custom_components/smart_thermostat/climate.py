@@ -2,18 +2,17 @@
 For more details about this platform, please refer to the documentation at
 https://github.com/ScratMan/HASmartThermostat"""
 
-import asyncio
 import logging
-import time
+import math
 from abc import ABC
+from datetime import timedelta
 
 import voluptuous as vol
 
 from homeassistant.core import HomeAssistant
-from homeassistant.helpers import condition, entity_platform
+from homeassistant.helpers import condition, discovery, entity_platform
 from homeassistant.helpers.typing import ConfigType, DiscoveryInfoType
 from homeassistant.const import (
-    ATTR_ENTITY_ID,
     ATTR_TEMPERATURE,
     CONF_NAME,
     CONF_UNIQUE_ID,
@@ -21,30 +20,25 @@ from homeassistant.const import (
     PRECISION_HALVES,
     PRECISION_TENTHS,
     PRECISION_WHOLE,
-    SERVICE_TURN_OFF,
-    SERVICE_TURN_ON,
     STATE_ON,
     STATE_OFF,
+    STATE_UNAVAILABLE,
     STATE_UNKNOWN,
 )
-from homeassistant.components.number.const import (
-    ATTR_VALUE,
-    SERVICE_SET_VALUE,
-    DOMAIN as NUMBER_DOMAIN
-)
-from homeassistant.components.input_number import DOMAIN as INPUT_NUMBER_DOMAIN
-from homeassistant.components.light import (DOMAIN as LIGHT_DOMAIN, SERVICE_TURN_ON as SERVICE_TURN_LIGHT_ON,
-                                            ATTR_BRIGHTNESS_PCT)
-from homeassistant.components.valve import (DOMAIN as VALVE_DOMAIN, SERVICE_SET_VALVE_POSITION, ATTR_POSITION)
-from homeassistant.core import DOMAIN as HA_DOMAIN, CoreState, Event, EventStateChangedData, callback
+from homeassistant.components.sensor import DOMAIN as SENSOR_DOMAIN
+from homeassistant.core import CoreState, Event, EventStateChangedData, callback
+from homeassistant.core import ServiceResponse, SupportsResponse
+from homeassistant.exceptions import HomeAssistantError, ServiceValidationError
+import homeassistant.util.dt as dt_util
 from homeassistant.util import slugify
 import homeassistant.helpers.config_validation as cv
 from homeassistant.helpers.event import (
+    async_call_later,
     async_track_state_change_event,
-    async_track_time_interval,
 )
 from homeassistant.helpers.reload import async_setup_reload_service
 from homeassistant.helpers.restore_state import RestoreEntity
+from homeassistant.helpers.storage import Store
 
 from homeassistant.components.climate import PLATFORM_SCHEMA, ClimateEntity, ClimateEntityFeature
 from homeassistant.components.climate import (
@@ -64,6 +58,13 @@ from homeassistant.components.climate import (
 from . import DOMAIN, PLATFORMS
 from . import const
 from . import pid_controller
+from .actuator import ActuatorGroup, needs_refresh
+from .aggregator import SampleAggregator
+from .coordinator import PwmScheduler, SensorRegistry, TickCoordinator, pwm_edge
+from .mailbox import ControlMailbox
+from .pid_controller.history import HistoryAutotune
+from .publisher import StatePublisher
+from .sensor import DIAGNOSTIC_SENSORS
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -94,12 +95,43 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
         vol.Optional(const.CONF_MIN_OFF_CYCLE_DURATION_PID_OFF): vol.All(
             cv.time_period, cv.positive_timedelta),
         vol.Required(const.CONF_KEEP_ALIVE): vol.All(cv.time_period, cv.positive_timedelta),
+        vol.Optional(const.CONF_KEEP_ALIVE_REFRESH, default=const.DEFAULT_KEEP_ALIVE_REFRESH):
+            vol.All(cv.time_period, cv.positive_timedelta),
+        vol.Optional(const.CONF_PWM_STAGGER, default=False): cv.boolean,
+        vol.Optional(const.CONF_HEATER_POWER): vol.All(vol.Coerce(float), vol.Range(min=0)),
+        vol.Optional(const.CONF_MAX_ACTIVE_HEATERS): cv.positive_int,
+        vol.Optional(const.CONF_POWER_BUDGET): vol.All(vol.Coerce(float), vol.Range(min=0)),
         vol.Optional(const.CONF_SAMPLING_PERIOD, default=const.DEFAULT_SAMPLING_PERIOD): vol.All(
             cv.time_period, cv.positive_timedelta),
         vol.Optional(const.CONF_SENSOR_STALL, default=const.DEFAULT_SENSOR_STALL): vol.All(
             cv.time_period, cv.positive_timedelta),
+        vol.Optional(const.CONF_SENSOR_WINDOW, default=const.DEFAULT_SENSOR_WINDOW): vol.All(
+            cv.time_period, cv.positive_timedelta),
+        vol.Optional(const.CONF_SENSOR_AGGREGATION, default=const.DEFAULT_SENSOR_AGGREGATION):
+            vol.In(SampleAggregator.methods),
         vol.Optional(const.CONF_OUTPUT_SAFETY, default=const.DEFAULT_OUTPUT_SAFETY): vol.Coerce(
             float),
+        vol.Optional(const.CONF_MIN_PUBLISH_INTERVAL,
+                     default=const.DEFAULT_MIN_PUBLISH_INTERVAL): vol.All(
+            cv.time_period, cv.positive_timedelta),
+        vol.Optional(const.CONF_DIAGNOSTIC_SENSORS, default=False): cv.boolean,
+        vol.Optional(const.CONF_DIAGNOSTIC_SAMPLING_PERIOD,
+                     default=const.DEFAULT_DIAGNOSTIC_SAMPLING_PERIOD): vol.All(
+            cv.time_period, cv.positive_timedelta),
+        vol.Optional(const.CONF_ACTUATOR_TIMEOUT, default=const.DEFAULT_ACTUATOR_TIMEOUT): vol.All(
+            cv.time_period, cv.positive_timedelta),
+        vol.Optional(const.CONF_ACTUATOR_RETRIES, default=const.DEFAULT_ACTUATOR_RETRIES):
+            cv.positive_int,
+        vol.Optional(const.CONF_ACTUATOR_RATE_LIMIT, default=0): cv.positive_int,
+        vol.Optional(const.CONF_ACTUATOR_RATE_PERIOD, default=const.DEFAULT_ACTUATOR_RATE_PERIOD):
+            vol.All(cv.time_period, cv.positive_timedelta),
+        vol.Optional(const.CONF_ACTUATOR_BURST): cv.positive_int,
+        vol.Optional(const.CONF_VALVE_RESOLUTION, default=const.DEFAULT_VALVE_RESOLUTION): vol.All(
+            vol.Coerce(float), vol.Range(min=0)),
+        vol.Optional(const.CONF_VALVE_DEADBAND, default=const.DEFAULT_VALVE_DEADBAND): vol.All(
+            vol.Coerce(float), vol.Range(min=0)),
+        vol.Optional(const.CONF_VALVE_REFRESH, default=const.DEFAULT_VALVE_REFRESH): vol.All(
+            cv.time_period, cv.positive_timedelta),
         vol.Optional(const.CONF_INITIAL_HVAC_MODE): vol.In(
             [HVACMode.COOL, HVACMode.HEAT, HVACMode.OFF]
         ),
@@ -141,6 +173,16 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
 )
 
 
+def _check_power_budget(config):
+    """Reject a power budget which could not count the power of the heater."""
+    if const.CONF_POWER_BUDGET in config and const.CONF_HEATER_POWER not in config:
+        raise vol.Invalid(f"{const.CONF_POWER_BUDGET} requires {const.CONF_HEATER_POWER}")
+    return config
+
+
+PLATFORM_SCHEMA = vol.All(PLATFORM_SCHEMA, _check_power_budget)
+
+
 async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Set up the generic thermostat platform."""
     await async_setup_reload_service(hass, DOMAIN, PLATFORMS)
@@ -168,9 +210,27 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info=
         'min_cycle_duration_pid_off': config.get(const.CONF_MIN_CYCLE_DURATION_PID_OFF),
         'min_off_cycle_duration_pid_off': config.get(const.CONF_MIN_OFF_CYCLE_DURATION_PID_OFF),
         'keep_alive': config.get(const.CONF_KEEP_ALIVE),
+        'keep_alive_refresh': config.get(const.CONF_KEEP_ALIVE_REFRESH),
+        'pwm_stagger': config.get(const.CONF_PWM_STAGGER),
+        'heater_power': config.get(const.CONF_HEATER_POWER),
+        'max_active_heaters': config.get(const.CONF_MAX_ACTIVE_HEATERS),
+        'power_budget': config.get(const.CONF_POWER_BUDGET),
         'sampling_period': config.get(const.CONF_SAMPLING_PERIOD),
         'sensor_stall': config.get(const.CONF_SENSOR_STALL),
+        'sensor_window': config.get(const.CONF_SENSOR_WINDOW),
+        'sensor_aggregation': config.get(const.CONF_SENSOR_AGGREGATION),
         'output_safety': config.get(const.CONF_OUTPUT_SAFETY),
+        'min_publish_interval': config.get(const.CONF_MIN_PUBLISH_INTERVAL),
+        'diagnostic_sensors': config.get(const.CONF_DIAGNOSTIC_SENSORS),
+        'diagnostic_sampling_period': config.get(const.CONF_DIAGNOSTIC_SAMPLING_PERIOD),
+        'actuator_timeout': config.get(const.CONF_ACTUATOR_TIMEOUT),
+        'actuator_retries': config.get(const.CONF_ACTUATOR_RETRIES),
+        'actuator_rate_limit': config.get(const.CONF_ACTUATOR_RATE_LIMIT),
+        'actuator_rate_period': config.get(const.CONF_ACTUATOR_RATE_PERIOD),
+        'actuator_burst': config.get(const.CONF_ACTUATOR_BURST),
+        'valve_resolution': config.get(const.CONF_VALVE_RESOLUTION),
+        'valve_deadband': config.get(const.CONF_VALVE_DEADBAND),
+        'valve_refresh': config.get(const.CONF_VALVE_REFRESH),
         'initial_hvac_mode': config.get(const.CONF_INITIAL_HVAC_MODE),
         'preset_sync_mode': config.get(const.CONF_PRESET_SYNC_MODE),
         'away_temp': config.get(const.CONF_AWAY_TEMP),
@@ -200,7 +260,10 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info=
         const.CONF_DEBUG: config.get(const.CONF_DEBUG),
     }
 
-    smart_thermostat = SmartThermostat(**parameters)
+    if parameters['diagnostic_sensors']:
+        smart_thermostat = DiagnosedSmartThermostat(**parameters)
+    else:
+        smart_thermostat = SmartThermostat(**parameters)
     async_add_entities([smart_thermostat])
 
     platform.async_register_entity_service(  # type: ignore
@@ -245,6 +308,14 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info=
         {},
         "clear_integral",
     )
+    platform.async_register_entity_service(  # type: ignore
+        "autotune_from_history",
+        {
+            vol.Optional("duration", default=timedelta(days=7)): cv.positive_time_period,
+        },
+        "async_autotune_from_history",
+        supports_response=SupportsResponse.ONLY,
+    )
 
 
 class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
@@ -264,15 +335,27 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
         self._ac_mode = kwargs.get('ac_mode', False)
         self._force_off_state = kwargs.get('force_off_state', True)
         self._keep_alive = kwargs.get('keep_alive')
+        self._keep_alive_refresh = kwargs.get('keep_alive_refresh', timedelta()).total_seconds()
+        self._last_toggle_time = None
         self._sampling_period = kwargs.get('sampling_period').seconds
         self._sensor_stall = kwargs.get('sensor_stall').seconds
+        self._sensor_window = kwargs.get('sensor_window', timedelta()).total_seconds()
+        self._sensor_aggregator = None
+        if self._sensor_window:
+            self._sensor_aggregator = SampleAggregator(
+                kwargs.get('sensor_aggregation', const.DEFAULT_SENSOR_AGGREGATION))
+        self._unsub_sensor_window = None
         self._output_safety = kwargs.get('output_safety')
+        self._min_publish_interval = kwargs.get('min_publish_interval').total_seconds()
+        self._diagnostic_sensors_enabled = kwargs.get('diagnostic_sensors')
+        self._diagnostic_sampling_period = kwargs.get('diagnostic_sampling_period')
         self._hvac_mode = kwargs.get('initial_hvac_mode', None)
         self._saved_target_temp = kwargs.get('target_temp', None) or kwargs.get('away_temp', None)
         self._temp_precision = kwargs.get('precision')
         self._target_temperature_step = kwargs.get('target_temp_step')
         self._debug = kwargs.get(const.CONF_DEBUG)
-        self._last_heat_cycle_time = time.time()
+        self._clock = kwargs.get('time_func') or pid_controller.default_clock
+        self._last_heat_cycle_time = self._clock()
         self._min_on_cycle_duration_pid_on = kwargs.get('min_cycle_duration')
         self._min_off_cycle_duration_pid_on = kwargs.get('min_off_cycle_duration')
         self._min_on_cycle_duration_pid_off = kwargs.get('min_cycle_duration_pid_off')
@@ -290,7 +373,9 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
         self._previous_temp = None
         self._previous_temp_time = None
         self._ext_temp = None
-        self._temp_lock = asyncio.Lock()
+        self._ext_temp_applied = None
+        self._control_mailbox = ControlMailbox(self._async_run_control_cycle)
+        self._debug_counters = None
         self._min_temp = kwargs.get('min_temp')
         self._max_temp = kwargs.get('max_temp')
         self._target_temp = kwargs.get('target_temp')
@@ -320,6 +405,20 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
         self._output_precision = kwargs.get('output_precision')
         self._output_min = kwargs.get('output_min')
         self._output_max = kwargs.get('output_max')
+        actuator_settings = {
+            'timeout': kwargs.get('actuator_timeout', timedelta(seconds=10)).total_seconds(),
+            'retries': kwargs.get('actuator_retries', 3),
+            'rate_limit': kwargs.get('actuator_rate_limit', 0),
+            'rate_period': kwargs.get('actuator_rate_period', timedelta(minutes=10)).total_seconds(),
+            'burst': kwargs.get('actuator_burst'),
+            'resolution': kwargs.get('valve_resolution', 0),
+            'deadband': kwargs.get('valve_deadband', 0),
+            'refresh': kwargs.get('valve_refresh', timedelta()).total_seconds(),
+            'limits': (self._output_min, self._output_max),
+            'time_func': self._clock,
+        }
+        self._heater_actuators = ActuatorGroup(self._heater_entity_id, **actuator_settings)
+        self._cooler_actuators = ActuatorGroup(self._cooler_entity_id, **actuator_settings)
         self._output_clamp_low = kwargs.get('output_clamp_low')
         self._output_clamp_high = kwargs.get('output_clamp_high')
         self._difference = self._output_max - self._output_min
@@ -336,6 +435,14 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
         self._kd = kwargs.get('kd')
         self._ke = kwargs.get('ke')
         self._pwm = kwargs.get('pwm').seconds
+        self._pwm_stagger = kwargs.get('pwm_stagger', False) and self._pwm > 0
+        self._heater_power = kwargs.get('heater_power')
+        self._max_active_heaters = kwargs.get('max_active_heaters')
+        self._power_budget = kwargs.get('power_budget')
+        self._pwm_scheduler = None
+        self._pwm_on_since = None
+        self._pwm_on_cycles = 0
+        self._pwm_served_cycle = None
         self._p = self._i = self._d = self._e = self._dt = 0
         self._control_output = self._output_min
         self._force_on = False
@@ -357,13 +464,19 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
         self._cold_tolerance = abs(kwargs.get('cold_tolerance'))
         self._hot_tolerance = abs(kwargs.get('hot_tolerance'))
         self._time_changed = 0
-        self._last_sensor_update = time.time()
-        self._last_ext_sensor_update = time.time()
+        self._unsub_pwm_edge = None
+        self._store = None
+        self._actuator_states = {}
+        self._presets_cache = None
+        self._attributes_cache = None
+        self._publisher = None
+        self._pid_restored = False
+        self._warm_restart = False
+        self._last_sensor_update = self._clock()
+        self._last_ext_sensor_update = self._clock()
         if self._autotune != "none":
             self._pid_controller = None
-            self._pid_autotune = pid_controller.PIDAutotune(self._difference, self._lookback,
-                                                            self._min_out, self._max_out,
-                                                            self._noiseband, time.time)
+            self._pid_autotune = self._create_autotune()
             _LOGGER.warning("%s: Autotune will run with the target temperature "
                             "set after 10 temperature samples from sensor. Changes submitted "
                             "after doesn't have any effect until autotuning is finished",
@@ -374,13 +487,23 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
             self._pid_controller = pid_controller.PID(self._kp, self._ki, self._kd, self._ke,
                                                       self._min_out, self._max_out,
                                                       self._sampling_period, self._cold_tolerance,
-                                                      self._hot_tolerance)
+                                                      self._hot_tolerance, self._clock)
             self._pid_controller.mode = "AUTO"
 
+    def _create_autotune(self):
+        return pid_controller.PIDAutotune(self._difference, self._lookback, self._min_out,
+                                          self._max_out, self._noiseband, self._clock)
+
     async def async_added_to_hass(self):
         """Run when entity about to be added."""
         await super().async_added_to_hass()
 
+        self._publisher = StatePublisher(self.hass, self.async_write_ha_state,
+                                         self._min_publish_interval, self._clock)
+        self.async_on_remove(self._publisher.cancel)
+        self._store = Store(self.hass, const.STORAGE_VERSION, f"{DOMAIN}.{self._unique_id}")
+        await self._async_restore_storage()
+
         # Add listener
         self.async_on_remove(
             async_track_state_change_event(
@@ -388,11 +511,11 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
                 self._sensor_entity_id,
                 self._async_sensor_changed))
         if self._ext_sensor_entity_id is not None:
+            # The outdoor sensor is usually shared by all the thermostats
             self.async_on_remove(
-                async_track_state_change_event(
-                    self.hass,
+                SensorRegistry.async_get(self.hass).async_subscribe(
                     self._ext_sensor_entity_id,
-                    self._async_ext_sensor_changed))
+                    self._async_ext_temperature_changed))
         self.async_on_remove(
             async_track_state_change_event(
                 self.hass,
@@ -404,12 +527,34 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
                     self.hass,
                     self._cooler_entity_id,
                     self._async_switch_changed))
+        coordinator = TickCoordinator.async_get(self.hass)
+        thermostats = self.hass.data.setdefault(DOMAIN, {}).setdefault(
+            const.DATA_THERMOSTATS, {})
+        thermostats[self.entity_id] = self
+        self.async_on_remove(lambda: thermostats.pop(self.entity_id, None))
+        if self._diagnostic_sensors_enabled:
+            self.hass.async_create_task(discovery.async_load_platform(
+                self.hass, SENSOR_DOMAIN, DOMAIN, {
+                    'entity_id': self.entity_id,
+                    'debug': self._debug,
+                    'sampling_period': self._diagnostic_sampling_period.total_seconds(),
+                }, {}))
+        self.async_on_remove(self._async_cancel_pwm_edge)
+        self.async_on_remove(self._heater_actuators.async_cancel)
+        self.async_on_remove(self._cooler_actuators.async_cancel)
+        self.async_on_remove(self._async_cancel_sensor_window)
+        if self._pwm_stagger:
+            self._pwm_scheduler = PwmScheduler.async_get(self.hass)
+            self.async_on_remove(
+                self._pwm_scheduler.async_register(
+                    self.entity_id, self._pwm, self._heater_power,
+                    self._max_active_heaters, self._power_budget))
         if self._keep_alive:
+            # The ticks are shared with the other thermostats using the same interval
             self.async_on_remove(
-                async_track_time_interval(
-                    self.hass,
-                    self._async_control_heating,
-                    self._keep_alive))
+                coordinator.async_register(
+                    self._keep_alive.total_seconds(),
+                    self._async_control_heating))
 
         @callback
         def _async_startup(*_):
@@ -445,41 +590,13 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
                                 'sleep_temp', 'activity_temp']:
                 if old_state.attributes.get(preset_mode) is not None:
                     setattr(self, f"_{preset_mode}", float(old_state.attributes.get(preset_mode)))
+                    self._async_invalidate_presets()
             if old_state.attributes.get(ATTR_PRESET_MODE) is not None:
                 self._attr_preset_mode = old_state.attributes.get(ATTR_PRESET_MODE)
-            if isinstance(old_state.attributes.get('pid_i'), (float, int)) and \
-                    self._pid_controller is not None:
-                self._i = float(old_state.attributes.get('pid_i'))
-                self._pid_controller.integral = self._i
             if not self._hvac_mode and old_state.state:
                 self.set_hvac_mode(old_state.state)
-            if old_state.attributes.get('kp') is not None and self._pid_controller is not None:
-                self._kp = float(old_state.attributes.get('kp'))
-                self._pid_controller.set_pid_param(kp=self._kp)
-            elif old_state.attributes.get('Kp') is not None and self._pid_controller is not None:
-                self._kp = float(old_state.attributes.get('Kp'))
-                self._pid_controller.set_pid_param(kp=self._kp)
-            if old_state.attributes.get('ki') is not None and self._pid_controller is not None:
-                self._ki = float(old_state.attributes.get('ki'))
-                self._pid_controller.set_pid_param(ki=self._ki)
-            elif old_state.attributes.get('Ki') is not None and self._pid_controller is not None:
-                self._ki = float(old_state.attributes.get('Ki'))
-                self._pid_controller.set_pid_param(ki=self._ki)
-            if old_state.attributes.get('kd') is not None and self._pid_controller is not None:
-                self._kd = float(old_state.attributes.get('kd'))
-                self._pid_controller.set_pid_param(kd=self._kd)
-            elif old_state.attributes.get('Kd') is not None and self._pid_controller is not None:
-                self._kd = float(old_state.attributes.get('Kd'))
-                self._pid_controller.set_pid_param(kd=self._kd)
-            if old_state.attributes.get('ke') is not None and self._pid_controller is not None:
-                self._ke = float(old_state.attributes.get('ke'))
-                self._pid_controller.set_pid_param(ke=self._ke)
-            elif old_state.attributes.get('Ke') is not None and self._pid_controller is not None:
-                self._ke = float(old_state.attributes.get('Ke'))
-                self._pid_controller.set_pid_param(ke=self._ke)
-            if old_state.attributes.get('pid_mode') is not None and \
-                    self._pid_controller is not None:
-                self._pid_controller.mode = old_state.attributes.get('pid_mode')
+            if not self._pid_restored and self._pid_controller is not None:
+                self._restore_pid_from_attributes(old_state)
 
         else:
             # No previous state, try and restore defaults
@@ -494,7 +611,108 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
         # Set default state to off
         if not self._hvac_mode:
             self._hvac_mode = HVACMode.OFF
-        await self._async_control_heating(calc_pid=True)
+        self._async_invalidate_attributes()
+        # After a warm restart, resume actuation at the restored output until the next sensor
+        # update instead of computing it from an incomplete state
+        await self._async_control_heating(calc_pid=not self._warm_restart)
+
+    @callback
+    def _restore_pid_from_attributes(self, old_state):
+        """Restore PID gains, integral and mode from the attributes of the previous state."""
+        if isinstance(old_state.attributes.get('pid_i'), (float, int)):
+            self._i = float(old_state.attributes.get('pid_i'))
+            self._pid_controller.integral = self._i
+        if old_state.attributes.get('kp') is not None:
+            self._kp = float(old_state.attributes.get('kp'))
+            self._pid_controller.set_pid_param(kp=self._kp)
+        elif old_state.attributes.get('Kp') is not None:
+            self._kp = float(old_state.attributes.get('Kp'))
+            self._pid_controller.set_pid_param(kp=self._kp)
+        if old_state.attributes.get('ki') is not None:
+            self._ki = float(old_state.attributes.get('ki'))
+            self._pid_controller.set_pid_param(ki=self._ki)
+        elif old_state.attributes.get('Ki') is not None:
+            self._ki = float(old_state.attributes.get('Ki'))
+            self._pid_controller.set_pid_param(ki=self._ki)
+        if old_state.attributes.get('kd') is not None:
+            self._kd = float(old_state.attributes.get('kd'))
+            self._pid_controller.set_pid_param(kd=self._kd)
+        elif old_state.attributes.get('Kd') is not None:
+            self._kd = float(old_state.attributes.get('Kd'))
+            self._pid_controller.set_pid_param(kd=self._kd)
+        if old_state.attributes.get('ke') is not None:
+            self._ke = float(old_state.attributes.get('ke'))
+            self._pid_controller.set_pid_param(ke=self._ke)
+        elif old_state.attributes.get('Ke') is not None:
+            self._ke = float(old_state.attributes.get('Ke'))
+            self._pid_controller.set_pid_param(ke=self._ke)
+        if old_state.attributes.get('pid_mode') is not None:
+            self._pid_controller.mode = old_state.attributes.get('pid_mode')
+
+    async def async_will_remove_from_hass(self):
+        """Save the controller state before the entity is removed."""
+        await super().async_will_remove_from_hass()
+        if self._store is not None:
+            await self._store.async_save(self._storage_data())
+
+    async def _async_restore_storage(self):
+        """Restore the controller state saved in the storage of the entity."""
+        data = await self._store.async_load() or {}
+        snapshot = data.get('autotune')
+        if snapshot is not None and self._autotune != "none":
+            try:
+                self._pid_autotune.restore(snapshot)
+            except ValueError as ex:
+                _LOGGER.warning("%s: Unable to resume autotune, restarting it: %s",
+                                self.unique_id, ex)
+                self._pid_autotune = self._create_autotune()
+                return
+            last_timestamp = self._pid_autotune.last_timestamp
+            if last_timestamp is not None and self._clock() - last_timestamp > self._lookback:
+                _LOGGER.warning("%s: Autotune checkpoint is older than the lookback period, "
+                                "restarting autotune", self.unique_id)
+                self._pid_autotune = self._create_autotune()
+                return
+            _LOGGER.warning("%s: Resuming autotune in state %s with %s peaks found",
+                            self.unique_id, self._pid_autotune.state,
+                            self._pid_autotune.peak_count)
+        snapshot = data.get('pid')
+        if snapshot is not None and self._pid_controller is not None:
+            fresh = pid_controller.PID.has_fresh_samples(snapshot, self._clock(),
+                                                         const.PID_RESTORE_MAX_AGE)
+            try:
+                self._pid_controller.restore(snapshot, samples=fresh)
+            except ValueError as ex:
+                _LOGGER.warning("%s: Unable to restore PID controller state: %s",
+                                self.unique_id, ex)
+                return
+            self._pid_restored = True
+            self._kp, self._ki, self._kd, self._ke = (snapshot['kp'], snapshot['ki'],
+                                                      snapshot['kd'], snapshot['ke'])
+            self._i = round(self._pid_controller.integral, 1)
+            if fresh:
+                # Resume from the last sample so the first cycle has a valid dt and derivative
+                self._warm_restart = True
+                self._previous_temp_time = self._cur_temp_time = snapshot['input_time']
+                if self._current_temp is None:
+                    self._current_temp = snapshot.get('input')
+                self._control_output = data.get('control_output', self._control_output)
+
+    @callback
+    def _storage_data(self):
+        """Return the controller state to save in the storage of the entity."""
+        data = {}
+        if self._autotune != "none":
+            data['autotune'] = self._pid_autotune.snapshot()
+        elif self._pid_controller is not None:
+            data['pid'] = self._pid_controller.snapshot()
+            data['control_output'] = self._control_output
+        return data
+
+    @callback
+    def _async_schedule_storage_save(self):
+        if self._store is not None:
+            self._store.async_delay_save(self._storage_data, const.STORAGE_SAVE_DELAY)
 
     @property
     def should_poll(self):
@@ -511,10 +729,6 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
         """Return a unique ID."""
         return self._unique_id
 
-    @staticmethod
-    def _get_number_entity_domain(entity_id):
-        return INPUT_NUMBER_DOMAIN if "input_number" in entity_id else NUMBER_DOMAIN
-
     @property
     def precision(self):
         """Return the precision of the system."""
@@ -568,46 +782,55 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
     @property
     def preset_modes(self):
         """Return a list of available preset modes."""
-        preset_modes = [PRESET_NONE]
-        for mode, preset_mode_temp in self._preset_modes_temp.items():
-            if preset_mode_temp is not None:
-                preset_modes.append(mode)
-        return preset_modes
+        return self._preset_views['preset_modes']
 
     @property
     def _preset_modes_temp(self):
         """Return a list of preset modes and their temperatures"""
-        return {
-            PRESET_AWAY: self._away_temp,
-            PRESET_ECO: self._eco_temp,
-            PRESET_BOOST: self._boost_temp,
-            PRESET_COMFORT: self._comfort_temp,
-            PRESET_HOME: self._home_temp,
-            PRESET_SLEEP: self._sleep_temp,
-            PRESET_ACTIVITY: self._activity_temp,
-        }
+        return self._preset_views['modes_temp']
 
     @property
     def _preset_temp_modes(self):
         """Return a list of preset temperature and their modes"""
-        return {
-            self._away_temp: PRESET_AWAY,
-            self._eco_temp: PRESET_ECO,
-            self._boost_temp: PRESET_BOOST,
-            self._comfort_temp: PRESET_COMFORT,
-            self._home_temp: PRESET_HOME,
-            self._sleep_temp: PRESET_SLEEP,
-            self._activity_temp: PRESET_ACTIVITY,
-        }
+        return self._preset_views['temp_modes']
 
     @property
     def presets(self):
         """Return a dict of available preset and temperatures."""
-        presets = {}
-        for mode, preset_mode_temp in self._preset_modes_temp.items():
-            if preset_mode_temp is not None:
-                presets.update({mode: preset_mode_temp})
-        return presets
+        return self._preset_views['presets']
+
+    @property
+    def _preset_views(self):
+        """Return the views of the preset temperatures, built once until a preset changes."""
+        if self._presets_cache is None:
+            modes_temp = {
+                PRESET_AWAY: self._away_temp,
+                PRESET_ECO: self._eco_temp,
+                PRESET_BOOST: self._boost_temp,
+                PRESET_COMFORT: self._comfort_temp,
+                PRESET_HOME: self._home_temp,
+                PRESET_SLEEP: self._sleep_temp,
+                PRESET_ACTIVITY: self._activity_temp,
+            }
+            presets = {mode: temp for mode, temp in modes_temp.items() if temp is not None}
+            self._presets_cache = {
+                'modes_temp': modes_temp,
+                'temp_modes': {temp: mode for mode, temp in modes_temp.items()},
+                'presets': presets,
+                'preset_modes': [PRESET_NONE, *presets],
+            }
+        return self._presets_cache
+
+    @callback
+    def _async_invalidate_presets(self):
+        """Clear the cached preset views, to call when a preset temperature changes."""
+        self._presets_cache = None
+        self._attributes_cache = None
+
+    @callback
+    def _async_invalidate_attributes(self):
+        """Clear the cached state attributes, to call when one of their values changes."""
+        self._attributes_cache = None
 
     @property
     def _min_on_cycle_duration(self):
@@ -661,6 +884,8 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
     @property
     def extra_state_attributes(self):
         """attributes to include in entity"""
+        if self._attributes_cache is not None:
+            return self._attributes_cache
         device_state_attributes = {
             'away_temp': self._away_temp,
             'eco_temp': self._eco_temp,
@@ -683,6 +908,9 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
                 "pid_d": 0 if self._autotune != "none" else self.pid_control_d,
                 "pid_e": 0 if self._autotune != "none" else self.pid_control_e,
                 "pid_dt": 0 if self._autotune != "none" else self._dt,
+                "control_coalesced": self._control_mailbox.coalesced,
+                "actuator_rate_limited": self._heater_actuators.rate_limited +
+                self._cooler_actuators.rate_limited,
             })
 
         if self._autotune != "none":
@@ -695,6 +923,7 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
                 "autotune_buffer_full": round(self._pid_autotune.buffer_full, 2),
                 "autotune_buffer_length": self._pid_autotune.buffer_length,
             })
+        self._attributes_cache = device_state_attributes
         return device_state_attributes
 
     def set_hvac_mode(self, hvac_mode: (HVACMode, str)) -> None:
@@ -714,6 +943,7 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
         elif hvac_mode == HVACMode.OFF:
             self._hvac_mode = HVACMode.OFF
             self._control_output = self._output_min
+            self._async_invalidate_attributes()
             self._previous_temp = None
             self._previous_temp_time = None
             if self._pid_controller is not None:
@@ -740,6 +970,7 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
         elif hvac_mode == HVACMode.OFF:
             self._hvac_mode = HVACMode.OFF
             self._control_output = self._output_min
+            self._async_invalidate_attributes()
             if self._pwm:
                 _LOGGER.debug("%s: Turn OFF heater from async_set_hvac_mode(%s)",
                               self.entity_id,
@@ -750,7 +981,7 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
                               self.entity_id,
                               self._control_output,
                               hvac_mode)
-                await self._async_set_valve_value(self._control_output)
+                await self._async_set_valve_value(self._control_output, force=True)
             # Clear the samples to avoid integrating the off period
             self._previous_temp = None
             self._previous_temp_time = None
@@ -762,10 +993,11 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
         if self._pid_controller:
             self._pid_controller.out_max = self._max_out
             self._pid_controller.out_min = self._min_out
-        if self._hvac_mode != HVACMode.OFF:
-            await self._async_control_heating(calc_pid=True)
-        # Ensure we update the current operation after changing the mode
-        self.async_write_ha_state()
+        with self._publisher.cycle():
+            if self._hvac_mode != HVACMode.OFF:
+                await self._async_control_heating(calc_pid=True)
+            # Ensure we update the current operation after changing the mode
+            self._publisher.publish()
 
     async def async_set_temperature(self, **kwargs):
         """Set new target temperature."""
@@ -776,13 +1008,14 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
             self._force_on = True
         elif self._current_temp is not None and temperature < self._current_temp:
             self._force_off = True
-        if temperature in self._preset_temp_modes and self._preset_sync_mode == 'sync':
-            await self.async_set_preset_mode(self._preset_temp_modes[temperature])
-        else:
-            await self.async_set_preset_mode(PRESET_NONE)
-            self._target_temp = temperature
-        await self._async_control_heating(calc_pid=True)
-        self.async_write_ha_state()
+        with self._publisher.cycle():
+            if temperature in self._preset_temp_modes and self._preset_sync_mode == 'sync':
+                await self.async_set_preset_mode(self._preset_temp_modes[temperature])
+            else:
+                await self.async_set_preset_mode(PRESET_NONE)
+                self._target_temp = temperature
+            await self._async_control_heating(calc_pid=True)
+            self._publisher.publish()
 
     async def async_set_pid(self, **kwargs):
         """Set PID parameters."""
@@ -790,6 +1023,8 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
             if gain is not None:
                 setattr(self, f'_{pid_kx}', float(gain))
         self._pid_controller.set_pid_param(self._kp, self._ki, self._kd, self._ke)
+        self._async_invalidate_attributes()
+        self._async_schedule_storage_save()
         await self._async_control_heating(calc_pid=True)
 
     async def async_set_pid_mode(self, **kwargs):
@@ -797,6 +1032,8 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
         mode = kwargs.get('mode', None)
         if str(mode).upper() in ['AUTO', 'OFF'] and self._pid_controller is not None:
             self._pid_controller.mode = str(mode).upper()
+            self._async_invalidate_attributes()
+            self._async_schedule_storage_save()
         await self._async_control_heating(calc_pid=True)
 
     async def async_set_preset_temp(self, **kwargs):
@@ -810,13 +1047,49 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
                 f'_{preset_name.replace('_disable', '')}',
                 value
             )
+        self._async_invalidate_presets()
         await self._async_control_heating(calc_pid=True)
 
+    async def async_autotune_from_history(self, **kwargs) -> ServiceResponse:
+        """Compute the PID gains of each tuning rule from the recorded heater cycles."""
+        if not self._pwm:
+            raise ServiceValidationError(
+                f"{self.entity_id}: autotune from history requires an on/off heater (pwm)")
+        if "recorder" not in self.hass.config.components:
+            raise ServiceValidationError(
+                f"{self.entity_id}: autotune from history requires the recorder")
+        # Only imported when used, the recorder being an optional dependency
+        from homeassistant.components.recorder import get_instance as get_recorder_instance
+        from .history import recorded_samples
+
+        end = dt_util.utcnow()
+        start = end - kwargs['duration']
+        tuner = HistoryAutotune(self._difference, 2 * self._lookback, self._noiseband)
+        samples = recorded_samples(self.hass, self._sensor_entity_id,
+                                   self.heater_or_cooler_entity, start, end,
+                                   self._heater_polarity_invert)
+        if not await get_recorder_instance(self.hass).async_add_executor_job(tuner.feed,
+                                                                               samples):
+            raise HomeAssistantError(
+                f"{self.entity_id}: only {tuner.cycle_count} heating cycles found in the "
+                f"history ({tuner.discarded} discarded), at least 3 are needed")
+        _LOGGER.info("%s: Autotune from history found %s cycles: Ku=%s, Pu=%s",
+                     self.entity_id, tuner.cycle_count, tuner.Ku, tuner.Pu)
+        return {
+            'cycles': tuner.cycle_count,
+            'ku': tuner.Ku,
+            'pu': tuner.Pu,
+            'rules': {rule: tuner.get_pid_parameters(rule)._asdict()
+                      for rule in tuner.tuning_rules},
+        }
+
     async def clear_integral(self, **kwargs):
         """Clear the integral value."""
         self._pid_controller.integral = 0.0
         self._i = self._pid_controller.integral
-        self.async_write_ha_state()
+        self._async_invalidate_attributes()
+        self._async_schedule_storage_save()
+        self._publisher.publish()
 
     @property
     def min_temp(self):
@@ -843,25 +1116,67 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
         if new_state is None:
             return
 
+        if self._sensor_aggregator is not None:
+            # Feed the controller with one sample per window
+            try:
+                temperature = float(new_state.state)
+            except ValueError as ex:
+                _LOGGER.debug("%s: Unable to update from sensor %s: %s", self.entity_id,
+                              self._sensor_entity_id, ex)
+                return
+            # The sensor is alive even if the controller only gets the aggregate
+            self._last_sensor_update = self._clock()
+            if self._sensor_aggregator.add(temperature, self._clock()):
+                self._unsub_sensor_window = async_call_later(
+                    self.hass, self._sensor_window, self._async_sensor_window_closed)
+            return
+
         self._previous_temp_time = self._cur_temp_time
-        self._cur_temp_time = time.time()
+        self._cur_temp_time = self._clock()
         self._async_update_temp(new_state)
+        await self._async_temperature_received()
+
+    async def _async_sensor_window_closed(self, _now):
+        """Feed the controller with the aggregate of the temperatures of the window."""
+        self._unsub_sensor_window = None
+        sample = self._sensor_aggregator.flush()
+        if sample is None:
+            return
+        self._previous_temp = self._current_temp
+        self._current_temp, timestamp = sample
+        self._previous_temp_time = self._cur_temp_time
+        self._cur_temp_time = timestamp
+        await self._async_temperature_received()
+
+    @callback
+    def _async_cancel_sensor_window(self):
+        if self._unsub_sensor_window is not None:
+            self._unsub_sensor_window()
+            self._unsub_sensor_window = None
+
+    async def _async_temperature_received(self):
         self._trigger_source = 'sensor'
         _LOGGER.debug("%s: Received new temperature: %s", self.entity_id, self._current_temp)
-        await self._async_control_heating(calc_pid=True)
-        self.async_write_ha_state()
+        with self._publisher.cycle():
+            await self._async_control_heating(calc_pid=True)
+            self._publisher.publish()
 
     @callback
-    async def _async_ext_sensor_changed(self, event: Event[EventStateChangedData]):
-        """Handle temperature changes."""
-        new_state = event.data["new_state"]
-        if new_state is None:
-            return
+    def _async_ext_temperature_changed(self, temperature):
+        """Handle outdoor temperature changes.
 
-        self._async_update_ext_temp(new_state)
+        A control cycle is only run when the change moves the outdoor compensation of the
+        output by at least the output precision.
+        """
+        self._ext_temp = temperature
+        self._last_ext_sensor_update = self._clock()
+        if pid_controller.PID.is_ext_change_negligible(self._ke, temperature,
+                                                       self._ext_temp_applied,
+                                                       self._output_precision):
+            return
         self._trigger_source = 'ext_sensor'
         _LOGGER.debug("%s: Received new external temperature: %s", self.entity_id, self._ext_temp)
-        await self._async_control_heating(calc_pid=False)
+        self.hass.async_create_task(self._async_control_heating(calc_pid=False))
 
     @callback
     def _async_switch_changed(self, event: Event[EventStateChangedData]):
@@ -869,7 +1184,12 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
         new_state = event.data["new_state"]
         if new_state is None:
             return
-        self.async_write_ha_state()
+        self._actuator_states[event.data["entity_id"]] = self._is_actuator_active(new_state)
+        if new_state.state in (STATE_UNAVAILABLE, STATE_UNKNOWN):
+            # Send the next value again once the actuator is back
+            self._heater_actuators.invalidate(event.data["entity_id"])
+            self._cooler_actuators.invalidate(event.data["entity_id"])
+        self._publisher.publish()
 
     @callback
     def _async_update_temp(self, state):
@@ -877,7 +1197,7 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
         try:
             self._previous_temp = self._current_temp
             self._current_temp = float(state.state)
-            self._last_sensor_update = time.time()
+            self._last_sensor_update = self._clock()
         except ValueError as ex:
             _LOGGER.debug("%s: Unable to update from sensor %s: %s", self.entity_id,
                           self._sensor_entity_id, ex)
@@ -887,21 +1207,34 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
         """Update thermostat with latest state from sensor."""
         try:
             self._ext_temp = float(state.state)
-            self._last_ext_sensor_update = time.time()
+            self._last_ext_sensor_update = self._clock()
         except ValueError as ex:
             _LOGGER.debug("%s: Unable to update from sensor %s: %s", self.entity_id,
                           self._ext_sensor_entity_id, ex)
 
     async def _async_control_heating(
             self, time_func: object = None, calc_pid: object = False) -> object:
-        """Run PID controller, optional autotune for faster integration"""
-        async with self._temp_lock:
+        """Run PID controller, optional autotune for faster integration
+
+        The triggers received while a cycle is running are merged into one follow-up cycle.
+        """
+        await self._control_mailbox.async_post(calc_pid)
+
+    async def _async_run_control_cycle(self, calc_pid):
+        if self._debug:
+            counters = (self._control_mailbox.coalesced, self._heater_actuators.rate_limited,
+                        self._cooler_actuators.rate_limited)
+            if counters != self._debug_counters:
+                self._debug_counters = counters
+                self._async_invalidate_attributes()
+        with self._publisher.cycle():
             if not self._active and None not in (self._current_temp, self._target_temp):
                 self._active = True
                 _LOGGER.info("%s: Obtained temperature %s with set point %s. Activating Smart"
                              "Thermostat.", self.entity_id, self._current_temp, self._target_temp)
 
             if not self._active or self._hvac_mode == HVACMode.OFF:
+                self._async_cancel_pwm_edge()
                 if self._force_off_state and self._hvac_mode == HVACMode.OFF and \
                         self._is_device_active:
                     _LOGGER.debug("%s: %s is active while HVAC mode is %s. Turning it OFF.",
@@ -910,44 +1243,68 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
                         await self._async_heater_turn_off(force=True)
                     else:
                         self._control_output = self._output_min
-                        await self._async_set_valve_value(self._control_output)
-                self.async_write_ha_state()
+                        self._async_invalidate_attributes()
+                        await self._async_set_valve_value(self._control_output,
+                                                          force=True)
+                self._publisher.publish()
                 return
 
-            if self._sensor_stall != 0 and time.time() - self._last_sensor_update > \
-                    self._sensor_stall:
+            enter_safety = False
+            if self._sensor_stall != 0 and \
+                    self._clock() - self._last_sensor_update > self._sensor_stall:
                 # sensor not updated for too long, considered as stall, set to safety level
-                self._control_output = self._output_safety
+                if self._control_output != self._output_safety:
+                    self._control_output = self._output_safety
+                    self._async_invalidate_attributes()
+                    enter_safety = True
             elif calc_pid or self._sampling_period != 0:
                 await self.calc_output()
-            await self.set_control_value()
-            self.async_write_ha_state()
+            # The safety level is sent to all the valves once when entering it
+            await self.set_control_value(force=enter_safety)
+            self._publisher.publish()
 
     @property
     def _is_device_active(self):
+        """If one of the controlled devices is currently active.
+
+        The activity of each device is cached and refreshed by its state change events, the
+        state machine is only read the first time a device is checked. As the commands are sent
+        in the background, the cache is set to the commanded activity as soon as a command is
+        posted, until the state change events of the devices confirm or correct it.
+        """
+        states = self._actuator_states
+        is_active = False
+        for heater_or_cooler_entity in self.heater_or_cooler_entity:
+            if heater_or_cooler_entity not in states:
+                states[heater_or_cooler_entity] = self._is_actuator_active(
+                    self.hass.states.get(heater_or_cooler_entity))
+            if states[heater_or_cooler_entity]:
+                is_active = True
+        return is_active
+
+    def _cache_commanded_activity(self, active=None):
+        """Cache the activity commanded to the devices, or their last value for valves."""
+        if active is None:
+            for entity, value in self._actuators.values.items():
+                self._actuator_states[entity] = value > 0
+            return
+        for heater_or_cooler_entity in self.heater_or_cooler_entity:
+            self._actuator_states[heater_or_cooler_entity] = active
+
+    def _is_actuator_active(self, state):
+        """Return if a device state is active, None if the state is not yet available."""
+        if state is None:
+            return None
         if self._pwm:
-            """If the toggleable device is currently active."""
-            expected = STATE_ON
+            # If the toggleable device is currently active
             if self._heater_polarity_invert:
-                expected = STATE_OFF
-            return any([self.hass.states.is_state(heater_or_cooler_entity, expected) for heater_or_cooler_entity
-                        in self.heater_or_cooler_entity])
-        else:
-            """If the valve device is currently active."""
-            is_active = False
-            try:  # do not throw an error if the state is not yet available on startup
-                for heater_or_cooler_entity in self.heater_or_cooler_entity:
-                    state = self.hass.states.get(heater_or_cooler_entity).state
-                    try:
-                        value = float(state)
-                        if value > 0:
-                            is_active = True
-                    except ValueError:
-                        if state in ['on', 'open']:
-                            is_active = True
-                return is_active
-            except:
-                return False
+                return state.state == STATE_OFF
+            return state.state == STATE_ON
+        # If the valve device is currently active
+        try:
+            return float(state.state) > 0
+        except ValueError:
+            return state.state in ['on', 'open']
 
     @property
     def supported_features(self):
@@ -961,75 +1318,89 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
             return self._cooler_entity_id
         return self._heater_entity_id
 
+    @property
+    def _actuators(self):
+        """Return the drivers of the entities to be controlled based on HVAC MODE"""
+        if self.hvac_mode == HVACMode.COOL and self._cooler_actuators:
+            return self._cooler_actuators
+        return self._heater_actuators
+
+    def _needs_refresh(self, active):
+        """Return if the state of the devices must be sent again by keep_alive.
+
+        Without keep_alive_refresh, the state is sent on every keep_alive tick. Otherwise it is
+        only sent when a device reports another state than the commanded one, or when the
+        last command is older than keep_alive_refresh.
+        """
+        return needs_refresh(self._actuator_states, self.heater_or_cooler_entity, active,
+                             self._last_toggle_time, self._clock(), self._keep_alive_refresh)
+
     async def _async_heater_turn_on(self):
-        """Turn heater toggleable device on."""
+        """Turn heater toggleable device on, return if it is on."""
         if self._is_device_active:
             # It's a state refresh call from keep_alive, just force switch ON.
+            if not self._needs_refresh(True):
+                return True
             _LOGGER.info("%s: Refresh state ON %s", self.entity_id,
                          ", ".join([entity for entity in self.heater_or_cooler_entity]))
-        elif time.time() - self._last_heat_cycle_time >= self._min_off_cycle_duration.seconds:
+        elif self._clock() - self._last_heat_cycle_time >= self._min_off_cycle_duration.seconds:
+            if self._pwm_scheduler is not None and not self._pwm_scheduler.async_acquire(
+                    self.entity_id, self._async_pwm_slot_released):
+                _LOGGER.info("%s: Delay turning ON %s: Maximum heater load reached",
+                             self.entity_id,
+                             ", ".join([entity for entity in self.heater_or_cooler_entity]))
+                return False
             _LOGGER.info("%s: Turning ON %s", self.entity_id,
                          ", ".join([entity for entity in self.heater_or_cooler_entity]))
-            self._last_heat_cycle_time = time.time()
+            self._last_heat_cycle_time = self._clock()
         else:
             _LOGGER.info("%s: Reject request turning ON %s: Cycle is too short",
                          self.entity_id, ", ".join([entity for entity in self.heater_or_cooler_entity]))
-            return
-        for heater_or_cooler_entity in self.heater_or_cooler_entity:
-            data = {ATTR_ENTITY_ID: heater_or_cooler_entity}
-            if self._heater_polarity_invert:
-                service = SERVICE_TURN_OFF
-            else:
-                service = SERVICE_TURN_ON
-            await self.hass.services.async_call(HA_DOMAIN, service, data)
+            return False
+        self._last_toggle_time = self._clock()
+        if self._heater_polarity_invert:
+            self._actuators.async_turn_off(self.hass)
+        else:
+            self._actuators.async_turn_on(self.hass)
+        self._cache_commanded_activity(True)
+        return True
 
     async def _async_heater_turn_off(self, force=False):
-        """Turn heater toggleable device off."""
+        """Turn heater toggleable device off, return if it is off."""
         if not self._is_device_active:
+            self._async_release_pwm_slot()
             # It's a state refresh call from keep_alive, just force switch OFF.
+            if not self._needs_refresh(False):
+                return True
             _LOGGER.info("%s: Refresh state OFF %s", self.entity_id,
                          ", ".join([entity for entity in self.heater_or_cooler_entity]))
-        elif time.time() - self._last_heat_cycle_time >= self._min_on_cycle_duration.seconds or force:
+        elif self._clock() - self._last_heat_cycle_time >= self._min_on_cycle_duration.seconds or force:
             _LOGGER.info("%s: Turning OFF %s", self.entity_id,
                          ", ".join([entity for entity in self.heater_or_cooler_entity]))
-            self._last_heat_cycle_time = time.time()
+            self._last_heat_cycle_time = self._clock()
         else:
             _LOGGER.info("%s: Reject request turning OFF %s: Cycle is too short",
                          self.entity_id, ", ".join([entity for entity in self.heater_or_cooler_entity]))
-            return
-        for entity in [self._heater_entity_id, self._cooler_entity_id]:
-            if entity is None:
-                continue
-            for heater_or_cooler_entity in self.heater_or_cooler_entity:
-                data = {ATTR_ENTITY_ID: heater_or_cooler_entity}
-                if self._heater_polarity_invert:
-                    service = SERVICE_TURN_ON
-                else:
-                    service = SERVICE_TURN_OFF
-                await self.hass.services.async_call(HA_DOMAIN, service, data)
-
-    async def _async_set_valve_value(self, value: float):
-        _LOGGER.info("%s: Change state of %s to %s", self.entity_id,
-                     ", ".join([entity for entity in self.heater_or_cooler_entity]), value)
-        for heater_or_cooler_entity in self.heater_or_cooler_entity:
-            if heater_or_cooler_entity[0:6] == 'light.':
-                data = {ATTR_ENTITY_ID: heater_or_cooler_entity, ATTR_BRIGHTNESS_PCT: value}
-                await self.hass.services.async_call(
-                    LIGHT_DOMAIN,
-                    SERVICE_TURN_LIGHT_ON,
-                    data)
-            elif heater_or_cooler_entity[0:6] == 'valve.':
-                data = {ATTR_ENTITY_ID: heater_or_cooler_entity, ATTR_POSITION: value}
-                await self.hass.services.async_call(
-                    VALVE_DOMAIN,
-                    SERVICE_SET_VALVE_POSITION,
-                    data)
-            else:
-                data = {ATTR_ENTITY_ID: heater_or_cooler_entity, ATTR_VALUE: value}
-                await self.hass.services.async_call(
-                    self._get_number_entity_domain(heater_or_cooler_entity),
-                    SERVICE_SET_VALUE,
-                    data)
+            return False
+        self._last_toggle_time = self._clock()
+        self._async_release_pwm_slot()
+        if self._heater_polarity_invert:
+            self._actuators.async_turn_on(self.hass)
+        else:
+            self._actuators.async_turn_off(self.hass)
+        self._cache_commanded_activity(False)
+        return True
+
+    async def _async_set_valve_value(self, value: float, force=False):
+        suppressed = self._actuators.suppressed
+        value = self._actuators.async_set_value(self.hass, value, force)
+        self._cache_commanded_activity()
+        if self._actuators.suppressed == suppressed:
+            _LOGGER.info("%s: Change state of %s to %s", self.entity_id,
+                         ", ".join([entity for entity in self.heater_or_cooler_entity]), value)
+        else:
+            _LOGGER.debug("%s: Keep state of %s close to %s", self.entity_id,
+                          ", ".join([entity for entity in self.heater_or_cooler_entity]), value)
 
     async def async_set_preset_mode(self, preset_mode: str):
         """Set new preset mode.
@@ -1062,10 +1433,12 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
     async def calc_output(self):
         """calculate control output and handle autotune"""
         update = False
+        attributes = (self._control_output, self._p, self._i, self._d, self._e,
+                      self._dt if self._debug else None)
         if self._previous_temp_time is None:
-            self._previous_temp_time = time.time()
+            self._previous_temp_time = self._clock()
         if self._cur_temp_time is None:
-            self._cur_temp_time = time.time()
+            self._cur_temp_time = self._clock()
         if self._previous_temp_time > self._cur_temp_time:
             self._previous_temp_time = self._cur_temp_time
         if self._autotune != "none":
@@ -1088,11 +1461,14 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
                                                               self._ke, self._min_out,
                                                               self._max_out, self._sampling_period,
                                                               self._cold_tolerance,
-                                                              self._hot_tolerance)
+                                                              self._hot_tolerance, self._clock)
                     self._autotune = "none"
+                self._async_invalidate_attributes()
+                self._async_schedule_storage_save()
             self._control_output = self._pid_autotune.output
             self._p = self._i = self._d = error = self._dt = 0
         else:
+            self._ext_temp_applied = self._ext_temp
             if self._pid_controller.sampling_period == 0:
                 self._control_output, update = self._pid_controller.calc(self._current_temp,
                                                                          self._target_temp,
@@ -1112,20 +1488,28 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
                 self._control_output = int(self._control_output)
             error = self._pid_controller.error
             self._dt = self._pid_controller.dt
+            if update:
+                self._async_schedule_storage_save()
+        if attributes != (self._control_output, self._p, self._i, self._d, self._e,
+                          self._dt if self._debug else None):
+            self._async_invalidate_attributes()
         if update:
             _LOGGER.debug("%s: New PID control output: %s (error = %.2f, dt = %.2f, "
                           "p=%.2f, i=%.2f, d=%.2f, e=%.2f)", self.entity_id,
                           str(self._control_output), error, self._dt, self._p, self._i, self._d,
                           self._e)
 
-    async def set_control_value(self):
-        """Set Output value for heater"""
+    async def set_control_value(self, force=False):
+        """Set Output value for heater, force sending the value to the valves"""
+        if not self._pwm or abs(self._control_output) in (0, self._difference):
+            # No edge to schedule while the output is constant
+            self._async_cancel_pwm_edge()
         if self._pwm:
             if abs(self._control_output) == self._difference:
                 if not self._is_device_active:
                     _LOGGER.info("%s: Output is %s. Request turning ON %s", self.entity_id,
                                  self._difference, ", ".join([entity for entity in self.heater_or_cooler_entity]))
-                    self._time_changed = time.time()
+                    self._time_changed = self._clock()
                 await self._async_heater_turn_on()
             elif abs(self._control_output) > 0:
                 await self.pwm_switch()
@@ -1133,14 +1517,14 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
                 if self._is_device_active:
                     _LOGGER.info("%s: Output is 0. Request turning OFF %s", self.entity_id,
                                  ", ".join([entity for entity in self.heater_or_cooler_entity]))
-                    self._time_changed = time.time()
+                    self._time_changed = self._clock()
                 await self._async_heater_turn_off()
         else:
-            await self._async_set_valve_value(abs(self._control_output))
+            await self._async_set_valve_value(abs(self._control_output), force)
 
     async def pwm_switch(self):
         """turn off and on the heater proportionally to control_value."""
-        time_passed = time.time() - self._time_changed
+        time_passed = self._clock() - self._time_changed
         # Compute time_on based on PWM duration and PID output
         time_on = self._pwm * abs(self._control_output) / self._difference
         time_off = self._pwm - time_on
@@ -1153,39 +1537,141 @@ class SmartThermostat(ClimateEntity, RestoreEntity, ABC):
             # time_off is too short, increase time_on and time_off
             time_on *= self._min_off_cycle_duration.seconds / time_off
             time_off = self._min_off_cycle_duration.seconds
+        if self._pwm_scheduler is not None:
+            await self._async_pwm_switch_staggered(time_on, time_off)
+            return
+        toggle, next_edge = pwm_edge(
+            self._is_device_active, time_on, time_off, time_passed,
+            self._force_off if self._is_device_active else self._force_on)
         if self._is_device_active:
-            if time_on <= time_passed or self._force_off:
+            if toggle:
                 _LOGGER.info(
                     "%s: ON time passed. Request turning OFF %s",
                     self.entity_id,
                     ", ".join([entity for entity in self.heater_or_cooler_entity])
                 )
                 await self._async_heater_turn_off()
-                self._time_changed = time.time()
+                self._time_changed = self._clock()
             else:
                 _LOGGER.info(
                     "%s: Time until %s turns OFF: %s sec",
                     self.entity_id,
                     ", ".join([entity for entity in self.heater_or_cooler_entity]),
-                    int(time_on - time_passed)
+                    int(next_edge)
                 )
                 if self._keep_alive:
                     await self._async_heater_turn_on()
         else:
-            if time_off <= time_passed or self._force_on:
+            if toggle:
                 _LOGGER.info(
                     "%s: OFF time passed. Request turning ON %s", self.entity_id,
                     ", ".join([entity for entity in self.heater_or_cooler_entity])
                 )
                 await self._async_heater_turn_on()
-                self._time_changed = time.time()
+                self._time_changed = self._clock()
             else:
                 _LOGGER.info(
                     "%s: Time until %s turns ON: %s sec", self.entity_id,
                     ", ".join([entity for entity in self.heater_or_cooler_entity]),
-                    int(time_off - time_passed)
+                    int(next_edge)
                 )
                 if self._keep_alive:
                     await self._async_heater_turn_off()
         self._force_on = False
         self._force_off = False
+        self._async_schedule_pwm_edge(next_edge)
+
+    async def _async_pwm_switch_staggered(self, time_on, time_off):
+        """Turn the heater on at the start of the cycles of its phase.
+
+        The cycles start at the phase given by the PWM scheduler. When the minimum cycle
+        durations stretch the ON and OFF times beyond the PWM period, the heater is only turned
+        on every few cycles, with the ON time scaled so that the duty cycle is kept. When the
+        heater is denied a slot, it is turned on as soon as one is released, and stays on for
+        the ON time of the next window too if it has started meanwhile.
+        """
+        # Cycles in a window of one ON time, and the ON time keeping the duty cycle
+        cycles = max(1, math.ceil((time_on + time_off) / self._pwm - 1e-9))
+        time_on *= cycles * self._pwm / (time_on + time_off)
+        now = self._clock()
+        cycle_start = self._pwm_scheduler.cycle_start(self.entity_id, now)
+        next_cycle = cycle_start + self._pwm
+        if self._force_on:
+            self._pwm_served_cycle = None
+        if self._pwm_on_since is None and self._is_device_active:
+            # Turned on at full output or before a restart
+            self._pwm_on_since = now
+            self._pwm_on_cycles = 1
+            self._pwm_served_cycle = cycle_start
+        if self._pwm_served_cycle is None:
+            next_window = cycle_start
+        else:
+            next_window = self._pwm_served_cycle + cycles * self._pwm
+        # Cycle starts are computed on a grid, tolerate rounding errors
+        window_due = cycle_start > next_window - self._pwm / 2
+        if self._pwm_on_since is not None:
+            if not self._force_off and window_due and \
+                    now >= self._pwm_on_since + time_on * self._pwm_on_cycles:
+                # The next window started before the end of a delayed ON time, stay on
+                self._pwm_on_cycles += 1
+                self._pwm_served_cycle = cycle_start
+                next_window = cycle_start + cycles * self._pwm
+            on_until = self._pwm_on_since + time_on * self._pwm_on_cycles
+            if now >= on_until or self._force_off:
+                _LOGGER.info("%s: ON time passed. Request turning OFF %s", self.entity_id,
+                             ", ".join([entity for entity in self.heater_or_cooler_entity]))
+                await self._async_heater_turn_off()
+                next_edge = max(next_window, next_cycle) - now
+            else:
+                next_edge = on_until - now
+                if self._keep_alive:
+                    await self._async_heater_turn_on()
+        elif window_due:
+            _LOGGER.info("%s: Cycle started. Request turning ON %s", self.entity_id,
+                         ", ".join([entity for entity in self.heater_or_cooler_entity]))
+            if await self._async_heater_turn_on():
+                self._pwm_on_since = now
+                self._pwm_on_cycles = 1
+                self._pwm_served_cycle = cycle_start
+                next_edge = time_on
+            else:
+                next_edge = next_cycle - now
+        else:
+            next_edge = max(next_window, next_cycle) - now
+            if self._keep_alive:
+                await self._async_heater_turn_off()
+        self._force_on = False
+        self._force_off = False
+        self._async_schedule_pwm_edge(next_edge)
+
+    @callback
+    def _async_release_pwm_slot(self):
+        self._pwm_on_since = None
+        if self._pwm_scheduler is not None:
+            self._pwm_scheduler.async_release(self.entity_id)
+
+    async def _async_pwm_slot_released(self):
+        await self._async_control_heating(calc_pid=False)
+
+    @callback
+    def _async_schedule_pwm_edge(self, delay):
+        """Run the control loop exactly when the heater has to be switched next."""
+        self._async_cancel_pwm_edge()
+        self._unsub_pwm_edge = async_call_later(self.hass, max(delay, 0), self._async_pwm_edge)
+
+    @callback
+    def _async_cancel_pwm_edge(self):
+        if self._unsub_pwm_edge is not None:
+            self._unsub_pwm_edge()
+            self._unsub_pwm_edge = None
+
+    async def _async_pwm_edge(self, _now):
+        self._unsub_pwm_edge = None
+        await self._async_control_heating(calc_pid=False)
+
+
+class DiagnosedSmartThermostat(SmartThermostat):
+    """Smart Thermostat publishing its PID values with diagnostic sensors."""
+
+    # Changing on every control cycle, recorded by the diagnostic sensors instead
+    _unrecorded_attributes = frozenset(DIAGNOSTIC_SENSORS)
@@ -9,6 +9,7 @@ DEFAULT_OUT_CLAMP_LOW = 0
 DEFAULT_OUT_CLAMP_HIGH = 100
 DEFAULT_PWM = '00:15:00'
 DEFAULT_MIN_CYCLE_DURATION = '00:00:00'
+DEFAULT_KEEP_ALIVE_REFRESH = '00:00:00'
 DEFAULT_TOLERANCE = 0.3
 DEFAULT_KP = 100
 DEFAULT_KI = 0
@@ -19,8 +20,24 @@ DEFAULT_NOISEBAND = 0.5
 DEFAULT_SAMPLING_PERIOD = '00:00:00'
 DEFAULT_LOOKBACK = '02:00:00'
 DEFAULT_SENSOR_STALL = '06:00:00'
+DEFAULT_SENSOR_WINDOW = '00:00:00'
+DEFAULT_SENSOR_AGGREGATION = 'mean'
 DEFAULT_OUTPUT_SAFETY = 5.0
 DEFAULT_PRESET_SYNC_MODE = "none"
+DEFAULT_MIN_PUBLISH_INTERVAL = '00:00:00'
+DEFAULT_DIAGNOSTIC_SAMPLING_PERIOD = '00:05:00'
+DEFAULT_ACTUATOR_TIMEOUT = '00:00:10'
+DEFAULT_ACTUATOR_RETRIES = 3
+DEFAULT_ACTUATOR_RATE_PERIOD = '00:10:00'
+DEFAULT_VALVE_RESOLUTION = 0
+DEFAULT_VALVE_DEADBAND = 0
+DEFAULT_VALVE_REFRESH = '00:30:00'
+
+STORAGE_VERSION = 1
+STORAGE_SAVE_DELAY = 60
+PID_RESTORE_MAX_AGE = 1800
+# hass.data[DOMAIN] key of the thermostats by entity_id, looked up by the sensor platform
+DATA_THERMOSTATS = 'thermostats'
 
 CONF_HEATER = "heater"
 CONF_COOLER = "cooler"
@@ -39,8 +56,15 @@ CONF_MIN_OFF_CYCLE_DURATION = "min_off_cycle_duration"
 CONF_MIN_CYCLE_DURATION_PID_OFF = 'min_cycle_duration_pid_off'
 CONF_MIN_OFF_CYCLE_DURATION_PID_OFF = 'min_off_cycle_duration_pid_off'
 CONF_KEEP_ALIVE = "keep_alive"
+CONF_KEEP_ALIVE_REFRESH = "keep_alive_refresh"
+CONF_PWM_STAGGER = 'pwm_stagger'
+CONF_HEATER_POWER = 'heater_power'
+CONF_MAX_ACTIVE_HEATERS = 'max_active_heaters'
+CONF_POWER_BUDGET = 'power_budget'
 CONF_SAMPLING_PERIOD = "sampling_period"
 CONF_SENSOR_STALL = 'sensor_stall'
+CONF_SENSOR_WINDOW = 'sensor_window'
+CONF_SENSOR_AGGREGATION = 'sensor_aggregation'
 CONF_OUTPUT_SAFETY = 'output_safety'
 CONF_INITIAL_HVAC_MODE = "initial_hvac_mode"
 CONF_PRESET_SYNC_MODE = "preset_sync_mode"
@@ -67,4 +91,15 @@ CONF_BOOST_PID_OFF = 'boost_pid_off'
 CONF_AUTOTUNE = "autotune"
 CONF_NOISEBAND = "noiseband"
 CONF_LOOKBACK = "lookback"
+CONF_MIN_PUBLISH_INTERVAL = 'min_publish_interval'
+CONF_DIAGNOSTIC_SENSORS = 'diagnostic_sensors'
+CONF_DIAGNOSTIC_SAMPLING_PERIOD = 'diagnostic_sampling_period'
+CONF_ACTUATOR_TIMEOUT = 'actuator_timeout'
+CONF_ACTUATOR_RETRIES = 'actuator_retries'
+CONF_ACTUATOR_RATE_LIMIT = 'actuator_rate_limit'
+CONF_ACTUATOR_RATE_PERIOD = 'actuator_rate_period'
+CONF_ACTUATOR_BURST = 'actuator_burst'
+CONF_VALVE_RESOLUTION = 'valve_resolution'
+CONF_VALVE_DEADBAND = 'valve_deadband'
+CONF_VALVE_REFRESH = 'valve_refresh'
 CONF_DEBUG = 'debug'
@@ -0,0 +1,330 @@
+"""Periodic ticks shared by all the thermostats of the domain."""
+import asyncio
+import logging
+import math
+
+from homeassistant.core import Event, EventStateChangedData, HomeAssistant, callback
+from homeassistant.helpers.event import async_call_at, async_track_state_change_event
+
+from . import DOMAIN
+
+_LOGGER = logging.getLogger(__name__)
+
+DATA_COORDINATOR = 'coordinator'
+DATA_PWM_SCHEDULER = 'pwm_scheduler'
+DATA_SENSOR_REGISTRY = 'sensor_registry'
+
+
+class TickCoordinator:
+    """Owns one timer per interval and dispatches its ticks to all the registered actions.
+
+    The thermostats using the same interval are run in a single pass on each tick instead of
+    each one waking the event loop with its own timer. The ticks are aligned on a fixed grid
+    of the event loop clock, so they don't drift with the time taken by the actions, and a
+    late tick skips the missed ones instead of running them in a burst.
+    """
+
+    def __init__(self, hass: HomeAssistant):
+        self._hass = hass
+        self._wheels = {}
+
+    @classmethod
+    @callback
+    def async_get(cls, hass: HomeAssistant):
+        """Get the coordinator of the domain, created on first use."""
+        data = hass.data.setdefault(DOMAIN, {})
+        if DATA_COORDINATOR not in data:
+            data[DATA_COORDINATOR] = cls(hass)
+        return data[DATA_COORDINATOR]
+
+    @callback
+    def async_register(self, interval, action):
+        """Call `action(now)` every `interval` seconds, a callback or a coroutine function.
+
+        Returns:
+            The function unregistering the action.
+        """
+        wheel = self._wheels.get(interval)
+        if wheel is None:
+            wheel = self._wheels[interval] = _Wheel(self._hass, interval)
+        wheel.actions.append(action)
+        wheel.start()
+
+        @callback
+        def unregister():
+            if action in wheel.actions:
+                wheel.actions.remove(action)
+            if not wheel.actions:
+                wheel.stop()
+                self._wheels.pop(interval, None)
+        return unregister
+
+    @property
+    def intervals(self):
+        """Get the number of actions registered for each interval."""
+        return {interval: len(wheel.actions) for interval, wheel in self._wheels.items()}
+
+
+class _Wheel:
+    def __init__(self, hass, interval):
+        self._hass = hass
+        self.interval = interval
+        self.actions = []
+        self._next_time = None
+        self._unsub = None
+        self.ticks = 0
+        self.skipped = 0
+
+    def start(self):
+        if self._unsub is not None:
+            return
+        now = self._hass.loop.time()
+        self._next_time = math.ceil(now / self.interval) * self.interval
+        self._unsub = async_call_at(self._hass, self._async_tick, self._next_time)
+
+    def stop(self):
+        if self._unsub is not None:
+            self._unsub()
+            self._unsub = None
+
+    async def _async_tick(self, now):
+        late = self._hass.loop.time() - self._next_time
+        missed = max(0, int(late // self.interval))
+        self.skipped += missed
+        self._next_time += (missed + 1) * self.interval
+        self._unsub = async_call_at(self._hass, self._async_tick, self._next_time)
+        self.ticks += 1
+        coroutines = []
+        for action in list(self.actions):
+            try:
+                result = action(now)
+            except Exception:
+                _LOGGER.exception("Error running a periodic update every %s s", self.interval)
+                continue
+            if asyncio.iscoroutine(result):
+                coroutines.append(result)
+        results = await asyncio.gather(*coroutines, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                _LOGGER.error("Error running a periodic update every %s s",
+                              self.interval, exc_info=result)
+
+
+def pwm_edge(active, time_on, time_off, time_passed, force=False):
+    """Return if a PWM heater must be switched now, and the delay until its next edge.
+
+    Args:
+        active (bool): If the heater is on.
+        time_on (float): The ON time of the PWM cycle in seconds.
+        time_off (float): The OFF time of the PWM cycle in seconds.
+        time_passed (float): The time since the heater was last switched in seconds.
+        force (bool): Switch the heater even if its ON or OFF time has not passed.
+
+    Returns:
+        A `(switch, delay)` tuple, the delay being counted from now.
+    """
+    current, following = (time_on, time_off) if active else (time_off, time_on)
+    if current <= time_passed or force:
+        return True, following
+    return False, current - time_passed
+
+
+class PwmScheduler:
+    """Spreads the PWM cycles of the thermostats and caps the number of heaters ON together.
+
+    Each thermostat registered with a PWM period gets a phase, the start of its cycles being
+    offset from the other thermostats with the same period: a new thermostat is placed in the
+    middle of the largest gap between the phases, the phases of the thermostats already
+    running are never moved so their cycles in progress keep their length.
+    A heater must acquire a slot before turning ON, which is denied when the maximum number of
+    active heaters or the power budget would be exceeded; the thermostats denied are called
+    back as soon as a heater releases its slot.
+
+    The limits are shared by the domain, the lowest values configured by the thermostats
+    apply. A heater whose power is unknown counts as the whole power budget, so it is only
+    turned ON alone.
+    """
+
+    def __init__(self, hass: HomeAssistant):
+        self._hass = hass
+        self._zones = {}
+        self._phases = {}
+        self._active = {}
+        self._waiting = {}
+
+    @classmethod
+    @callback
+    def async_get(cls, hass: HomeAssistant):
+        """Get the PWM scheduler of the domain, created on first use."""
+        data = hass.data.setdefault(DOMAIN, {})
+        if DATA_PWM_SCHEDULER not in data:
+            data[DATA_PWM_SCHEDULER] = cls(hass)
+        return data[DATA_PWM_SCHEDULER]
+
+    @callback
+    def async_register(self, key, period, power=None, max_active=None, power_budget=None):
+        """Register the heater of a thermostat.
+
+        Args:
+            key (str): The identifier of the thermostat.
+            period (float): The PWM period in seconds.
+            power (float): The power of the heater, counted in the power budget, None if
+                unknown.
+            max_active (int): The maximum number of heaters ON together, None if not limited.
+            power_budget (float): The maximum total power of the heaters ON together, None if
+                not limited.
+
+        Returns:
+            The function unregistering the thermostat.
+        """
+        if self._zones.get(key, (None,))[0] != period:
+            self._phases[key] = self._free_phase(period)
+        self._zones[key] = (period, power, max_active, power_budget)
+
+        @callback
+        def unregister():
+            self._zones.pop(key, None)
+            self._phases.pop(key, None)
+            self._waiting.pop(key, None)
+            self.async_release(key)
+        return unregister
+
+    @property
+    def max_active(self):
+        """Get the maximum number of heaters ON together, None if not limited."""
+        return min((zone[2] for zone in self._zones.values() if zone[2] is not None),
+                   default=None)
+
+    @property
+    def power_budget(self):
+        """Get the maximum total power of the heaters ON together, None if not limited."""
+        return min((zone[3] for zone in self._zones.values() if zone[3] is not None),
+                   default=None)
+
+    @property
+    def active(self):
+        """Get the thermostats holding a slot and the power of their heater."""
+        return dict(self._active)
+
+    def cycle_start(self, key, now):
+        """Get the start of the current PWM cycle of a thermostat."""
+        period = self._zones[key][0]
+        phase = self._phases.get(key, 0)
+        return math.floor((now - phase) / period) * period + phase
+
+    @callback
+    def async_acquire(self, key, waiter=None):
+        """Acquire a slot to turn the heater of a thermostat ON.
+
+        Args:
+            key (str): The identifier of the thermostat.
+            waiter (function): A coroutine function called when a slot is released, if the
+                slot is denied.
+
+        Returns:
+            True if the heater can be turned ON.
+        """
+        if key in self._active:
+            return True
+        power = self._zones[key][1]
+        max_active = self.max_active
+        power_budget = self.power_budget
+        if power is None:
+            power = power_budget or 0
+        if (max_active is not None and len(self._active) >= max_active) or \
+                (power_budget is not None and sum(self._active.values()) + power > power_budget):
+            if waiter is not None:
+                self._waiting[key] = waiter
+            return False
+        self._waiting.pop(key, None)
+        self._active[key] = power
+        return True
+
+    @callback
+    def async_release(self, key):
+        """Release the slot of a thermostat whose heater is turned OFF."""
+        if self._active.pop(key, None) is None:
+            return
+        waiting, self._waiting = self._waiting, {}
+        for waiter in waiting.values():
+            self._hass.async_create_task(waiter())
+
+    def _free_phase(self, period):
+        """Get the middle of the largest gap between the phases of the period."""
+        phases = sorted(self._phases[key] for key, zone in self._zones.items()
+                        if zone[0] == period)
+        if not phases:
+            return 0
+        gaps = [(phases[0] + period - phases[-1], phases[-1])]
+        gaps += [(phase - previous, previous) for previous, phase in zip(phases, phases[1:])]
+        gap, start = max(gaps)
+        return (start + gap / 2) % period
+
+
+class SensorRegistry:
+    """Shares the temperature sensors used by several thermostats, ie the outdoor sensor.
+
+    Each sensor is subscribed once whatever the number of thermostats using it, its state is
+    parsed once and the temperature is passed to the listeners of all the thermostats.
+    """
+
+    def __init__(self, hass: HomeAssistant):
+        self._hass = hass
+        self._sensors = {}
+
+    @classmethod
+    @callback
+    def async_get(cls, hass: HomeAssistant):
+        """Get the sensor registry of the domain, created on first use."""
+        data = hass.data.setdefault(DOMAIN, {})
+        if DATA_SENSOR_REGISTRY not in data:
+            data[DATA_SENSOR_REGISTRY] = cls(hass)
+        return data[DATA_SENSOR_REGISTRY]
+
+    @callback
+    def async_subscribe(self, entity_id, listener):
+        """Call `listener(temperature)` on each valid temperature of a sensor.
+
+        Returns:
+            The function unsubscribing the listener.
+        """
+        sensor = self._sensors.get(entity_id)
+        if sensor is None:
+            sensor = self._sensors[entity_id] = _SharedSensor(entity_id)
+            sensor.unsub = async_track_state_change_event(self._hass, entity_id,
+                                                          sensor.async_changed)
+        sensor.listeners.append(listener)
+
+        @callback
+        def unsubscribe():
+            if listener in sensor.listeners:
+                sensor.listeners.remove(listener)
+            if not sensor.listeners and self._sensors.get(entity_id) is sensor:
+                sensor.unsub()
+                del self._sensors[entity_id]
+        return unsubscribe
+
+    @property
+    def listeners(self):
+        """Get the number of listeners of each sensor subscribed."""
+        return {entity_id: len(sensor.listeners) for entity_id, sensor in self._sensors.items()}
+
+
+class _SharedSensor:
+    def __init__(self, entity_id):
+        self.entity_id = entity_id
+        self.listeners = []
+        self.unsub = None
+
+    @callback
+    def async_changed(self, event: Event[EventStateChangedData]):
+        new_state = event.data["new_state"]
+        if new_state is None:
+            return
+        try:
+            temperature = float(new_state.state)
+        except ValueError as ex:
+            _LOGGER.debug("Unable to update from sensor %s: %s", self.entity_id, ex)
+            return
+        for listener in list(self.listeners):
+            listener(temperature)
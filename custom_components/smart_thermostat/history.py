@@ -0,0 +1,47 @@
+"""Read the recorded history of a thermostat for offline analysis."""
+from datetime import datetime
+
+from sqlalchemy import select
+
+from homeassistant.components.recorder.db_schema import States, StatesMeta
+from homeassistant.components.recorder.util import session_scope
+from homeassistant.const import STATE_OFF, STATE_ON
+from homeassistant.core import HomeAssistant
+
+HISTORY_BATCH_SIZE = 1000
+
+
+def recorded_samples(hass: HomeAssistant, sensor_entity_id: str, heater_entity_ids: list,
+                     start: datetime, end: datetime, invert: bool = False):
+    """Yield `(timestamp, temperature, heater_on)` samples from the recorder database.
+
+    The states are streamed in batches from the database, so the memory used doesn't depend on
+    the length of the period. The heater is on when any of the heater entities is on. A sample
+    with both values None is yielded when an entity is unavailable.
+
+    This generator does blocking I/O and must be consumed in the recorder executor.
+    """
+    on_state = STATE_OFF if invert else STATE_ON
+    heaters = {}
+    query = (
+        select(StatesMeta.entity_id, States.state, States.last_updated_ts)
+        .join(StatesMeta, States.metadata_id == StatesMeta.metadata_id)
+        .where(StatesMeta.entity_id.in_([sensor_entity_id, *heater_entity_ids]))
+        .where(States.last_updated_ts >= start.timestamp())
+        .where(States.last_updated_ts < end.timestamp())
+        .order_by(States.last_updated_ts)
+        .execution_options(yield_per=HISTORY_BATCH_SIZE)
+    )
+    with session_scope(hass=hass, read_only=True) as session:
+        for entity_id, state, timestamp in session.execute(query):
+            if entity_id == sensor_entity_id:
+                try:
+                    yield timestamp, float(state), None
+                except (TypeError, ValueError):
+                    yield timestamp, None, None
+            elif state in (STATE_ON, STATE_OFF):
+                heaters[entity_id] = state == on_state
+                yield timestamp, None, any(heaters.values())
+            else:
+                heaters.pop(entity_id, None)
+                yield timestamp, None, None
@@ -0,0 +1,82 @@
+"""Single slot mailbox serializing the control cycles of a thermostat."""
+import asyncio
+
+
+class ControlMailbox:
+    """Run the control cycles of a thermostat one at a time, merging the ones waiting.
+
+    A cycle requested while another one is running is not queued: all the requests received
+    meanwhile are merged into a single follow-up cycle, run once the current one is finished
+    with the newest inputs. The follow-up computes the PID output if any of the merged
+    requests asked for it. Each request returns once the cycle handling it has run.
+
+    Args:
+        run (function): The coroutine function running a cycle, called with `calc_pid`.
+    """
+
+    def __init__(self, run):
+        self._run = run
+        self._running = False
+        self._follow_up = None
+        self._follow_up_calc_pid = False
+        self._requested = 0
+        self._runs = 0
+        self._coalesced = 0
+
+    @property
+    def requested(self):
+        """Get the number of cycles requested."""
+        return self._requested
+
+    @property
+    def runs(self):
+        """Get the number of cycles run."""
+        return self._runs
+
+    @property
+    def coalesced(self):
+        """Get the number of requests received while a cycle was running, merged into the
+        follow-up cycle."""
+        return self._coalesced
+
+    async def async_post(self, calc_pid=False):
+        """Request a control cycle and wait until it has run."""
+        self._requested += 1
+        if self._running:
+            self._coalesced += 1
+            if self._follow_up is None:
+                self._follow_up = asyncio.get_running_loop().create_future()
+                self._follow_up_calc_pid = calc_pid
+            else:
+                self._follow_up_calc_pid |= calc_pid
+            await asyncio.shield(self._follow_up)
+            return
+
+        self._running = True
+        try:
+            self._runs += 1
+            await self._run(calc_pid)
+        finally:
+            try:
+                await self._async_run_follow_ups()
+            finally:
+                self._running = False
+                # Cancelled before running the follow-up, release the requests waiting for it
+                if self._follow_up is not None:
+                    self._follow_up.cancel()
+                    self._follow_up = None
+
+    async def _async_run_follow_ups(self):
+        while self._follow_up is not None:
+            done, calc_pid = self._follow_up, self._follow_up_calc_pid
+            self._follow_up = None
+            self._runs += 1
+            try:
+                await self._run(calc_pid)
+            except Exception as ex:
+                done.set_exception(ex)
+            except BaseException:
+                done.cancel()
+                raise
+            else:
+                done.set_result(None)
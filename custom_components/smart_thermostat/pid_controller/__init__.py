@@ -1,18 +1,39 @@
 import math
 import logging
-from time import time
+from time import monotonic, time
 from collections import deque, namedtuple
 
 _LOGGER = logging.getLogger(__name__)
 
 
+class MonotonicClock:
+    """Monotonic time source giving seconds since epoch.
+
+    The clock is anchored on the wall clock when created, then only advances with the
+    monotonic clock of the system, so wall clock jumps (ie NTP corrections) can not corrupt
+    the time deltas computed by the controllers. Any function returning the current time in
+    seconds can be used instead, ie a virtual clock for simulations.
+    """
+
+    def __init__(self):
+        self._offset = time() - monotonic()
+
+    def __call__(self):
+        return self._offset + monotonic()
+
+
+default_clock = MonotonicClock()
+
+
 # Based on Arduino PID Library
 # See https://github.com/br3ttb/Arduino-PID-Library
 class PID:
+    SNAPSHOT_VERSION = 1
     error: float
 
     def __init__(self, kp, ki, kd, ke=0, out_min=float('-inf'), out_max=float('+inf'),
-                 sampling_period=0, cold_tolerance=0.3, hot_tolerance=0.3):
+                 sampling_period=0, cold_tolerance=0.3, hot_tolerance=0.3,
+                 time_func=default_clock):
         """A proportional-integral-derivative controller.
             :param kp: Proportional coefficient.
             :type kp: float
@@ -32,6 +53,8 @@ class PID:
             :type cold_tolerance: float
             :param hot_tolerance: time period between two PID calculations in seconds
             :type hot_tolerance: float
+            :param time_func: A function which returns the current time in seconds.
+            :type time_func: function
         """
         if kp is None:
             raise ValueError('kp must be specified')
@@ -70,6 +93,7 @@ class PID:
         self._sampling_period = sampling_period
         self._cold_tolerance = cold_tolerance
         self._hot_tolerance = hot_tolerance
+        self._time = time_func
 
     @property
     def mode(self):
@@ -147,7 +171,87 @@ class PID:
         self._input_time = None
         self._last_input = None
         self._last_input_time = None
-        
+
+    def snapshot(self):
+        """Get the controller state as a JSON serializable dict, to resume it with `restore`."""
+        return {
+            'version': PID.SNAPSHOT_VERSION,
+            'kp': self._Kp,
+            'ki': self._Ki,
+            'kd': self._Kd,
+            'ke': self._Ke,
+            'mode': self._mode,
+            'integral': self._integral,
+            'set_point': self._set_point,
+            'input': self._input,
+            'input_time': self._input_time,
+            'last_input': self._last_input,
+            'last_input_time': self._last_input_time,
+            'output': self._output,
+        }
+
+    @staticmethod
+    def has_fresh_samples(snapshot, now, max_age):
+        """Return if the last input of a snapshot is recent enough to restore the samples.
+
+        Args:
+            snapshot (dict): The state returned by `snapshot`.
+            now (float): The current time in seconds.
+            max_age (float): The maximum age of the last input in seconds.
+        """
+        input_time = snapshot.get('input_time')
+        return isinstance(input_time, (float, int)) and now - input_time <= max_age
+
+    @staticmethod
+    def is_ext_change_negligible(ke, ext_temp, last_ext_temp, output_precision):
+        """Return if an outdoor temperature change moves the external term of the output by
+        less than the output precision.
+
+        Args:
+            ke (float): Outdoor temperature compensation coefficient.
+            ext_temp (float): The new outdoor temperature value.
+            last_ext_temp (float): The outdoor temperature of the last PID calculation, None
+                if it was never used.
+            output_precision (int): The number of decimals of the output.
+        """
+        if ke is None or last_ext_temp is None:
+            return False
+        return abs(ke * (ext_temp - last_ext_temp)) < 10 ** -(output_precision or 0)
+
+    def restore(self, snapshot, samples=True):
+        """Resume the controller state saved by `snapshot`.
+
+        Args:
+            snapshot (dict): The state returned by `snapshot`.
+            samples (bool): Restore the last input values and timestamps, set to False if they
+                are too old to compute a meaningful derivative and integral.
+
+        Raises:
+            ValueError: if the snapshot is invalid.
+        """
+        try:
+            if snapshot['version'] != PID.SNAPSHOT_VERSION:
+                raise ValueError(f"unsupported snapshot version {snapshot['version']}")
+            if snapshot['mode'] not in ['AUTO', 'OFF']:
+                raise ValueError(f"invalid mode {snapshot['mode']}")
+            gains = [float(snapshot[gain]) for gain in ['kp', 'ki', 'kd', 'ke']]
+            integral = float(snapshot['integral'])
+            set_point = float(snapshot['set_point'])
+            output = float(snapshot['output'])
+            inputs = [snapshot[field] for field in
+                      ['input', 'input_time', 'last_input', 'last_input_time']]
+        except (KeyError, TypeError) as ex:
+            raise ValueError(f'invalid snapshot: {ex}') from ex
+        self._Kp, self._Ki, self._Kd, self._Ke = gains
+        self._mode = snapshot['mode']
+        self._integral = integral
+        self._last_set_point = self._set_point = set_point
+        self._last_output = self._output = max(min(output, self._out_max), self._out_min)
+        if samples:
+            self._input, self._input_time, self._last_input, self._last_input_time = inputs
+        else:
+            self.clear_samples()
+
     def calc(self, input_val, set_point, input_time=None, last_input_time=None, ext_temp=None):
         """Adjusts and holds the given setpoint.
 
@@ -163,7 +267,7 @@ class PID:
             A value between `out_min` and `out_max`.
         """
         if self._sampling_period != 0 and self._last_input_time is not None and \
-                time() - self._input_time < self._sampling_period:
+                self._time() - self._input_time < self._sampling_period:
             return self._output, False  # If last sample is too young, keep last output value
 
         self._last_input = self._input
@@ -178,7 +282,7 @@ class PID:
         if self._sampling_period == 0:
             self._input_time = input_time
         else:
-            self._input_time = time()
+            self._input_time = self._time()
         self._last_set_point = self._set_point
         self._set_point = set_point
 
@@ -234,6 +338,54 @@ class PID:
         return self._output, True
 
 
+class SlidingExtrema:
+    """Tracks the minimum and maximum of the last `size` samples.
+
+    Uses monotonic deques so each append costs amortized O(1), whatever the window size.
+
+    Args:
+        size (int): Number of samples in the sliding window.
+    """
+
+    def __init__(self, size):
+        self._size = size
+        self._count = 0
+        self._max = deque()
+        self._min = deque()
+
+    @property
+    def maximum(self):
+        """Get the maximum value of the window."""
+        return self._max[0][1]
+
+    @property
+    def minimum(self):
+        """Get the minimum value of the window."""
+        return self._min[0][1]
+
+    def clear(self):
+        """Drop all samples from the window."""
+        self._count = 0
+        self._max.clear()
+        self._min.clear()
+
+    def append(self, value):
+        """Add a sample to the window, dropping the oldest one if the window is full."""
+        index = self._count
+        self._count += 1
+        while self._max and self._max[-1][1] < value:
+            self._max.pop()
+        self._max.append((index, value))
+        while self._min and self._min[-1][1] > value:
+            self._min.pop()
+        self._min.append((index, value))
+        oldest = self._count - self._size
+        while self._max[0][0] < oldest:
+            self._max.popleft()
+        while self._min[0][0] < oldest:
+            self._min.popleft()
+
+
 # Based on a fork of Arduino PID AutoTune Library
 # See https://github.com/t0mpr1c3/Arduino-PID-AutoTune-Library
 class PIDAutotune:
@@ -254,13 +406,14 @@ class PIDAutotune:
     PIDParams = namedtuple('PIDParams', ['Kp', 'Ki', 'Kd'])
 
     PEAK_AMPLITUDE_TOLERANCE = 0.05
+    SNAPSHOT_VERSION = 1
     STATE_OFF = 'off'
     STATE_RELAY_STEP_UP = 'relay step up'
     STATE_RELAY_STEP_DOWN = 'relay step down'
     STATE_SUCCEEDED = 'succeeded'
     STATE_FAILED = 'failed'
 
-    _tuning_rules = {
+    TUNING_RULES = {
         # rule: [Kp_divisor, Ki_divisor, Kd_divisor]
         "ziegler-nichols": [34, 40, 160],
         "tyreus-luyben": [44,  9, 126],
@@ -272,7 +425,8 @@ class PIDAutotune:
     }
 
     def __init__(self, out_step=10, lookback=60,
-                 out_min=float('-inf'), out_max=float('inf'), noiseband=0.5, time_func=time):
+                 out_min=float('-inf'), out_max=float('inf'), noiseband=0.5,
+                 time_func=default_clock):
         if out_step < 1:
             raise ValueError('out_step must be greater or equal to 1')
         if out_min >= out_max:
@@ -285,6 +439,7 @@ class PIDAutotune:
         self._lookback = lookback
         self._inputs = deque(maxlen=10)
         self._inputs_timestamps = deque(maxlen=10)
+        self._extrema = SlidingExtrema(10)
         self._setpoint = None
         self._outputstep = out_step
         self._noiseband = noiseband
@@ -315,7 +470,7 @@ class PIDAutotune:
     @property
     def tuning_rules(self):
         """Get a list of all available tuning rules."""
-        return self._tuning_rules.keys()
+        return self.TUNING_RULES.keys()
 
     @property
     def set_point(self):
@@ -346,6 +501,76 @@ class PIDAutotune:
             return 0
         return self._inputs.maxlen
 
+    @property
+    def last_timestamp(self):
+        """Get the timestamp of the last sample processed, None if no sample was received"""
+        if self._last_run_timestamp:
+            return self._last_run_timestamp
+        return self._last_sample_time
+
+    def snapshot(self):
+        """Get the tuning progress as a JSON serializable dict, to resume it with `restore`."""
+        return {
+            'version': PIDAutotune.SNAPSHOT_VERSION,
+            'out_step': self._outputstep,
+            'lookback': self._lookback,
+            'noiseband': self._noiseband,
+            'sample_time': self._sampletime,
+            'last_sample_time': self._last_sample_time,
+            'sample_time_calc': list(self._sample_time_calc),
+            'set_point': self._setpoint,
+            'state': self._state,
+            'output': self._output,
+            'initial_output': self._initial_output,
+            'last_run_timestamp': self._last_run_timestamp,
+            'buffer_length': self._inputs.maxlen,
+            'inputs': list(self._inputs),
+            'inputs_timestamps': list(self._inputs_timestamps),
+            'peak_type': self._peak_type,
+            'peak_count': self._peak_count,
+            'peaks': list(self._peaks),
+            'peak_timestamps': list(self._peak_timestamps),
+        }
+
+    def restore(self, snapshot):
+        """Resume the tuning progress saved by `snapshot`.
+
+        Raises:
+            ValueError: if the snapshot is invalid or was taken with other tuning settings.
+        """
+        try:
+            if snapshot['version'] != PIDAutotune.SNAPSHOT_VERSION:
+                raise ValueError(f"unsupported snapshot version {snapshot['version']}")
+            if (snapshot['out_step'], snapshot['lookback'], snapshot['noiseband']) != \
+                    (self._outputstep, self._lookback, self._noiseband):
+                raise ValueError('snapshot was taken with different tuning settings')
+            if snapshot['state'] not in [PIDAutotune.STATE_OFF, PIDAutotune.STATE_RELAY_STEP_UP,
+                                         PIDAutotune.STATE_RELAY_STEP_DOWN]:
+                raise ValueError(f"can not resume a tuning in state {snapshot['state']}")
+            inputs = deque(snapshot['inputs'], maxlen=snapshot['buffer_length'])
+            inputs_timestamps = deque(snapshot['inputs_timestamps'],
+                                      maxlen=snapshot['buffer_length'])
+            extrema = SlidingExtrema(snapshot['buffer_length'])
+            for input_val in inputs:
+                extrema.append(input_val)
+            self._sampletime = snapshot['sample_time']
+            self._last_sample_time = snapshot['last_sample_time']
+            self._sample_time_calc = list(snapshot['sample_time_calc'])
+            self._setpoint = snapshot['set_point']
+            self._state = snapshot['state']
+            self._output = snapshot['output']
+            self._initial_output = snapshot['initial_output']
+            self._last_run_timestamp = snapshot['last_run_timestamp']
+            self._inputs = inputs
+            self._inputs_timestamps = inputs_timestamps
+            self._extrema = extrema
+            self._peak_type = snapshot['peak_type']
+            self._peak_count = snapshot['peak_count']
+            self._peaks = deque(snapshot['peaks'], maxlen=5)
+            self._peak_timestamps = deque(snapshot['peak_timestamps'], maxlen=5)
+        except (KeyError, TypeError) as ex:
+            raise ValueError(f'invalid snapshot: {ex}') from ex
+
     def get_pid_parameters(self, tuning_rule='ziegler-nichols'):
         """Get PID parameters.
 
@@ -353,7 +578,7 @@ class PIDAutotune:
             tuning_rule (str): Sets the rule which should be used to calculate
                 the parameters.
         """
-        divisors = self._tuning_rules[tuning_rule]
+        divisors = self.TUNING_RULES[tuning_rule]
         kp = self._Ku / divisors[0]
         ki = kp / (self._Pu / divisors[1])
         kd = kp * (self._Pu / divisors[2])
@@ -384,6 +609,7 @@ class PIDAutotune:
             self._setpoint = set_point
             self._inputs = deque(maxlen=round(self._lookback / self._sampletime))
             self._inputs_timestamps = deque(maxlen=round(self._lookback / self._sampletime))
+            self._extrema = SlidingExtrema(self._inputs.maxlen)
 
         if self._state in [PIDAutotune.STATE_OFF, PIDAutotune.STATE_SUCCEEDED,
                            PIDAutotune.STATE_FAILED]:
@@ -413,16 +639,9 @@ class PIDAutotune:
         self._output = min(self._output, self._out_max)
         self._output = max(self._output, self._out_min)
 
-        # identify peaks
-        is_max = True
-        is_min = True
-
-        for val in self._inputs:
-            is_max = is_max and (input_val >= val)
-            is_min = is_min and (input_val <= val)
-
         self._inputs.append(input_val)
         self._inputs_timestamps.append(now)
+        self._extrema.append(input_val)
         self._last_run_timestamp = now
 
         # we don't want to trust the maxes or mins until the input array is full
@@ -430,8 +649,6 @@ class PIDAutotune:
             return False
 
         return self.analysis()
-        # increment peak count and record peak time for maxima and minima
-
 
     def _initTuner(self, inputValue, timestamp):
         self._peak_type = 0
@@ -441,86 +658,90 @@ class PIDAutotune:
         self._Ku = 0
         self._Pu = 0
         self._inputs.clear()
+        self._extrema.clear()
         self._peaks.clear()
         self._peak_timestamps.clear()
         # self._peak_timestamps.append(timestamp)
         self._state = PIDAutotune.STATE_RELAY_STEP_UP
 
     def analysis(self):
-        for index in range(self._inputs.maxlen):
-            input_val = self._inputs[index]
-            now = self._inputs_timestamps[index]
-            # identify peaks
-            is_max = True
-            is_min = True
-
-            for val in self._inputs:
-                is_max = is_max and (input_val >= val)
-                is_min = is_min and (input_val <= val)
-
-            # increment peak count and record peak time for maxima and minima
-            inflection = False
-
-            # peak types:
-            # -1: minimum
-            # +1: maximum
-            if is_max:
-                if self._peak_type == -1:
-                    inflection = True
-                self._peak_type = 1
-            elif is_min:
-                if self._peak_type == 1:
-                    inflection = True
-                self._peak_type = -1
-
-            # update peak times and values
-            if inflection:
-                self._peak_count += 1
-                self._peaks.append(input_val)
-                self._peak_timestamps.append(now)
-                _LOGGER.debug('found peak: %.1f', input_val)
-                _LOGGER.debug('peak count: %i', self._peak_count)
-
-            # check for convergence of induced oscillation
-            # convergence of amplitude assessed on last 4 peaks (1.5 cycles)
-            self._induced_amplitude = 0
-
-            if inflection and (self._peak_count > 4):
-                abs_max = self._peaks[-2]
-                abs_min = self._peaks[-2]
-                for i in range(0, len(self._peaks) - 2):
-                    self._induced_amplitude += abs(self._peaks[i] - self._peaks[i+1])
-                    abs_max = max(self._peaks[i], abs_max)
-                    abs_min = min(self._peaks[i], abs_min)
-
-                self._induced_amplitude /= 6.0
-
-                # check convergence criterion for amplitude of induced oscillation
-                amplitude_dev = ((0.5 * (abs_max - abs_min) - self._induced_amplitude)
-                                 / self._induced_amplitude)
-
-                _LOGGER.debug('amplitude: %.2f', self._induced_amplitude)
-                _LOGGER.debug('amplitude deviation: %.2f', amplitude_dev)
-
-                if amplitude_dev < PIDAutotune.PEAK_AMPLITUDE_TOLERANCE:
-                    self._state = PIDAutotune.STATE_SUCCEEDED
-
-            # if the autotune has not already converged
-            # terminate after 10 cycles
-            if self._peak_count >= 20:
-                self._output = 0
-                self._state = PIDAutotune.STATE_FAILED
-                return True
-
-            if self._state == PIDAutotune.STATE_SUCCEEDED:
-                self._output = 0
-
-                # calculate ultimate gain
-                self._Ku = 4.0 * self._outputstep / (self._induced_amplitude * math.pi)
-
-                # calculate ultimate period in seconds
-                period1 = self._peak_timestamps[3] - self._peak_timestamps[1]
-                period2 = self._peak_timestamps[4] - self._peak_timestamps[2]
-                self._Pu = 0.5 * (period1 + period2)
-                return True
-            return False
+        """Check if the oldest sample of the lookback window is a peak.
+
+        The window extrema are maintained incrementally by `SlidingExtrema`, so each call
+        costs O(1) instead of a rescan of the whole input buffer.
+
+        Returns:
+            `true` if tuning is finished, otherwise `false`.
+        """
+        input_val = self._inputs[0]
+        now = self._inputs_timestamps[0]
+        # identify peaks
+        is_max = input_val >= self._extrema.maximum
+        is_min = input_val <= self._extrema.minimum
+
+        # increment peak count and record peak time for maxima and minima
+        inflection = False
+
+        # peak types:
+        # -1: minimum
+        # +1: maximum
+        if is_max:
+            if self._peak_type == -1:
+                inflection = True
+            self._peak_type = 1
+        elif is_min:
+            if self._peak_type == 1:
+                inflection = True
+            self._peak_type = -1
+
+        # update peak times and values
+        if inflection:
+            self._peak_count += 1
+            self._peaks.append(input_val)
+            self._peak_timestamps.append(now)
+            _LOGGER.debug('found peak: %.1f', input_val)
+            _LOGGER.debug('peak count: %i', self._peak_count)
+
+        # check for convergence of induced oscillation
+        # convergence of amplitude assessed on last 4 peaks (1.5 cycles)
+        self._induced_amplitude = 0
+
+        if inflection and (self._peak_count > 4):
+            abs_max = self._peaks[-2]
+            abs_min = self._peaks[-2]
+            for i in range(0, len(self._peaks) - 2):
+                self._induced_amplitude += abs(self._peaks[i] - self._peaks[i+1])
+                abs_max = max(self._peaks[i], abs_max)
+                abs_min = min(self._peaks[i], abs_min)
+
+            self._induced_amplitude /= 6.0
+
+            # check convergence criterion for amplitude of induced oscillation
+            amplitude_dev = ((0.5 * (abs_max - abs_min) - self._induced_amplitude)
+                             / self._induced_amplitude)
+
+            _LOGGER.debug('amplitude: %.2f', self._induced_amplitude)
+            _LOGGER.debug('amplitude deviation: %.2f', amplitude_dev)
+
+            if amplitude_dev < PIDAutotune.PEAK_AMPLITUDE_TOLERANCE:
+                self._state = PIDAutotune.STATE_SUCCEEDED
+
+        # if the autotune has not already converged
+        # terminate after 10 cycles
+        if self._peak_count >= 20:
+            self._output = 0
+            self._state = PIDAutotune.STATE_FAILED
+            return True
+
+        if self._state == PIDAutotune.STATE_SUCCEEDED:
+            self._output = 0
+
+            # calculate ultimate gain
+            self._Ku = 4.0 * self._outputstep / (self._induced_amplitude * math.pi)
+
+            # calculate ultimate period in seconds
+            period1 = self._peak_timestamps[3] - self._peak_timestamps[1]
+            period2 = self._peak_timestamps[4] - self._peak_timestamps[2]
+            self._Pu = 0.5 * (period1 + period2)
+            return True
+        return False
@@ -0,0 +1,466 @@
+import logging
+import math
+
+import numpy as np
+
+from . import PID, default_clock
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class PIDBank:
+    """A bank of N proportional-integral-derivative controllers computed in one step.
+
+    The state of every controller is stored in NumPy arrays and `calc` updates all of them
+    with vectorized operations. Each controller behaves exactly like `PID.calc`: same
+    anti-windup, same integral reset on set point change and same outdoor compensation.
+    Missing values (no previous input, no outdoor temperature) are stored as NaN.
+
+    The vectorized step has a fixed cost of a few hundred microseconds, so the bank is only
+    faster than calling `PID.calc` for each controller from about 60 controllers (see the
+    `pid_fleet` benchmark); smaller fleets should keep using `PID`.
+
+    Args:
+        time_func (function): A function which returns the current time in seconds, used by
+            controllers having a sampling period.
+    """
+
+    _FIELDS = {
+        # field: initial value
+        'kp': np.nan,
+        'ki': np.nan,
+        'kd': np.nan,
+        'ke': 0.0,
+        'out_min': -np.inf,
+        'out_max': np.inf,
+        'sampling_period': 0.0,
+        'cold_tolerance': 0.3,
+        'hot_tolerance': 0.3,
+        'auto': True,
+        'proportional': 0.0,
+        'integral': 0.0,
+        'derivative': 0.0,
+        'external': 0.0,
+        'error': 0.0,
+        'input_diff': 0.0,
+        'dext': 0.0,
+        'dt': 0.0,
+        'set_point': 0.0,
+        'last_set_point': 0.0,
+        'input': np.nan,
+        'input_time': np.nan,
+        'last_input': np.nan,
+        'last_input_time': np.nan,
+        'output': 0.0,
+        'last_output': 0.0,
+    }
+
+    def __init__(self, time_func=default_clock):
+        self._time = time_func
+        self._size = 0
+        for field, value in self._FIELDS.items():
+            dtype = bool if isinstance(value, bool) else float
+            setattr(self, f'_{field}', np.empty(0, dtype=dtype))
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        if not -self._size <= index < self._size:
+            raise IndexError('PID bank index out of range')
+        return PIDBankController(self, index % self._size)
+
+    @property
+    def outputs(self):
+        """Get the last outputs of all controllers."""
+        return self._output
+
+    @property
+    def errors(self):
+        return self._error
+
+    @property
+    def proportionals(self):
+        return self._proportional
+
+    @property
+    def integrals(self):
+        return self._integral
+
+    @property
+    def derivatives(self):
+        return self._derivative
+
+    @property
+    def externals(self):
+        return self._external
+
+    @property
+    def dts(self):
+        return self._dt
+
+    def add(self, kp, ki, kd, ke=0, out_min=float('-inf'), out_max=float('+inf'),
+            sampling_period=0, cold_tolerance=0.3, hot_tolerance=0.3):
+        """Add a controller to the bank, with the same parameters as `PID`.
+
+        Returns:
+            A `PIDBankController` giving scalar access to the new controller.
+        """
+        if kp is None:
+            raise ValueError('kp must be specified')
+        if ki is None:
+            raise ValueError('ki must be specified')
+        if kd is None:
+            raise ValueError('kd must be specified')
+        if out_min >= out_max:
+            raise ValueError('out_min must be less than out_max')
+
+        values = dict(self._FIELDS, kp=kp, ki=ki, kd=kd, ke=ke, out_min=out_min,
+                      out_max=out_max, sampling_period=sampling_period,
+                      cold_tolerance=cold_tolerance, hot_tolerance=hot_tolerance)
+        for field, value in values.items():
+            array = getattr(self, f'_{field}')
+            setattr(self, f'_{field}', np.append(array, np.array([value], dtype=array.dtype)))
+        self._size += 1
+        return PIDBankController(self, self._size - 1)
+
+    def set_pid_param(self, index, kp=None, ki=None, kd=None, ke=None):
+        """Set PID parameters of a controller."""
+        for field, value in (('kp', kp), ('ki', ki), ('kd', kd), ('ke', ke)):
+            if value is not None and isinstance(value, (int, float)):
+                getattr(self, f'_{field}')[index] = value
+
+    def clear_samples(self, index=None):
+        """Clear the samples values and timestamps of one or all controllers."""
+        selection = slice(None) if index is None else index
+        self._input[selection] = np.nan
+        self._input_time[selection] = np.nan
+        self._last_input[selection] = np.nan
+        self._last_input_time[selection] = np.nan
+
+    def calc(self, input_vals, set_points, input_times=None, last_input_times=None,
+             ext_temps=None, mask=None):
+        """Adjusts and holds the given setpoints of all controllers.
+
+        Args:
+            input_vals (array): The input values.
+            set_points (array): The target values.
+            input_times (array): The timestamps in seconds of the input values to compute dt,
+                used by controllers without sampling period.
+            last_input_times (array): The timestamps in seconds of the previous input values
+                to compute dt, used by controllers without sampling period.
+            ext_temps (array): The outdoor temperature values, NaN if not available.
+            mask (array): Boolean selection of the controllers to compute, others are left
+                untouched.
+
+        Returns:
+            A tuple with the array of outputs, each between `out_min` and `out_max`, and the
+            boolean array of controllers whose output was updated.
+        """
+        size = self._size
+        input_vals = np.broadcast_to(np.asarray(input_vals, dtype=float), size)
+        set_points = np.broadcast_to(np.asarray(set_points, dtype=float), size)
+        input_times = self._as_array(input_times)
+        last_input_times = self._as_array(last_input_times)
+        ext_temps = self._as_array(ext_temps)
+        if mask is None:
+            mask = np.ones(size, dtype=bool)
+
+        sampled = self._sampling_period != 0
+        if sampled.any():
+            now = self._time()
+            # If last sample is too young, keep last output value
+            too_young = sampled & ~np.isnan(self._last_input_time) & \
+                (now - self._input_time < self._sampling_period)
+            mask = mask & ~too_young
+        else:
+            now = np.nan
+        if not mask.any():
+            return self._output.copy(), mask
+
+        m = mask
+        self._last_input[m] = self._input[m]
+        self._last_input_time[m] = np.where(sampled, self._input_time, last_input_times)[m]
+        self._last_output[m] = self._output[m]
+
+        # Refresh with actual values
+        self._input[m] = input_vals[m]
+        self._input_time[m] = np.where(sampled, now, input_times)[m]
+        self._last_set_point[m] = self._set_point[m]
+        self._set_point[m] = set_points[m]
+
+        # If PID is off, simply switch between min and max output
+        off = m & ~self._auto
+        cold = off & (input_vals <= set_points - self._cold_tolerance)
+        hot = off & ~cold & (input_vals >= set_points + self._hot_tolerance)
+        self._output[cold] = self._out_max[cold]
+        self._output[hot] = self._out_min[hot]
+        updated = cold | hot
+
+        a = m & self._auto
+        if a.any():
+            # Compute all the working error variables
+            self._error[a] = (set_points - input_vals)[a]
+            has_last_input = ~np.isnan(self._last_input)
+            self._input_diff[a] = np.where(has_last_input, self._input - self._last_input,
+                                           0.0)[a]
+            has_last_time = ~np.isnan(self._last_input_time)
+            self._dt[a] = np.where(has_last_time, self._input_time - self._last_input_time,
+                                   0.0)[a]
+            has_ext = ~np.isnan(ext_temps)
+            self._dext[a] = np.where(has_ext, set_points - ext_temps, 0.0)[a]
+
+            # Compensate losses due to external temperature
+            self._external[a] = (self._ke * self._dext)[a]
+
+            # In order to prevent windup, only integrate if the process is not saturated and
+            # set point is stable
+            integrate = a & (self._out_min < self._last_output) & \
+                (self._last_output < self._out_max) & (self._last_set_point == self._set_point)
+            integral = self._integral + self._ki * self._error * self._dt
+            # Take external temperature compensation into account for integral clamping
+            integral = np.maximum(np.minimum(integral, self._out_max - self._external),
+                                  self._out_min - self._external)
+            self._integral[integrate] = integral[integrate]
+            # Reset integral if set point has changed as system will need to converge to a new
+            # value
+            self._integral[a & has_ext & (self._last_set_point != self._set_point)] = 0.0
+
+            self._proportional[a] = (self._kp * self._error)[a]
+            has_dt = self._dt != 0
+            derivative = -(self._kd * self._input_diff) / np.where(has_dt, self._dt, 1.0)
+            self._derivative[a] = np.where(has_dt, derivative, 0.0)[a]
+
+            # Compute PID Output
+            output = self._proportional + self._integral + self._derivative + self._external
+            self._output[a] = np.maximum(np.minimum(output, self._out_max), self._out_min)[a]
+            updated |= a
+
+        return self._output.copy(), updated
+
+    def _calc_slot(self, index, input_val, set_point, input_time, last_input_time, ext_temp):
+        """Same as `calc` for a single controller, computed with scalars on its slot only.
+
+        Returns:
+            A tuple with the output and whether it was updated.
+        """
+        i = index
+        sampling_period = float(self._sampling_period[i])
+        if sampling_period != 0:
+            now = self._time()
+            # If last sample is too young, keep last output value
+            if not math.isnan(self._last_input_time[i]) and \
+                    now - self._input_time[i] < sampling_period:
+                return float(self._output[i]), False
+            last_input_time = float(self._input_time[i])
+            input_time = now
+        last_input = float(self._input[i])
+        last_output = float(self._output[i])
+        last_set_point = float(self._set_point[i])
+        self._last_input[i] = last_input
+        self._last_input_time[i] = last_input_time
+        self._last_output[i] = last_output
+
+        # Refresh with actual values
+        self._input[i] = input_val
+        self._input_time[i] = input_time
+        self._last_set_point[i] = last_set_point
+        self._set_point[i] = set_point
+
+        out_min = float(self._out_min[i])
+        out_max = float(self._out_max[i])
+        # If PID is off, simply switch between min and max output
+        if not self._auto[i]:
+            if input_val <= set_point - self._cold_tolerance[i]:
+                self._output[i] = out_max
+                return out_max, True
+            if input_val >= set_point + self._hot_tolerance[i]:
+                self._output[i] = out_min
+                return out_min, True
+            return last_output, False
+
+        # Compute all the working error variables
+        error = set_point - input_val
+        input_diff = 0.0 if math.isnan(last_input) else input_val - last_input
+        dt = 0.0 if math.isnan(last_input_time) else input_time - last_input_time
+        has_ext = not math.isnan(ext_temp)
+        dext = set_point - ext_temp if has_ext else 0.0
+
+        # Compensate losses due to external temperature
+        external = float(self._ke[i]) * dext
+
+        # In order to prevent windup, only integrate if the process is not saturated and set
+        # point is stable
+        integral = float(self._integral[i])
+        if out_min < last_output < out_max and last_set_point == set_point:
+            integral += float(self._ki[i]) * error * dt
+            # Take external temperature compensation into account for integral clamping
+            integral = max(min(integral, out_max - external), out_min - external)
+        # Reset integral if set point has changed as system will need to converge to a new value
+        if has_ext and last_set_point != set_point:
+            integral = 0.0
+
+        proportional = float(self._kp[i]) * error
+        derivative = -(float(self._kd[i]) * input_diff) / dt if dt != 0 else 0.0
+
+        # Compute PID Output
+        output = max(min(proportional + integral + derivative + external, out_max), out_min)
+        self._error[i] = error
+        self._input_diff[i] = input_diff
+        self._dt[i] = dt
+        self._dext[i] = dext
+        self._external[i] = external
+        self._integral[i] = integral
+        self._proportional[i] = proportional
+        self._derivative[i] = derivative
+        self._output[i] = output
+        return output, True
+
+    def _as_array(self, values):
+        if values is None:
+            return np.full(self._size, np.nan)
+        values = np.asarray(values, dtype=float)
+        return np.broadcast_to(values, self._size)
+
+
+class PIDBankController:
+    """Scalar view on one controller of a `PIDBank`, with the same interface as `PID`."""
+
+    def __init__(self, bank, index):
+        self._bank = bank
+        self._index = index
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def mode(self):
+        return 'AUTO' if self._bank._auto[self._index] else 'OFF'
+
+    @mode.setter
+    def mode(self, mode):
+        assert mode.upper() in ['AUTO', 'OFF']
+        self._bank._auto[self._index] = mode.upper() == 'AUTO'
+
+    @property
+    def out_max(self):
+        return float(self._bank._out_max[self._index])
+
+    @out_max.setter
+    def out_max(self, out_max):
+        self._bank._out_max[self._index] = out_max
+
+    @property
+    def out_min(self):
+        return float(self._bank._out_min[self._index])
+
+    @out_min.setter
+    def out_min(self, out_min):
+        self._bank._out_min[self._index] = out_min
+
+    @property
+    def sampling_period(self):
+        return float(self._bank._sampling_period[self._index])
+
+    @property
+    def error(self):
+        return float(self._bank._error[self._index])
+
+    @property
+    def proportional(self):
+        return float(self._bank._proportional[self._index])
+
+    @property
+    def integral(self):
+        return float(self._bank._integral[self._index])
+
+    @integral.setter
+    def integral(self, i):
+        assert isinstance(i, float), "Integral should be a float"
+        self._bank._integral[self._index] = i
+
+    @property
+    def derivative(self):
+        return float(self._bank._derivative[self._index])
+
+    @property
+    def external(self):
+        return float(self._bank._external[self._index])
+
+    @property
+    def dt(self):
+        return float(self._bank._dt[self._index])
+
+    def set_pid_param(self, kp=None, ki=None, kd=None, ke=None):
+        """Set PID parameters."""
+        self._bank.set_pid_param(self._index, kp, ki, kd, ke)
+
+    def clear_samples(self):
+        """Clear the samples values and timestamp to restart PID from clean state after
+        a switch off of the thermostat"""
+        self._bank.clear_samples(self._index)
+
+    def snapshot(self):
+        """Get the controller state as a JSON serializable dict, to resume it with `restore`.
+
+        The snapshot has the format of `PID.snapshot`, so it can be restored by either.
+        """
+        bank, index = self._bank, self._index
+
+        def optional(value):
+            return None if math.isnan(value) else float(value)
+        return {
+            'version': PID.SNAPSHOT_VERSION,
+            'kp': float(bank._kp[index]),
+            'ki': float(bank._ki[index]),
+            'kd': float(bank._kd[index]),
+            'ke': float(bank._ke[index]),
+            'mode': self.mode,
+            'integral': self.integral,
+            'set_point': float(bank._set_point[index]),
+            'input': optional(bank._input[index]),
+            'input_time': optional(bank._input_time[index]),
+            'last_input': optional(bank._last_input[index]),
+            'last_input_time': optional(bank._last_input_time[index]),
+            'output': float(bank._output[index]),
+        }
+
+    def restore(self, snapshot, samples=True):
+        """Resume the controller state saved by `snapshot` or `PID.snapshot`.
+
+        Args:
+            snapshot (dict): The state returned by `snapshot`.
+            samples (bool): Restore the last input values and timestamps, set to False if they
+                are too old to compute a meaningful derivative and integral.
+
+        Raises:
+            ValueError: if the snapshot is invalid.
+        """
+        # Validated and clamped to the output limits like a PID
+        pid = PID(0, 0, 0, out_min=self.out_min, out_max=self.out_max)
+        pid.restore(snapshot, samples)
+        state = pid.snapshot()
+        bank, index = self._bank, self._index
+        bank.set_pid_param(index, state['kp'], state['ki'], state['kd'], state['ke'])
+        self.mode = state['mode']
+        bank._integral[index] = state['integral']
+        bank._last_set_point[index] = bank._set_point[index] = state['set_point']
+        bank._last_output[index] = bank._output[index] = state['output']
+        for field in ('input', 'input_time', 'last_input', 'last_input_time'):
+            getattr(bank, f'_{field}')[index] = np.nan if state[field] is None else state[field]
+
+    def calc(self, input_val, set_point, input_time=None, last_input_time=None, ext_temp=None):
+        """Adjusts and holds the given setpoint, computing only this controller of the bank.
+
+        The other controllers are not touched, use `PIDBank.calc` to compute all of them in
+        one step.
+
+        Returns:
+            A value between `out_min` and `out_max`.
+        """
+        return self._bank._calc_slot(
+            self._index, float(input_val), float(set_point),
+            math.nan if input_time is None else float(input_time),
+            math.nan if last_input_time is None else float(last_input_time),
+            math.nan if ext_temp is None else float(ext_temp))
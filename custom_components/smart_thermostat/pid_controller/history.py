@@ -0,0 +1,154 @@
+import logging
+import math
+from collections import deque
+
+from . import PIDAutotune
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class HistoryAutotune:
+    """Determines PID parameters from the recorded on/off cycles of a heating system.
+
+    When a heater is driven by an on/off (hysteresis) thermostat, each heating cycle is the
+    response to a relay, like the one induced by `PIDAutotune`. The cycles are measured from
+    one heater rising edge to the next, the peak-to-peak amplitude of the temperature and the
+    cycle period give the ultimate gain and period with the describing function method:
+    `Ku = 4 * d / (pi * a)`, `d` and `a` being the half swing of the output and of the
+    temperature.
+
+    Samples are consumed one at a time so any length of history is analyzed in constant
+    memory. Temperatures are held between samples (zero-order hold), so only the recorded
+    state changes are needed.
+
+    Args:
+        out_step (float): The output swing between heater off and heater on.
+        max_period (float): The longest cycle in seconds considered as a relay cycle, longer
+            cycles (heating off, open window...) are discarded.
+        min_amplitude (float): The smallest peak-to-peak temperature amplitude of a relay
+            cycle, smaller cycles (PWM of a PID controller) are discarded.
+        cycles (int): The number of most recent valid cycles averaged.
+        min_cycles (int): The number of valid cycles needed for the tuning to succeed.
+    """
+
+    def __init__(self, out_step=100, max_period=4 * 3600, min_amplitude=0.2, cycles=10,
+                 min_cycles=3):
+        if out_step <= 0:
+            raise ValueError('out_step must be positive')
+        if not 0 < min_cycles <= cycles:
+            raise ValueError('min_cycles must be between 1 and cycles')
+        self._outputstep = out_step
+        self._max_period = max_period
+        self._min_amplitude = min_amplitude
+        self._min_cycles = min_cycles
+        self._cycles = deque(maxlen=cycles)
+        self._temperature = None
+        self._heater_on = None
+        self._cycle_start = None
+        self._cycle_max = None
+        self._cycle_min = None
+        self._samples = 0
+        self._discarded = 0
+
+    @property
+    def samples(self):
+        return self._samples
+
+    @property
+    def cycle_count(self):
+        """Get the number of valid cycles used for the analysis."""
+        return len(self._cycles)
+
+    @property
+    def discarded(self):
+        """Get the number of complete cycles rejected as not being relay cycles."""
+        return self._discarded
+
+    @property
+    def state(self):
+        if len(self._cycles) >= self._min_cycles:
+            return PIDAutotune.STATE_SUCCEEDED
+        return PIDAutotune.STATE_FAILED
+
+    @property
+    def tuning_rules(self):
+        """Get a list of all available tuning rules."""
+        return PIDAutotune.TUNING_RULES.keys()
+
+    @property
+    def Pu(self):
+        """Get the ultimate period in seconds, mean of the analyzed cycles periods."""
+        if not self._cycles:
+            return None
+        return sum(period for period, _ in self._cycles) / len(self._cycles)
+
+    @property
+    def Ku(self):
+        """Get the ultimate gain."""
+        if not self._cycles:
+            return None
+        amplitude = sum(amplitude for _, amplitude in self._cycles) / len(self._cycles)
+        return 4.0 * (self._outputstep / 2) / (math.pi * amplitude / 2)
+
+    def feed(self, samples):
+        """Analyze an iterable of `(timestamp, temperature, heater_on)` samples.
+
+        `temperature` or `heater_on` is None when the sample doesn't update it. A sample where
+        both are None marks a gap in the history (unavailable entity) and interrupts the
+        current cycle.
+
+        Returns:
+            `true` if enough cycles were found, otherwise `false`.
+        """
+        for timestamp, temperature, heater_on in samples:
+            self.update(timestamp, temperature, heater_on)
+        _LOGGER.debug('analyzed %i samples: %i cycles found, %i discarded', self._samples,
+                      len(self._cycles), self._discarded)
+        return self.state == PIDAutotune.STATE_SUCCEEDED
+
+    def update(self, timestamp, temperature=None, heater_on=None):
+        """Add one sample to the analysis."""
+        self._samples += 1
+        if temperature is None and heater_on is None:
+            self._cycle_start = None
+            return
+        if temperature is not None:
+            self._temperature = temperature
+            if self._cycle_start is not None:
+                self._cycle_max = max(self._cycle_max, temperature)
+                self._cycle_min = min(self._cycle_min, temperature)
+        if heater_on is None:
+            return
+        rising_edge = heater_on and self._heater_on is False
+        self._heater_on = heater_on
+        if not rising_edge or self._temperature is None:
+            return
+        if self._cycle_start is not None:
+            self._close_cycle(timestamp)
+        self._cycle_start = timestamp
+        self._cycle_max = self._cycle_min = self._temperature
+
+    def _close_cycle(self, timestamp):
+        period = timestamp - self._cycle_start
+        amplitude = self._cycle_max - self._cycle_min
+        if period > self._max_period or amplitude < self._min_amplitude:
+            self._discarded += 1
+            return
+        _LOGGER.debug('found cycle: period %.0f s, amplitude %.2f', period, amplitude)
+        self._cycles.append((period, amplitude))
+
+    def get_pid_parameters(self, tuning_rule='ziegler-nichols'):
+        """Get PID parameters.
+
+        Args:
+            tuning_rule (str): Sets the rule which should be used to calculate
+                the parameters.
+        """
+        if self.state != PIDAutotune.STATE_SUCCEEDED:
+            raise ValueError(f'not enough cycles found: {len(self._cycles)} out of '
+                             f'{self._min_cycles}')
+        divisors = PIDAutotune.TUNING_RULES[tuning_rule]
+        kp = self.Ku / divisors[0]
+        ki = kp / (self.Pu / divisors[1])
+        kd = kp * (self.Pu / divisors[2])
+        return PIDAutotune.PIDParams(kp, ki, kd)
@@ -0,0 +1,193 @@
+import logging
+import math
+from collections import namedtuple
+
+import numpy as np
+
+from . import PIDAutotune
+
+_LOGGER = logging.getLogger(__name__)
+
+FOPDTModel = namedtuple('FOPDTModel', ['gain', 'time_constant', 'dead_time', 'ke', 'offset',
+                                       'rmse'])
+FOPDTModel.__doc__ = """First order plus dead time model of a room heated by the controller output.
+
+    `tau * dT/dt = outdoor + offset + gain * output(t - dead_time) - T`
+
+    gain (float): Temperature rise in steady state per unit of output.
+    time_constant (float): Time constant in seconds.
+    dead_time (float): Delay in seconds between the output and the temperature response.
+    ke (float): Outdoor compensation gain of the PID matching the model, `1 / gain`.
+    offset (float): Constant temperature rise from other heat sources.
+    rmse (float): Root mean square error of the one step ahead prediction.
+"""
+
+# Number of dead times evaluated on the coarse grid before refining around the best one
+_COARSE_DEAD_TIMES = 16
+
+
+def resample(timestamps, values, start, end, sample_time):
+    """Resample irregular samples on a regular grid with a zero-order hold.
+
+    Args:
+        timestamps (array): The sorted timestamps of the samples in seconds.
+        values (array): The values of the samples.
+        start (float): The timestamp of the first point of the grid.
+        end (float): The timestamp after the last point of the grid.
+        sample_time (float): The interval between points of the grid in seconds.
+
+    Returns:
+        The array of the values held at each point of the grid, NaN before the first sample.
+    """
+    timestamps = np.asarray(timestamps, dtype=float)
+    values = np.asarray(values, dtype=float)
+    grid = np.arange(start, end, sample_time)
+    index = np.searchsorted(timestamps, grid, side='right') - 1
+    return np.where(index >= 0, values[np.maximum(index, 0)], np.nan)
+
+
+def fit_fopdt(temperatures, outputs, outdoor=None, sample_time=60, max_dead_time=7200):
+    """Fit a first order plus dead time model to regularly sampled data with least squares.
+
+    The exact discretization of the model is linear in its coefficients for a given dead
+    time: `T[k+1] - T[k] = a * (outdoor[k] - T[k]) + b * output[k - d] + c`. The normal
+    equations of all the dead times share most of their terms, only the correlations of the
+    delayed output are computed for each of them, on a coarse grid first and then around the
+    best dead time.
+
+    Args:
+        temperatures (array): The room temperatures.
+        outputs (array): The controller outputs.
+        outdoor (array): The outdoor temperatures, a constant outdoor temperature is assumed
+            and merged in the offset if not available.
+        sample_time (float): The interval between samples in seconds.
+        max_dead_time (float): The longest dead time considered in seconds.
+
+    Returns:
+        The `FOPDTModel` with the smallest prediction error.
+
+    Raises:
+        ValueError: if the data is not enough or doesn't fit a stable heating process.
+    """
+    y = np.asarray(temperatures, dtype=float)
+    u = np.asarray(outputs, dtype=float)
+    o = np.zeros_like(y) if outdoor is None else np.asarray(outdoor, dtype=float)
+    if not y.shape == u.shape == o.shape or y.ndim != 1:
+        raise ValueError('temperatures, outputs and outdoor must be 1D arrays of same length')
+    # Skip the beginning of the period until every signal has a value
+    first = max(int(np.argmax(np.isfinite(signal))) for signal in (y, u, o))
+    y, u, o = y[first:], u[first:], o[first:]
+    if not (np.isfinite(y).all() and np.isfinite(u).all() and np.isfinite(o).all()):
+        raise ValueError('samples must not contain gaps')
+
+    max_lag = int(max_dead_time // sample_time)
+    n = len(y) - 1
+    m = n - max_lag
+    if m < 10 * (max_lag + 1):
+        raise ValueError(f'not enough samples: {len(y)} for a dead time up to '
+                         f'{max_dead_time} s')
+
+    dy = y[max_lag + 1:] - y[max_lag:-1]
+    z = o[max_lag:n] - y[max_lag:n]
+    targets = np.vstack([z, dy])
+    # Sums of the delayed output for every lag from cumulative sums
+    u_sum = np.concatenate([[0.0], np.cumsum(u[:n])])
+    u_sq_sum = np.concatenate([[0.0], np.cumsum(u[:n] * u[:n])])
+    s_zz, s_z = z @ z, z.sum()
+    s_zy, s_y, s_yy = z @ dy, dy.sum(), dy @ dy
+
+    def solve(lags):
+        lags = np.asarray(lags)
+        begin = max_lag - lags
+        s_u = u_sum[begin + m] - u_sum[begin]
+        s_uu = u_sq_sum[begin + m] - u_sq_sum[begin]
+        s_uz, s_uy = np.array([targets @ u[lag:lag + m] for lag in begin]).T
+        normal = np.empty((len(lags), 3, 3))
+        normal[:, 0, 0] = s_zz
+        normal[:, 0, 1] = normal[:, 1, 0] = s_uz
+        normal[:, 0, 2] = normal[:, 2, 0] = s_z
+        normal[:, 1, 1] = s_uu
+        normal[:, 1, 2] = normal[:, 2, 1] = s_u
+        normal[:, 2, 2] = m
+        rhs = np.stack([np.full(len(lags), s_zy), s_uy, np.full(len(lags), s_y)], axis=1)
+        try:
+            coefficients = np.linalg.solve(normal, rhs[..., None])[..., 0]
+        except np.linalg.LinAlgError as ex:
+            raise ValueError(f'outputs are not exciting the process: {ex}') from ex
+        errors = s_yy - np.einsum('ij,ij->i', coefficients, rhs)
+        return coefficients, errors
+
+    stride = max(1, (max_lag + 1) // _COARSE_DEAD_TIMES)
+    coarse = np.arange(0, max_lag + 1, stride)
+    _, errors = solve(coarse)
+    best = coarse[np.argmin(errors)]
+    fine = np.arange(max(0, best - stride + 1), min(max_lag, best + stride - 1) + 1)
+    coefficients, errors = solve(fine)
+    index = np.argmin(errors)
+    a, b, c = coefficients[index]
+    lag = fine[index]
+    _LOGGER.debug('best dead time %i samples: a=%g, b=%g, c=%g', lag, a, b, c)
+    if not 0 < a < 1 or b <= 0:
+        raise ValueError(f'identified model is not a stable heating process: a={a}, b={b}')
+
+    gain = float(b / a)
+    return FOPDTModel(gain=gain, time_constant=-sample_time / math.log(1 - a),
+                      dead_time=float(lag * sample_time), ke=1 / gain, offset=float(c / a),
+                      rmse=math.sqrt(max(errors[index], 0.0) / m))
+
+
+def _closed_loop_time_constant(model, closed_loop_time_constant):
+    if closed_loop_time_constant is not None:
+        return closed_loop_time_constant
+    return max(model.dead_time, model.time_constant / 10)
+
+
+def imc_parameters(model, closed_loop_time_constant=None):
+    """Get PID parameters with the internal model control rule for a FOPDT process.
+
+    Args:
+        model (FOPDTModel): The process model.
+        closed_loop_time_constant (float): The desired closed loop time constant in seconds,
+            the larger the smoother. Defaults to the dead time, or a tenth of the time
+            constant for fast processes.
+    """
+    tau, theta = model.time_constant, model.dead_time
+    lam = _closed_loop_time_constant(model, closed_loop_time_constant)
+    kp = (2 * tau + theta) / (model.gain * (2 * lam + theta))
+    ti = tau + theta / 2
+    td = tau * theta / (2 * tau + theta)
+    return PIDAutotune.PIDParams(kp, kp / ti, kp * td)
+
+
+def simc_parameters(model, closed_loop_time_constant=None):
+    """Get PI parameters with the Skogestad SIMC rule for a FOPDT process.
+
+    Args:
+        model (FOPDTModel): The process model.
+        closed_loop_time_constant (float): The desired closed loop time constant in seconds,
+            the larger the smoother. Defaults to the dead time for tight control, or a tenth
+            of the time constant for fast processes.
+    """
+    tau, theta = model.time_constant, model.dead_time
+    tc = _closed_loop_time_constant(model, closed_loop_time_constant)
+    kp = tau / (model.gain * (tc + theta))
+    ti = min(tau, 4 * (tc + theta))
+    return PIDAutotune.PIDParams(kp, kp / ti, 0.0)
+
+
+tuning_rules = {
+    'imc': imc_parameters,
+    'simc': simc_parameters,
+}
+
+
+def get_pid_parameters(model, tuning_rule='simc', closed_loop_time_constant=None):
+    """Get PID parameters of a process model.
+
+    Args:
+        model (FOPDTModel): The process model.
+        tuning_rule (str): Sets the rule which should be used to calculate the parameters,
+            one of `tuning_rules`.
+        closed_loop_time_constant (float): The desired closed loop time constant in seconds.
+    """
+    return tuning_rules[tuning_rule](model, closed_loop_time_constant)
@@ -0,0 +1,91 @@
+"""Coalesced publishing of the thermostat state."""
+from contextlib import contextmanager
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.event import async_call_later
+
+from .pid_controller import default_clock
+
+
+class StatePublisher:
+    """Collapse the state writes of an entity.
+
+    Writes requested during a control cycle are published once, when the outermost cycle
+    ends. With a minimum interval, a write requested too soon after the previous one is
+    delayed until the interval has elapsed and merged with the writes requested meanwhile.
+
+    Args:
+        hass: The Home Assistant instance.
+        write (function): The function writing the state, `async_write_ha_state`.
+        min_interval (float): The minimum interval between two writes in seconds, 0 to write
+            as soon as possible.
+        time_func (function): A function which returns the current time in seconds.
+    """
+
+    def __init__(self, hass: HomeAssistant, write, min_interval=0, time_func=default_clock):
+        self._hass = hass
+        self._write = write
+        self._min_interval = min_interval
+        self._time = time_func
+        self._depth = 0
+        self._pending = False
+        self._last_write = None
+        self._unsub_delayed = None
+        self._requested = 0
+        self._written = 0
+
+    @property
+    def requested(self):
+        """Get the number of writes requested."""
+        return self._requested
+
+    @property
+    def written(self):
+        """Get the number of writes actually published."""
+        return self._written
+
+    @contextmanager
+    def cycle(self):
+        """Defer the writes requested in this block until the outermost cycle ends."""
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            if self._depth == 0 and self._pending:
+                self._flush()
+
+    @callback
+    def publish(self):
+        """Request a write of the state."""
+        self._requested += 1
+        self._pending = True
+        if self._depth == 0:
+            self._flush()
+
+    @callback
+    def cancel(self):
+        """Cancel a delayed write."""
+        if self._unsub_delayed is not None:
+            self._unsub_delayed()
+            self._unsub_delayed = None
+
+    @callback
+    def _flush(self):
+        if self._unsub_delayed is not None:
+            return  # Already waiting for the minimum interval
+        if self._min_interval and self._last_write is not None:
+            delay = self._last_write + self._min_interval - self._time()
+            if delay > 0:
+                self._unsub_delayed = async_call_later(self._hass, delay, self._async_delayed)
+                return
+        self._pending = False
+        self._last_write = self._time()
+        self._written += 1
+        self._write()
+
+    @callback
+    def _async_delayed(self, _now):
+        self._unsub_delayed = None
+        if self._pending and self._depth == 0:
+            self._flush()
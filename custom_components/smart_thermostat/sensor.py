@@ -0,0 +1,90 @@
+"""Diagnostic sensors of the PID controller of a Smart Thermostat."""
+import logging
+
+from homeassistant.components.sensor import SensorEntity, SensorStateClass
+from homeassistant.const import UnitOfTime
+from homeassistant.core import Event, EventStateChangedData, callback
+from homeassistant.helpers.event import async_track_state_change_event
+
+from . import DOMAIN
+from .const import DATA_THERMOSTATS
+from .coordinator import TickCoordinator
+
+_LOGGER = logging.getLogger(__name__)
+
+# attribute of the thermostat: (name, unit, published without debug)
+DIAGNOSTIC_SENSORS = {
+    'control_output': ('control output', None, True),
+    'pid_i': ('PID integral', None, True),
+    'pid_p': ('PID proportional', None, False),
+    'pid_d': ('PID derivative', None, False),
+    'pid_e': ('PID external', None, False),
+    'pid_dt': ('PID dt', UnitOfTime.SECONDS, False),
+}
+
+
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
+    """Set up the diagnostic sensors of a thermostat, discovered by the climate platform."""
+    if discovery_info is None:
+        return
+    entity_id = discovery_info['entity_id']
+    thermostat = hass.data.get(DOMAIN, {}).get(DATA_THERMOSTATS, {}).get(entity_id)
+    if thermostat is None:
+        _LOGGER.warning("Thermostat %s removed before its diagnostic sensors were created",
+                        entity_id)
+        return
+    async_add_entities([
+        DiagnosticSensor(entity_id, f"{thermostat.name} {name}",
+                         f"{thermostat.unique_id}_{attribute}", attribute, unit,
+                         discovery_info['sampling_period'])
+        for attribute, (name, unit, always) in DIAGNOSTIC_SENSORS.items()
+        if always or discovery_info['debug']])
+
+
+class DiagnosticSensor(SensorEntity):
+    """A PID value of a thermostat, sampled periodically from the thermostat state.
+
+    The sensor follows the state changes of the thermostat, and is removed with it.
+    """
+
+    _attr_should_poll = False
+    _attr_state_class = SensorStateClass.MEASUREMENT
+
+    def __init__(self, thermostat_entity_id, name, unique_id, attribute, unit, sampling_period):
+        self._thermostat_entity_id = thermostat_entity_id
+        self._attribute = attribute
+        self._sampling_period = sampling_period
+        self._attr_name = name
+        self._attr_unique_id = unique_id
+        self._attr_native_unit_of_measurement = unit
+
+    async def async_added_to_hass(self):
+        """Sample the thermostat periodically and follow its state changes."""
+        await super().async_added_to_hass()
+        self.async_on_remove(
+            async_track_state_change_event(self.hass, self._thermostat_entity_id,
+                                           self._async_thermostat_changed))
+        # The ticks are shared with the other sensors using the same sampling period
+        self.async_on_remove(
+            TickCoordinator.async_get(self.hass).async_register(self._sampling_period,
+                                                                self.async_sample))
+        self._async_read_value()
+
+    @callback
+    def _async_thermostat_changed(self, event: Event[EventStateChangedData]):
+        if event.data["new_state"] is None:
+            # The thermostat is removed, or reloaded and creating its sensors again
+            self.hass.async_create_task(self.async_remove())
+
+    @callback
+    def _async_read_value(self):
+        state = self.hass.states.get(self._thermostat_entity_id)
+        self._attr_available = state is not None
+        self._attr_native_value = None if state is None else state.attributes.get(
+            self._attribute)
+
+    @callback
+    def async_sample(self, *_):
+        """Publish the current value of the thermostat attribute."""
+        self._async_read_value()
+        self.async_write_ha_state()
@@ -0,0 +1,24 @@
+"""Faster than realtime simulation of Smart Thermostat controllers.
+
+Run the PID and the autotuner of `custom_components.smart_thermostat.pid_controller` against
+a first-order-plus-dead-time room model on a virtual clock, or replay recorded sensor series,
+to evaluate gains and tuning rules in seconds instead of days.
+"""
+from .clock import VirtualClock
+from .driver import AutotuneDriver, PIDDriver, Simulation, SimulationStep
+from .plant import RoomModel, constant, daily_cycle
+from .replay import Sample, read_csv, replay
+
+__all__ = [
+    'AutotuneDriver',
+    'PIDDriver',
+    'RoomModel',
+    'Sample',
+    'Simulation',
+    'SimulationStep',
+    'VirtualClock',
+    'constant',
+    'daily_cycle',
+    'read_csv',
+    'replay',
+]
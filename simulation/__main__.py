@@ -0,0 +1,87 @@
+"""Command line entry point: python -m simulation --help"""
+import argparse
+import math
+import time
+
+from custom_components.smart_thermostat import pid_controller
+
+from . import (AutotuneDriver, PIDDriver, RoomModel, Simulation, VirtualClock, daily_cycle,
+               read_csv, replay)
+
+
+def _summary(steps):
+    errors = [step.set_point - step.temperature for step in steps]
+    return {
+        'samples': len(steps),
+        'rms_error': math.sqrt(sum(error * error for error in errors) / len(errors)),
+        'max_overshoot': max(0.0, -min(errors)),
+        'mean_output': sum(step.output for step in steps) / len(steps),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--kp', type=float, default=100)
+    parser.add_argument('--ki', type=float, default=0)
+    parser.add_argument('--kd', type=float, default=0)
+    parser.add_argument('--ke', type=float, default=0)
+    parser.add_argument('--autotune', choices=sorted(pid_controller.PIDAutotune.TUNING_RULES),
+                        help='run a relay autotune instead of PID and print the gains given '
+                             'by this tuning rule')
+    parser.add_argument('--noiseband', type=float, default=0.5)
+    parser.add_argument('--lookback', type=float, default=7200)
+    parser.add_argument('--hours', type=float, default=24 * 7)
+    parser.add_argument('--sample-time', type=float, default=60)
+    parser.add_argument('--sampling-period', type=float, default=0)
+    parser.add_argument('--pwm', type=float, default=900)
+    parser.add_argument('--set-point', type=float, default=20)
+    parser.add_argument('--gain', type=float, default=0.2,
+                        help='room gain in °C above outdoor per %% of output')
+    parser.add_argument('--time-constant', type=float, default=7200)
+    parser.add_argument('--dead-time', type=float, default=300)
+    parser.add_argument('--outdoor', type=float, default=5, help='mean outdoor temperature')
+    parser.add_argument('--outdoor-amplitude', type=float, default=4)
+    parser.add_argument('--noise', type=float, default=0.02)
+    parser.add_argument('--resolution', type=float, default=0.1)
+    parser.add_argument('--csv', help='replay recorded samples from this CSV file instead')
+    args = parser.parse_args()
+
+    clock = VirtualClock()
+    if args.autotune:
+        controller = pid_controller.PIDAutotune(100, args.lookback, 0, 100, args.noiseband,
+                                                time_func=clock)
+        driver = AutotuneDriver(controller)
+    else:
+        controller = pid_controller.PID(args.kp, args.ki, args.kd, args.ke, 0, 100,
+                                        args.sampling_period, time_func=clock)
+        driver = PIDDriver(controller)
+
+    started = time.perf_counter()
+    if args.csv:
+        results = replay(read_csv(args.csv, args.set_point), driver, clock)
+        elapsed = time.perf_counter() - started
+        print(f'replayed {len(results)} samples in {elapsed:.3f}s')
+    else:
+        plant = RoomModel(args.gain, args.time_constant, args.dead_time,
+                          outdoor=daily_cycle(args.outdoor, args.outdoor_amplitude),
+                          noise=args.noise, resolution=args.resolution, seed=0)
+        simulation = Simulation(plant, driver, clock, args.sample_time,
+                                pwm=args.pwm, outdoor_sensor=bool(args.ke))
+        steps = simulation.run(args.hours * 3600)
+        elapsed = time.perf_counter() - started
+        print(f'simulated {args.hours:g}h in {elapsed:.3f}s '
+              f'({args.hours / elapsed:.0f} simulated hours per second)')
+        if not args.autotune:
+            # skip the first day, used to converge from initial conditions
+            for key, value in _summary(steps[int(86400 / args.sample_time):] or steps).items():
+                print(f'{key}: {value:.3f}' if isinstance(value, float) else f'{key}: {value}')
+
+    if args.autotune:
+        print(f'autotune {controller.state} after {controller.peak_count} peaks')
+        if controller.state == pid_controller.PIDAutotune.STATE_SUCCEEDED:
+            params = controller.get_pid_parameters(args.autotune)
+            print(f'{args.autotune}: Kp={params.Kp:.4f}, Ki={params.Ki:.6f}, Kd={params.Kd:.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""Virtual time source for simulations."""
+
+
+class VirtualClock:
+    """A clock which only moves when told to.
+
+    The clock is callable and returns the current virtual time in seconds, so it can be given
+    anywhere a `time_func` is expected (ie `PIDAutotune`).
+
+    Args:
+        start (float): The initial virtual time in seconds.
+    """
+
+    def __init__(self, start=0.0):
+        self._now = float(start)
+
+    def __call__(self):
+        return self._now
+
+    @property
+    def now(self):
+        """Get the current virtual time in seconds."""
+        return self._now
+
+    def advance(self, seconds):
+        """Move the clock forward by `seconds`."""
+        if seconds < 0:
+            raise ValueError('virtual time can not go backward')
+        self._now += seconds
+        return self._now
+
+    def set(self, timestamp):
+        """Move the clock forward to `timestamp`."""
+        if timestamp < self._now:
+            raise ValueError('virtual time can not go backward')
+        self._now = float(timestamp)
+        return self._now
@@ -0,0 +1,126 @@
+"""Run controllers against a room model in virtual time."""
+from collections import namedtuple
+
+from .clock import VirtualClock
+from .plant import constant
+
+SimulationStep = namedtuple('SimulationStep',
+                            ['time', 'temperature', 'set_point', 'outdoor', 'output'])
+
+
+class PIDDriver:
+    """Drives a `PID` the same way the thermostat does on each sensor update."""
+
+    def __init__(self, pid):
+        self._pid = pid
+        self._last_time = None
+
+    @property
+    def controller(self):
+        return self._pid
+
+    def update(self, now, temperature, set_point, outdoor):
+        last_time = self._last_time if self._last_time is not None else now
+        self._last_time = now
+        output, _ = self._pid.calc(temperature, set_point, now, last_time, outdoor)
+        return output
+
+
+class AutotuneDriver:
+    """Drives a `PIDAutotune` relay experiment until it finishes."""
+
+    def __init__(self, autotune):
+        self._autotune = autotune
+        self._finished = False
+
+    @property
+    def controller(self):
+        return self._autotune
+
+    @property
+    def finished(self):
+        return self._finished
+
+    def update(self, now, temperature, set_point, outdoor):
+        if not self._finished:
+            self._finished = self._autotune.run(temperature, set_point, now)
+        return self._autotune.output
+
+
+class Simulation:
+    """Closed loop simulation of a controller and a room model on a virtual clock.
+
+    The controller is called once per `sample_time` with the sensor reading, like the
+    thermostat on each sensor update. When `pwm` is set, the output is applied as an ON/OFF
+    heater held ON for the `output / output_max` fraction of each PWM period, otherwise it is
+    applied as a proportional (valve) output.
+
+    Args:
+        plant (RoomModel): The room model.
+        driver: A `PIDDriver`, an `AutotuneDriver` or any object with an
+            `update(now, temperature, set_point, outdoor)` method returning the output.
+        clock (VirtualClock): The clock shared with the controller.
+        sample_time (float): Interval in seconds between two sensor readings.
+        set_point (function): Function of time giving the target temperature.
+        pwm (float): PWM period in seconds, 0 for proportional output.
+        output_max (float): Output giving 100% of heating power.
+        outdoor_sensor (bool): Whether the outdoor temperature is given to the controller.
+    """
+
+    def __init__(self, plant, driver, clock=None, sample_time=60, set_point=None, pwm=0,
+                 output_max=100, outdoor_sensor=True):
+        if sample_time <= 0:
+            raise ValueError('sample_time must be greater than 0')
+        self._plant = plant
+        self._driver = driver
+        self._clock = clock if clock is not None else VirtualClock()
+        self._sample_time = sample_time
+        self._set_point = set_point if set_point is not None else constant(20.0)
+        self._pwm = pwm
+        self._output_max = output_max
+        self._outdoor_sensor = outdoor_sensor
+        self._output = 0.0
+
+    @property
+    def clock(self):
+        return self._clock
+
+    def run(self, duration):
+        """Simulate `duration` seconds and return the list of `SimulationStep`."""
+        steps = []
+        end = self._clock.now + duration
+        while self._clock.now < end:
+            steps.append(self.step())
+        return steps
+
+    def step(self):
+        """Read the sensor, update the controller and advance the clock by one sample."""
+        now = self._clock.now
+        temperature = self._plant.measure()
+        set_point = self._set_point(now)
+        outdoor = self._plant.outdoor(now)
+        self._output = self._driver.update(now, temperature, set_point,
+                                           outdoor if self._outdoor_sensor else None)
+        self._actuate(now, now + self._sample_time)
+        self._clock.advance(self._sample_time)
+        return SimulationStep(now, temperature, set_point, outdoor, self._output)
+
+    def _actuate(self, start, end):
+        """Apply the output to the plant and integrate it until `end`."""
+        power = max(0.0, min(abs(self._output) / self._output_max, 1.0)) * 100
+        if not self._pwm or power in (0.0, 100.0):
+            self._plant.apply(start, power)
+            self._plant.advance(start, end - start)
+            return
+        # heater is ON at the beginning of each PWM period for the duty cycle duration
+        time_on = self._pwm * power / 100
+        while start < end:
+            period_start = start - start % self._pwm
+            if start < period_start + time_on:
+                edge = min(end, period_start + time_on)
+                self._plant.apply(start, 100.0)
+            else:
+                edge = min(end, period_start + self._pwm)
+                self._plant.apply(start, 0.0)
+            self._plant.advance(start, edge - start)
+            start = edge
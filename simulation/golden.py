@@ -0,0 +1,379 @@
+"""Golden trace regression corpus for the PID and autotune numerics.
+
+Each trace of the corpus stores the inputs given to a controller and the expected per-step
+results computed by the reference implementation. Replaying a trace feeds the same inputs to
+a fresh controller and diffs the results within tolerance, so a faster engine can be
+validated against the reference behaviour.
+
+Run with `python -m simulation.golden`, `--engine bank` to validate `PIDBank.calc` computing
+all the PID traces together in one bank, `--engine bank_controller` to validate the scalar
+`PIDBankController` and `--regenerate` to rebuild the corpus after an intended change of
+behaviour.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+
+from custom_components.smart_thermostat import pid_controller
+
+from .clock import VirtualClock
+from .driver import AutotuneDriver, Simulation
+from .plant import RoomModel, constant, daily_cycle
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), 'traces')
+TRACE_VERSION = 1
+
+PID_FIELDS = ('p', 'i', 'd', 'e', 'output', 'update')
+AUTOTUNE_FIELDS = ('output', 'finished')
+
+
+def _schedule(*changes):
+    """Return a function of time giving the set point of a daily schedule.
+
+    Args:
+        changes: (hour, set point) tuples, sorted by hour.
+    """
+    def set_point(timestamp):
+        hour = (timestamp / 3600) % 24
+        value = changes[-1][1]
+        for start, temperature in changes:
+            if hour >= start:
+                value = temperature
+        return value
+    return set_point
+
+
+class _RecordingPID:
+    """Closed loop driver recording the inputs and results of a `PID`."""
+
+    def __init__(self, pid, events):
+        self._pid = pid
+        self._events = dict(events)
+        self._last_time = None
+        self.inputs = {'now': [], 'input': [], 'set_point': [], 'input_time': [],
+                       'last_input_time': [], 'ext_temp': []}
+        self.expected = {field: [] for field in PID_FIELDS}
+
+    def update(self, now, temperature, set_point, outdoor):
+        event = self._events.get(len(self.inputs['now']))
+        _apply_event(self._pid, event)
+        if event is not None and event[0] == 'clear_samples':
+            # the thermostat forgets the previous sample time along with the PID samples
+            self._last_time = None
+        last_time = self._last_time
+        self._last_time = now
+        for key, value in zip(self.inputs, (now, temperature, set_point, now, last_time,
+                                            outdoor)):
+            self.inputs[key].append(value)
+        output, update = self._pid.calc(temperature, set_point, now, last_time, outdoor)
+        for key, value in zip(PID_FIELDS, _pid_results(self._pid, output, update)):
+            self.expected[key].append(value)
+        return output
+
+
+def _apply_event(pid, event):
+    if event is None:
+        return
+    if event[0] == 'mode':
+        pid.mode = event[1]
+    elif event[0] == 'clear_samples':
+        pid.clear_samples()
+    elif event[0] == 'integral':
+        pid.integral = float(event[1])
+    elif event[0] == 'gains':
+        pid.set_pid_param(*event[1:])
+
+
+def _pid_results(pid, output, update):
+    return (pid.proportional, pid.integral, pid.derivative, pid.external, output, update)
+
+
+def _record_pid(name, description, config, plant, hours, set_point, sample_time=60, pwm=0,
+                events=(), outdoor_sensor=True):
+    clock = VirtualClock()
+    pid = pid_controller.PID(time_func=clock, **config)
+    recorder = _RecordingPID(pid, events)
+    Simulation(plant, recorder, clock, sample_time, set_point, pwm,
+               outdoor_sensor=outdoor_sensor).run(hours * 3600)
+    return {
+        'version': TRACE_VERSION,
+        'kind': 'pid',
+        'name': name,
+        'description': description,
+        'config': config,
+        'events': [[step] + list(event) for step, event in events],
+        'inputs': recorder.inputs,
+        'expected': recorder.expected,
+    }
+
+
+def _record_autotune(name, description, config, plant, hours, set_point=20.0,
+                     sample_time=60):
+    clock = VirtualClock()
+    autotune = pid_controller.PIDAutotune(time_func=clock, **config)
+    driver = AutotuneDriver(autotune)
+    inputs = {'now': [], 'input': [], 'set_point': []}
+    expected = {field: [] for field in AUTOTUNE_FIELDS}
+    transitions = []
+    simulation = Simulation(plant, driver, clock, sample_time, constant(set_point))
+    while not driver.finished and clock.now < hours * 3600:
+        step = simulation.step()
+        inputs['now'].append(step.time)
+        inputs['input'].append(step.temperature)
+        inputs['set_point'].append(step.set_point)
+        expected['output'].append(step.output)
+        expected['finished'].append(driver.finished)
+        if not transitions or transitions[-1][1] != autotune.state:
+            transitions.append([len(inputs['now']) - 1, autotune.state])
+    return {
+        'version': TRACE_VERSION,
+        'kind': 'autotune',
+        'name': name,
+        'description': description,
+        'config': config,
+        'inputs': inputs,
+        'expected': expected,
+        'transitions': transitions,
+        'final': _autotune_final(autotune),
+    }
+
+
+def _autotune_final(autotune):
+    final = {'state': autotune.state, 'peak_count': autotune.peak_count,
+             'sample_time': autotune.sample_time, 'params': {}}
+    if autotune.state == pid_controller.PIDAutotune.STATE_SUCCEEDED:
+        final['params'] = {rule: list(autotune.get_pid_parameters(rule))
+                           for rule in autotune.tuning_rules}
+    return final
+
+
+def build_corpus():
+    """Record the corpus traces with the current (reference) implementation."""
+    pid_config = {'kp': 30, 'ki': 0.005, 'kd': 5000, 'ke': 0, 'out_min': 0, 'out_max': 100}
+    schedule = _schedule((0, 17.0), (6, 20.0), (9, 18.5), (17, 21.0), (22, 17.0))
+    yield _record_pid(
+        'pid_auto_valve', 'PID in auto mode driving a valve, daily set point schedule',
+        pid_config, RoomModel(0.2, 7200, 300, 17.0, constant(5.0), 0.02, 0.1, seed=1), 24,
+        schedule, outdoor_sensor=False)
+    yield _record_pid(
+        'pid_auto_outdoor_pwm', 'PID with outdoor compensation driving a PWM heater, the '
+        'integral is reset on each set point change',
+        dict(pid_config, ke=0.6), RoomModel(0.2, 7200, 300, 17.0, daily_cycle(4, 5), 0.02,
+                                            0.1, seed=2), 24, schedule, pwm=900)
+    yield _record_pid(
+        'pid_saturated', 'High gains saturating the output, exercising the anti-windup',
+        dict(pid_config, kp=200, ki=0.05, ke=0.6), RoomModel(0.1, 3600, 600, 14.0,
+                                                              constant(-5.0), 0.05, 0.1, seed=3),
+        12, _schedule((0, 19.0), (4, 22.0), (8, 16.0)))
+    yield _record_pid(
+        'pid_off_hysteresis', 'PID off, switching between min and max output',
+        dict(pid_config, cold_tolerance=0.3, hot_tolerance=0.2),
+        RoomModel(0.2, 5400, 120, 18.0, constant(5.0), 0.0, 0.1, seed=4), 12,
+        constant(20.0), events=[(0, ('mode', 'off'))])
+    yield _record_pid(
+        'pid_sampling_period', 'Sensor updates every minute, PID computed every 5 minutes',
+        dict(pid_config, ke=0.6, sampling_period=300),
+        RoomModel(0.2, 7200, 300, 17.0, daily_cycle(4, 5), 0.02, 0.1, seed=5), 12, schedule)
+    yield _record_pid(
+        'pid_events', 'Mode changes, samples cleared, integral forced and gains changed',
+        dict(pid_config, ke=0.6), RoomModel(0.2, 7200, 300, 19.0, constant(5.0), 0.02, 0.1,
+                                            seed=6), 12, constant(20.0),
+        events=[(60, ('mode', 'off')), (180, ('mode', 'auto')), (240, ('clear_samples',)),
+                (300, ('integral', 12.5)), (420, ('gains', 45, 0.002, 8000, 0.8))])
+
+    autotune_config = {'out_step': 100, 'lookback': 7200, 'out_min': 0, 'out_max': 100,
+                       'noiseband': 0.2}
+    yield _record_autotune(
+        'autotune_relay', 'Relay autotune converging on a clean sensor', autotune_config,
+        RoomModel(0.2, 7200, 300, 18.0, constant(5.0), 0.0, 0.0, seed=7), 48)
+    yield _record_autotune(
+        'autotune_noisy', 'Relay autotune on a noisy and quantized sensor',
+        dict(autotune_config, noiseband=0.3),
+        RoomModel(0.3, 5400, 600, 18.0, constant(0.0), 0.05, 0.1, seed=8), 48)
+    yield _record_autotune(
+        'autotune_short_lookback', 'Relay autotune with a 30 minutes lookback',
+        dict(autotune_config, lookback=1800),
+        RoomModel(0.2, 3600, 120, 19.0, constant(8.0), 0.01, 0.1, seed=9), 48)
+
+
+def write_corpus(directory=CORPUS_DIR):
+    os.makedirs(directory, exist_ok=True)
+    for trace in build_corpus():
+        with open(os.path.join(directory, f'{trace["name"]}.json'), 'w') as file:
+            json.dump(trace, file, separators=(',', ':'))
+            file.write('\n')
+        yield trace['name']
+
+
+def load_corpus(directory=CORPUS_DIR):
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith('.json'):
+            with open(os.path.join(directory, filename)) as file:
+                yield json.load(file)
+
+
+def pid_engine(config, clock):
+    return pid_controller.PID(time_func=clock, **config)
+
+
+def bank_controller_engine(config, clock):
+    from custom_components.smart_thermostat.pid_controller.bank import PIDBank
+    return PIDBank(time_func=clock).add(**config)
+
+
+ENGINES = {'pid': pid_engine, 'bank_controller': bank_controller_engine}
+
+
+def _close(expected, actual, rtol, atol):
+    if isinstance(expected, (bool, str)) or expected is None:
+        return expected == actual
+    return math.isclose(expected, actual, rel_tol=rtol, abs_tol=atol)
+
+
+def _diff(name, step, expected, actual, rtol, atol):
+    return [f'{name}: step {step}: {field} expected {expected[field]!r}, got {actual[field]!r}'
+            for field in expected if not _close(expected[field], actual[field], rtol, atol)]
+
+
+def replay_pid(trace, engine=pid_engine, rtol=1e-9, atol=1e-9):
+    """Replay a PID trace and return the list of differences."""
+    clock = VirtualClock()
+    pid = engine(trace['config'], clock)
+    events = {event[0]: event[1:] for event in trace['events']}
+    inputs = trace['inputs']
+    expected = trace['expected']
+    differences = []
+    for step in range(len(inputs['now'])):
+        clock.set(inputs['now'][step])
+        _apply_event(pid, events.get(step))
+        output, update = pid.calc(inputs['input'][step], inputs['set_point'][step],
+                                  inputs['input_time'][step], inputs['last_input_time'][step],
+                                  inputs['ext_temp'][step])
+        actual = dict(zip(PID_FIELDS, _pid_results(pid, output, update)))
+        differences += _diff(trace['name'], step, {field: expected[field][step]
+                                                   for field in PID_FIELDS},
+                             actual, rtol, atol)
+    return differences
+
+
+def replay_pid_bank(traces, rtol=1e-9, atol=1e-9):
+    """Replay PID traces together, one controller of a `PIDBank` per trace.
+
+    At each time step a single `PIDBank.calc` computes the traces having a sample at that
+    time, selected with the mask.
+
+    Returns:
+        The list of differences of each trace, by name.
+    """
+    import numpy as np
+    from custom_components.smart_thermostat.pid_controller.bank import PIDBank
+
+    clock = VirtualClock()
+    bank = PIDBank(time_func=clock)
+    controllers = [bank.add(**trace['config']) for trace in traces]
+    events = [{event[0]: event[1:] for event in trace['events']} for trace in traces]
+    steps = [0] * len(traces)
+    differences = {trace['name']: [] for trace in traces}
+    times = sorted({now for trace in traces for now in trace['inputs']['now']})
+    for now in times:
+        clock.set(now)
+        mask = np.zeros(len(traces), dtype=bool)
+        values = np.full((5, len(traces)), np.nan)
+        for index, trace in enumerate(traces):
+            inputs, step = trace['inputs'], steps[index]
+            if step == len(inputs['now']) or inputs['now'][step] != now:
+                continue
+            mask[index] = True
+            _apply_event(controllers[index], events[index].get(step))
+            values[:, index] = [np.nan if inputs[key][step] is None else inputs[key][step]
+                                for key in ('input', 'set_point', 'input_time',
+                                            'last_input_time', 'ext_temp')]
+        outputs, updated = bank.calc(*values, mask=mask)
+        for index in np.flatnonzero(mask):
+            trace, step = traces[index], steps[index]
+            actual = dict(zip(PID_FIELDS, (
+                float(bank.proportionals[index]), float(bank.integrals[index]),
+                float(bank.derivatives[index]), float(bank.externals[index]),
+                float(outputs[index]), bool(updated[index]))))
+            differences[trace['name']] += _diff(
+                trace['name'], step, {field: trace['expected'][field][step]
+                                      for field in PID_FIELDS}, actual, rtol, atol)
+            steps[index] += 1
+    return differences
+
+
+def replay_autotune(trace, rtol=1e-9, atol=1e-9):
+    """Replay an autotune trace and return the list of differences."""
+    clock = VirtualClock()
+    autotune = pid_controller.PIDAutotune(time_func=clock, **trace['config'])
+    inputs = trace['inputs']
+    expected = trace['expected']
+    differences = []
+    transitions = []
+    finished = False
+    for step in range(len(inputs['now'])):
+        clock.set(inputs['now'][step])
+        if not finished:
+            finished = autotune.run(inputs['input'][step], inputs['set_point'][step],
+                                    inputs['now'][step])
+        actual = {'output': autotune.output, 'finished': finished}
+        differences += _diff(trace['name'], step, {field: expected[field][step]
+                                                   for field in AUTOTUNE_FIELDS},
+                             actual, rtol, atol)
+        if not transitions or transitions[-1][1] != autotune.state:
+            transitions.append([step, autotune.state])
+    if transitions != trace['transitions']:
+        differences.append(f'{trace["name"]}: state transitions expected '
+                           f'{trace["transitions"]}, got {transitions}')
+    final = _autotune_final(autotune)
+    for key in ('state', 'peak_count', 'sample_time'):
+        if not _close(trace['final'][key], final[key], rtol, atol):
+            differences.append(f'{trace["name"]}: final {key} expected '
+                               f'{trace["final"][key]!r}, got {final[key]!r}')
+    for rule, params in trace['final']['params'].items():
+        actual = final['params'].get(rule)
+        if actual is None or not all(_close(a, b, rtol, atol) for a, b in zip(params, actual)):
+            differences.append(f'{trace["name"]}: {rule} parameters expected {params}, '
+                               f'got {actual}')
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay the golden trace corpus.')
+    parser.add_argument('--engine', choices=sorted([*ENGINES, 'bank']), default='pid',
+                        help='PID engine replaying the PID traces')
+    parser.add_argument('--rtol', type=float, default=1e-9, help='relative tolerance')
+    parser.add_argument('--atol', type=float, default=1e-9, help='absolute tolerance')
+    parser.add_argument('--regenerate', action='store_true',
+                        help='record the corpus again with the current implementation')
+    args = parser.parse_args()
+
+    if args.regenerate:
+        for name in write_corpus():
+            print(f'recorded {name}')
+        return
+
+    failed = False
+    traces = list(load_corpus())
+    if args.engine == 'bank':
+        bank_differences = replay_pid_bank([trace for trace in traces if trace['kind'] == 'pid'],
+                                           args.rtol, args.atol)
+    for trace in traces:
+        if trace['kind'] == 'pid' and args.engine == 'bank':
+            differences = bank_differences[trace['name']]
+        elif trace['kind'] == 'pid':
+            differences = replay_pid(trace, ENGINES[args.engine], args.rtol, args.atol)
+        else:
+            differences = replay_autotune(trace, args.rtol, args.atol)
+        steps = len(trace['inputs']['now'])
+        print(f'{trace["name"]}: {steps} steps, {"FAILED" if differences else "ok"}')
+        for difference in differences[:10]:
+            print(f'  {difference}')
+        failed = failed or bool(differences)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
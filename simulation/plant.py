@@ -0,0 +1,102 @@
+"""Thermal models of the heated room."""
+import math
+import random
+from collections import deque
+
+
+def constant(value):
+    """Return a function of time always giving `value`."""
+    return lambda _: value
+
+
+def daily_cycle(mean, amplitude, coldest_hour=5):
+    """Return a function of time giving a sinusoidal daily outdoor temperature.
+
+    Args:
+        mean (float): The mean temperature of the day.
+        amplitude (float): Half the difference between the warmest and coldest temperature.
+        coldest_hour (float): The hour of the day with the coldest temperature.
+    """
+    def temperature(timestamp):
+        phase = 2 * math.pi * (timestamp / 3600 - coldest_hour) / 24
+        return mean - amplitude * math.cos(phase)
+    return temperature
+
+
+class RoomModel:
+    """First-order-plus-dead-time model of a heated room.
+
+    The room temperature T follows:
+        tau * dT/dt = gain * u(t - dead_time) - (T - T_outdoor)
+    so at steady state, the output needed to hold a temperature is
+    (T - T_outdoor) / gain, which is what the `ke` compensation of the PID models.
+
+    Args:
+        gain (float): Steady state temperature rise above outdoor per unit of output
+            (°C per % of heating power).
+        time_constant (float): Time constant of the room in seconds.
+        dead_time (float): Delay in seconds between a change of output and its effect.
+        temperature (float): Initial room temperature.
+        outdoor (function): Function of time giving the outdoor temperature.
+        noise (float): Standard deviation of the sensor noise.
+        resolution (float): Resolution of the sensor, 0 for no quantization.
+        seed (int): Seed of the sensor noise generator.
+    """
+
+    def __init__(self, gain=0.2, time_constant=7200, dead_time=300, temperature=18.0,
+                 outdoor=None, noise=0.0, resolution=0.0, seed=None):
+        if time_constant <= 0:
+            raise ValueError('time_constant must be greater than 0')
+        if dead_time < 0:
+            raise ValueError('dead_time must be greater or equal to 0')
+        self._gain = gain
+        self._time_constant = time_constant
+        self._dead_time = dead_time
+        self._temperature = temperature
+        self._outdoor = outdoor if outdoor is not None else constant(5.0)
+        self._noise = noise
+        self._resolution = resolution
+        self._random = random.Random(seed)
+        # outputs applied, as (timestamp, output), the first one being the delayed output
+        self._outputs = deque([(float('-inf'), 0.0)])
+
+    @property
+    def temperature(self):
+        """Get the true room temperature."""
+        return self._temperature
+
+    def outdoor(self, timestamp):
+        """Get the outdoor temperature at `timestamp`."""
+        return self._outdoor(timestamp)
+
+    def measure(self):
+        """Get the room temperature as read by the sensor."""
+        value = self._temperature
+        if self._noise:
+            value += self._random.gauss(0, self._noise)
+        if self._resolution:
+            value = round(value / self._resolution) * self._resolution
+        return value
+
+    def apply(self, timestamp, output):
+        """Set the heating output from `timestamp` on."""
+        if output != self._outputs[-1][1]:
+            self._outputs.append((timestamp, output))
+
+    def advance(self, start, duration):
+        """Integrate the room temperature from `start` over `duration` seconds."""
+        end = start + duration
+        outputs = self._outputs
+        while start < end:
+            # drop the outputs whose successor already reached the room
+            while len(outputs) > 1 and outputs[1][0] + self._dead_time <= start:
+                outputs.popleft()
+            # integrate until the next delayed output change
+            segment_end = end
+            if len(outputs) > 1:
+                segment_end = min(end, outputs[1][0] + self._dead_time)
+            target = self._outdoor(start) + self._gain * outputs[0][1]
+            decay = math.exp(-(segment_end - start) / self._time_constant)
+            self._temperature = target + (self._temperature - target) * decay
+            start = segment_end
+        return self._temperature
@@ -0,0 +1,62 @@
+"""Replay recorded sensor series through controllers."""
+import csv
+from collections import namedtuple
+from datetime import datetime
+
+Sample = namedtuple('Sample', ['time', 'temperature', 'set_point', 'outdoor'])
+
+
+def _parse_time(value):
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def _parse_float(value):
+    if value is None or value.strip() in ('', 'unknown', 'unavailable'):
+        return None
+    return float(value)
+
+
+def read_csv(path, default_set_point=None):
+    """Read recorded samples from a CSV file.
+
+    The file must have a header with a `time` column (seconds since epoch or ISO 8601) and a
+    `temperature` column. Optional `set_point` and `outdoor` columns are used when present.
+    Rows with an unavailable temperature are skipped.
+
+    Returns:
+        A generator of `Sample`, in file order.
+    """
+    with open(path, newline='') as file:
+        for row in csv.DictReader(file):
+            temperature = _parse_float(row.get('temperature'))
+            if temperature is None:
+                continue
+            set_point = _parse_float(row.get('set_point'))
+            yield Sample(_parse_time(row['time']), temperature,
+                         set_point if set_point is not None else default_set_point,
+                         _parse_float(row.get('outdoor')))
+
+
+def replay(samples, driver, clock=None):
+    """Feed recorded samples to a controller driver, in open loop.
+
+    Args:
+        samples: Iterable of `Sample`.
+        driver: A `PIDDriver`, an `AutotuneDriver` or any object with an
+            `update(now, temperature, set_point, outdoor)` method returning the output.
+        clock (VirtualClock): Clock moved to each sample time before calling the driver.
+
+    Returns:
+        A list of (`Sample`, output) tuples.
+    """
+    results = []
+    for sample in samples:
+        if clock is not None:
+            clock.set(sample.time)
+        output = driver.update(sample.time, sample.temperature, sample.set_point,
+                               sample.outdoor)
+        results.append((sample, output))
+    return results
@@ -0,0 +1,227 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('homeassistant')
+
+from custom_components.smart_thermostat import actuator  # noqa: E402
+from custom_components.smart_thermostat.actuator import (  # noqa: E402
+    ActuatorGroup,
+    needs_refresh,
+)
+
+
+class _Services:
+    """Records the service calls, failing the number of calls given by `failures`."""
+
+    def __init__(self, failures=0):
+        self.calls = []
+        self.failures = failures
+
+    async def async_call(self, domain, service, data, blocking=False):
+        self.calls.append((domain, service, dict(data)))
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError('device unavailable')
+
+
+class _Hass:
+    def __init__(self, failures=0):
+        self.loop = asyncio.get_running_loop()
+        self.services = _Services(failures)
+
+    def async_create_background_task(self, target, name):
+        return self.loop.create_task(target, name=name)
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+async def _idle(group):
+    while group._worker is not None:
+        await asyncio.sleep(0.001)
+
+
+def _values(hass):
+    return [(data['entity_id'], data.get('position', data.get('value')))
+            for _, _, data in hass.services.calls]
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(actuator, 'RETRY_DELAY', 0.01)
+
+
+def test_deadband_limits_and_refresh():
+    async def run():
+        hass = _Hass()
+        clock = _Clock()
+        group = ActuatorGroup(['valve.a'], resolution=1, deadband=5, refresh=600,
+                              limits=(0, 100), time_func=clock)
+        for now, value in ((0, 50.2), (10, 53), (20, 56), (30, 99.6), (40, 100), (50, 97),
+                           (700, 97)):
+            clock.now = now
+            group.async_set_value(hass, value)
+            await _idle(group)
+        return hass, group
+
+    hass, group = asyncio.run(run())
+    # 53 is within the deadband, 100 is a limit, 97 is refreshed after 600 s
+    assert _values(hass) == [(['valve.a'], 50), (['valve.a'], 56), (['valve.a'], 100),
+                             (['valve.a'], 97)]
+    assert (group.sent, group.suppressed) == (4, 3)
+
+
+def test_forced_value_is_always_sent():
+    async def run():
+        hass = _Hass()
+        group = ActuatorGroup(['number.a'], deadband=5)
+        group.async_set_value(hass, 50)
+        await _idle(group)
+        group.async_set_value(hass, 50, force=True)
+        await _idle(group)
+        return hass
+
+    assert _values(asyncio.run(run())) == [(['number.a'], 50), (['number.a'], 50)]
+
+
+def test_identical_commands_are_batched_and_superseded():
+    async def run():
+        hass = _Hass()
+        group = ActuatorGroup(['switch.a', 'switch.b'])
+        group.async_turn_on(hass)
+        group.async_turn_off(hass)
+        await _idle(group)
+        return hass, group
+
+    hass, group = asyncio.run(run())
+    assert hass.services.calls == [('switch', 'turn_off', {'entity_id': ['switch.a',
+                                                                         'switch.b']})]
+    assert group.superseded == 2
+
+
+def test_failed_command_is_retried():
+    async def run():
+        hass = _Hass(failures=2)
+        group = ActuatorGroup(['valve.a'], deadband=5, retries=3)
+        group.async_set_value(hass, 40)
+        await asyncio.sleep(0)
+        # The same value waiting for its retry is not sent again
+        group.async_set_value(hass, 40)
+        await _idle(group)
+        return hass, group
+
+    hass, group = asyncio.run(run())
+    assert _values(hass) == [(['valve.a'], 40)] * 3
+    assert (group.sent, group.suppressed, group.failed) == (1, 1, 0)
+
+
+def test_retries_back_off():
+    async def run():
+        hass = _Hass(failures=3)
+        group = ActuatorGroup(['valve.a'], retries=3)
+        times = []
+        call = hass.services.async_call
+
+        async def timed_call(*args, **kwargs):
+            times.append(hass.loop.time())
+            await call(*args, **kwargs)
+        hass.services.async_call = timed_call
+        group.async_set_value(hass, 40)
+        await _idle(group)
+        return times
+
+    times = asyncio.run(run())
+    delays = [later - earlier for earlier, later in zip(times, times[1:])]
+    assert len(delays) == 3
+    assert delays[0] >= 0.01 and delays[1] >= 0.02 and delays[2] >= 0.04
+
+
+def test_failed_value_is_not_suppressed():
+    async def run():
+        hass = _Hass(failures=2)
+        group = ActuatorGroup(['valve.a'], deadband=5, retries=1)
+        group.async_set_value(hass, 40)
+        await _idle(group)
+        assert group.failed == 1
+        # The device never accepted 40, so it is sent again
+        group.async_set_value(hass, 40)
+        await _idle(group)
+        return hass, group
+
+    hass, group = asyncio.run(run())
+    assert _values(hass) == [(['valve.a'], 40)] * 3
+    assert group.suppressed == 0
+
+
+def test_failed_value_is_sent_again_before_giving_up(monkeypatch):
+    monkeypatch.setattr(actuator, 'RETRY_DELAY', 10)
+
+    async def run():
+        hass = _Hass(failures=1)
+        group = ActuatorGroup(['valve.a'], deadband=5, retries=3)
+        group.async_set_value(hass, 40)
+        await asyncio.sleep(0.001)
+        # A newer value within the deadband replaces the retry
+        group.async_set_value(hass, 42)
+        await _idle(group)
+        return hass, group
+
+    hass, group = asyncio.run(run())
+    assert _values(hass) == [(['valve.a'], 40), (['valve.a'], 42)]
+    assert group.superseded == 1
+
+
+def test_rate_limit():
+    async def run():
+        hass = _Hass()
+        clock = _Clock()
+        group = ActuatorGroup(['valve.a'], rate_limit=2, rate_period=3600, time_func=clock)
+        for value in (10, 20, 30, 40):
+            clock.now += 1
+            group.async_set_value(hass, value)
+            await asyncio.sleep(0.001)
+        sent = _values(hass)
+        group.async_cancel()
+        return sent, group
+
+    sent, group = asyncio.run(run())
+    # The burst of 2 commands is sent, 30 waits for a token and is replaced by 40
+    assert sent == [(['valve.a'], 10), (['valve.a'], 20)]
+    assert group.rate_limited == 1
+
+
+def test_values_commanded():
+    async def run():
+        hass = _Hass(failures=1)
+        group = ActuatorGroup(['valve.a', 'valve.b'], deadband=5, retries=0)
+        group.async_set_value(hass, 40)
+        await _idle(group)
+        # The first call fails, its entities have no value until the next one is sent
+        assert group.values == {}
+        group.async_set_value(hass, 10)
+        group.async_set_value(hass, 12)
+        await _idle(group)
+        return group
+
+    assert asyncio.run(run()).values == {'valve.a': 10, 'valve.b': 10}
+
+
+@pytest.mark.parametrize('reported, last_command, now, refresh, expected', [
+    # Sent on every keep_alive without refresh, or after a restart
+    ({'switch.a': True, 'switch.b': True}, 0, 10, 0, True),
+    ({'switch.a': True, 'switch.b': True}, None, 10, 600, True),
+    # Only sent again when a device disagrees or the command is too old
+    ({'switch.a': True, 'switch.b': True}, 0, 10, 600, False),
+    ({'switch.a': True, 'switch.b': False}, 0, 10, 600, True),
+    ({'switch.a': True}, 0, 10, 600, True),
+    ({'switch.a': True, 'switch.b': True}, 0, 600, 600, True),
+])
+def test_needs_refresh(reported, last_command, now, refresh, expected):
+    assert needs_refresh(reported, ['switch.a', 'switch.b'], True, last_command, now,
+                         refresh) is expected
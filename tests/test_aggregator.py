@@ -0,0 +1,53 @@
+import pytest
+
+from custom_components.smart_thermostat.aggregator import SampleAggregator
+
+SAMPLES = [(20.0, 0.0), (20.4, 10.0), (19.9, 20.0), (25.0, 60.0)]
+
+
+def _aggregate(method, samples=SAMPLES):
+    aggregator = SampleAggregator(method)
+    firsts = [aggregator.add(value, timestamp) for value, timestamp in samples]
+    assert firsts == [True] + [False] * (len(samples) - 1)
+    assert aggregator.count == len(samples)
+    return aggregator, aggregator.flush()
+
+
+def test_mean():
+    _, (value, timestamp) = _aggregate('mean')
+    assert value == pytest.approx(21.325)
+    assert timestamp == pytest.approx(22.5)
+
+
+def test_median():
+    _, (value, timestamp) = _aggregate('median')
+    assert value == pytest.approx(20.2)
+    assert timestamp == 30.0
+    _, (value, _) = _aggregate('median', SAMPLES[:3])
+    assert value == 20.0
+
+
+def test_last():
+    aggregator, sample = _aggregate('last')
+    assert sample == (25.0, 60.0)
+
+
+@pytest.mark.parametrize('method', SampleAggregator.methods)
+def test_flush_starts_a_new_window(method):
+    aggregator, _ = _aggregate(method)
+    assert aggregator.count == 0
+    assert aggregator.flush() is None
+    assert aggregator.add(18.0, 100.0)
+    assert aggregator.flush() == (18.0, 100.0)
+
+
+def test_clear_drops_the_window():
+    aggregator = SampleAggregator()
+    aggregator.add(20.0, 0.0)
+    aggregator.clear()
+    assert aggregator.flush() is None
+
+
+def test_invalid_method():
+    with pytest.raises(ValueError):
+        SampleAggregator('max')
@@ -0,0 +1,83 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('homeassistant')
+
+from custom_components.smart_thermostat import coordinator  # noqa: E402
+
+
+def test_failing_action_does_not_stop_the_others(monkeypatch):
+    monkeypatch.setattr(coordinator, 'async_call_at', lambda hass, action, when: lambda: None)
+    ticked = []
+
+    def failing(now):
+        raise RuntimeError('broken thermostat')
+
+    async def failing_async(now):
+        raise RuntimeError('broken thermostat')
+
+    async def ticking_async(now):
+        ticked.append(('async', now))
+
+    async def run():
+        hass = SimpleNamespace(loop=asyncio.get_running_loop())
+        tick_coordinator = coordinator.TickCoordinator(hass)
+        tick_coordinator.async_register(60, failing)
+        tick_coordinator.async_register(60, lambda now: ticked.append(('callback', now)))
+        tick_coordinator.async_register(60, failing_async)
+        tick_coordinator.async_register(60, ticking_async)
+        wheel = tick_coordinator._wheels[60]
+        await wheel._async_tick(1)
+        await wheel._async_tick(2)
+        return wheel
+
+    wheel = asyncio.run(run())
+    assert ticked == [('callback', 1), ('async', 1), ('callback', 2), ('async', 2)]
+    assert wheel.ticks == 2
+
+
+def test_unregister_stops_the_wheel(monkeypatch):
+    cancelled = []
+    monkeypatch.setattr(coordinator, 'async_call_at',
+                        lambda hass, action, when: lambda: cancelled.append(when))
+
+    async def run():
+        hass = SimpleNamespace(loop=asyncio.get_running_loop())
+        tick_coordinator = coordinator.TickCoordinator(hass)
+        unregister = tick_coordinator.async_register(30, lambda now: None)
+        assert tick_coordinator.intervals == {30: 1}
+        unregister()
+        return tick_coordinator
+
+    tick_coordinator = asyncio.run(run())
+    assert tick_coordinator.intervals == {}
+    assert len(cancelled) == 1
+
+
+def test_sensor_is_subscribed_once(monkeypatch):
+    subscriptions = []
+
+    def track(hass, entity_id, action):
+        subscriptions.append((entity_id, action))
+        return lambda: subscriptions.remove((entity_id, action))
+    monkeypatch.setattr(coordinator, 'async_track_state_change_event', track)
+    registry = coordinator.SensorRegistry.async_get(SimpleNamespace(data={}))
+    first, second = [], []
+    unsubscribe_first = registry.async_subscribe('sensor.outdoor', first.append)
+    unsubscribe_second = registry.async_subscribe('sensor.outdoor', second.append)
+    assert len(subscriptions) == 1
+    assert registry.listeners == {'sensor.outdoor': 2}
+
+    changed = subscriptions[0][1]
+    for state in ('5.5', 'unavailable'):
+        changed(SimpleNamespace(data={'new_state': SimpleNamespace(state=state)}))
+    changed(SimpleNamespace(data={'new_state': None}))
+    assert first == second == [5.5]
+
+    unsubscribe_first()
+    assert len(subscriptions) == 1
+    unsubscribe_second()
+    assert subscriptions == []
+    assert registry.listeners == {}
@@ -0,0 +1,31 @@
+import pytest
+
+from simulation import golden
+
+TRACES = list(golden.load_corpus())
+PID_TRACES = [trace for trace in TRACES if trace['kind'] == 'pid']
+AUTOTUNE_TRACES = [trace for trace in TRACES if trace['kind'] == 'autotune']
+
+
+def _name(trace):
+    return trace['name']
+
+
+@pytest.mark.parametrize('engine', sorted(golden.ENGINES))
+@pytest.mark.parametrize('trace', PID_TRACES, ids=_name)
+def test_pid_trace(trace, engine):
+    if engine != 'pid':
+        pytest.importorskip('numpy')
+    assert golden.replay_pid(trace, golden.ENGINES[engine]) == []
+
+
+def test_pid_traces_in_one_bank():
+    pytest.importorskip('numpy')
+    differences = golden.replay_pid_bank(PID_TRACES)
+    assert sorted(differences) == sorted(trace['name'] for trace in PID_TRACES)
+    assert all(not trace_differences for trace_differences in differences.values())
+
+
+@pytest.mark.parametrize('trace', AUTOTUNE_TRACES, ids=_name)
+def test_autotune_trace(trace):
+    assert golden.replay_autotune(trace) == []
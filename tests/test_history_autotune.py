@@ -0,0 +1,87 @@
+import math
+
+import pytest
+
+from custom_components.smart_thermostat.pid_controller import PIDAutotune
+from custom_components.smart_thermostat.pid_controller.history import HistoryAutotune
+from simulation import RoomModel, Simulation, VirtualClock, constant
+
+
+class _HysteresisThermostat:
+    """On/off thermostat recording the samples as the recorder would."""
+
+    def __init__(self, tolerance):
+        self._tolerance = tolerance
+        self._on = False
+        self.samples = []
+
+    def update(self, now, temperature, set_point, outdoor):
+        if temperature < set_point - self._tolerance:
+            self._on = True
+        elif temperature > set_point + self._tolerance:
+            self._on = False
+        self.samples.append((now, temperature, self._on))
+        return 100.0 if self._on else 0.0
+
+
+def _relay_trace(gain, time_constant, dead_time, tolerance, hours=48):
+    # Outdoor temperature holding the set point at 50% output, for a symmetric relay
+    plant = RoomModel(gain, time_constant, dead_time, 20.0, constant(20.0 - gain * 50))
+    thermostat = _HysteresisThermostat(tolerance)
+    Simulation(plant, thermostat, VirtualClock(), 10, constant(20.0)).run(hours * 3600)
+    return thermostat.samples
+
+
+@pytest.mark.parametrize('gain, time_constant, dead_time', [
+    (0.2, 7200, 300),
+    (0.3, 5400, 600),
+    (0.2, 3600, 120),
+])
+def test_ultimate_gain_and_period_of_a_relay(gain, time_constant, dead_time):
+    tolerance = 0.2
+    tuner = HistoryAutotune(100, 4 * 3600, tolerance)
+    assert tuner.feed(_relay_trace(gain, time_constant, dead_time, tolerance))
+    assert tuner.state == PIDAutotune.STATE_SUCCEEDED
+    assert tuner.cycle_count == 10
+
+    # Relay oscillation of a first order plus dead time plant, the output swinging by 50
+    # around the set point output
+    swing = gain * 50
+    decay = math.exp(-dead_time / time_constant)
+    amplitude = swing - (swing - tolerance) * decay
+    period = 2 * (dead_time + time_constant * math.log((swing + amplitude) /
+                                                        (swing - tolerance)))
+    assert tuner.Pu == pytest.approx(period, rel=0.05)
+    assert tuner.Ku == pytest.approx(4 * 50 / (math.pi * amplitude), rel=0.05)
+
+    params = tuner.get_pid_parameters('ziegler-nichols')
+    assert params.Kp == pytest.approx(tuner.Ku / 34)
+    assert params.Ki == pytest.approx(params.Kp / (tuner.Pu / 40))
+    assert params.Kd == pytest.approx(params.Kp * tuner.Pu / 160)
+
+
+def test_small_and_long_cycles_are_discarded():
+    # The cycles last about 1750 s
+    tuner = HistoryAutotune(100, 1200, 0.2)
+    assert not tuner.feed(_relay_trace(0.2, 7200, 300, 0.2, hours=12))
+    assert tuner.cycle_count == 0
+    assert tuner.discarded > 0
+    with pytest.raises(ValueError):
+        tuner.get_pid_parameters()
+
+    # The peak-to-peak amplitude is about 1.2 °C
+    tuner = HistoryAutotune(100, 4 * 3600, 2.0)
+    assert not tuner.feed(_relay_trace(0.2, 7200, 300, 0.2, hours=12))
+    assert tuner.cycle_count == 0
+
+
+def test_gap_interrupts_the_cycle():
+    samples = _relay_trace(0.2, 7200, 300, 0.2, hours=12)
+    tuner = HistoryAutotune(100, 4 * 3600, 0.2, cycles=100)
+    tuner.feed(samples)
+    cycles = tuner.cycle_count
+
+    tuner = HistoryAutotune(100, 4 * 3600, 0.2, cycles=100)
+    middle = len(samples) // 2
+    tuner.feed(samples[:middle] + [(samples[middle][0], None, None)] + samples[middle:])
+    assert tuner.cycle_count == cycles - 1
@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+
+from custom_components.smart_thermostat.mailbox import ControlMailbox
+
+
+class _Cycles:
+    """Control cycles recording their calc_pid, each one running until released."""
+
+    def __init__(self, wait=True, error=None):
+        self.calls = []
+        self.releases = []
+        self._wait = wait
+        self._error = error
+
+    async def run(self, calc_pid):
+        self.calls.append(calc_pid)
+        release = asyncio.Event()
+        self.releases.append(release)
+        if self._wait:
+            await release.wait()
+        if self._error is not None:
+            raise self._error
+
+    async def started(self, count):
+        while len(self.calls) < count:
+            await asyncio.sleep(0)
+
+
+def test_single_request_runs_once():
+    async def run():
+        cycles = _Cycles(wait=False)
+        mailbox = ControlMailbox(cycles.run)
+        await mailbox.async_post(True)
+        return cycles, mailbox
+
+    cycles, mailbox = asyncio.run(run())
+    assert cycles.calls == [True]
+    assert (mailbox.requested, mailbox.runs, mailbox.coalesced) == (1, 1, 0)
+
+
+@pytest.mark.parametrize('calc_pid', [False, True])
+def test_requests_after_a_cycle_run_a_new_one(calc_pid):
+    async def run():
+        cycles = _Cycles(wait=False)
+        mailbox = ControlMailbox(cycles.run)
+        await mailbox.async_post(False)
+        await mailbox.async_post(calc_pid)
+        return cycles, mailbox
+
+    cycles, mailbox = asyncio.run(run())
+    assert cycles.calls == [False, calc_pid]
+    assert mailbox.coalesced == 0
+
+
+def test_requests_during_a_cycle_are_coalesced():
+    async def run():
+        cycles = _Cycles()
+        mailbox = ControlMailbox(cycles.run)
+        first = asyncio.create_task(mailbox.async_post(False))
+        await cycles.started(1)
+        merged = [asyncio.create_task(mailbox.async_post(calc_pid))
+                  for calc_pid in (False, True, False)]
+        await asyncio.sleep(0)
+        assert cycles.calls == [False]
+        cycles.releases[0].set()
+        await cycles.started(2)
+        assert not any(task.done() for task in merged)
+        cycles.releases[1].set()
+        await asyncio.gather(first, *merged)
+        return cycles, mailbox
+
+    cycles, mailbox = asyncio.run(run())
+    # The follow-up computes the PID as one of the merged requests asked for it
+    assert cycles.calls == [False, True]
+    assert (mailbox.requested, mailbox.runs, mailbox.coalesced) == (4, 2, 3)
+
+
+def test_follow_up_error_is_given_to_the_merged_requests():
+    async def run():
+        cycles = _Cycles(wait=False, error=RuntimeError('cycle failed'))
+        mailbox = ControlMailbox(cycles.run)
+        first = asyncio.create_task(mailbox.async_post())
+        merged = asyncio.create_task(mailbox.async_post())
+        return await asyncio.gather(first, merged, return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert [type(result) for result in results] == [RuntimeError, RuntimeError]
+
+
+def test_cancelled_follow_up_releases_the_merged_requests():
+    async def run():
+        cycles = _Cycles()
+        mailbox = ControlMailbox(cycles.run)
+        first = asyncio.create_task(mailbox.async_post())
+        await cycles.started(1)
+        merged = asyncio.create_task(mailbox.async_post())
+        await asyncio.sleep(0)
+        cycles.releases[0].set()
+        await cycles.started(2)
+        # Another follow-up is requested while the first one runs
+        newer = asyncio.create_task(mailbox.async_post())
+        await asyncio.sleep(0)
+        first.cancel()
+        results = await asyncio.wait_for(
+            asyncio.gather(first, merged, newer, return_exceptions=True), 1)
+
+        # The mailbox still runs the cycles requested after the cancellation
+        cycles.releases.clear()
+        after = asyncio.create_task(mailbox.async_post(True))
+        await cycles.started(3)
+        cycles.releases[0].set()
+        await asyncio.wait_for(after, 1)
+        return results, cycles
+
+    results, cycles = asyncio.run(run())
+    assert all(isinstance(result, asyncio.CancelledError) for result in results)
+    assert cycles.calls == [False, False, True]
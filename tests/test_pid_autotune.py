@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from custom_components.smart_thermostat.pid_controller import PIDAutotune
+from simulation import VirtualClock, golden
+
+AUTOTUNE_TRACES = [trace for trace in golden.load_corpus() if trace['kind'] == 'autotune']
+
+
+def _name(trace):
+    return trace['name']
+
+
+def _run(autotune, clock, inputs, steps):
+    outputs = []
+    for step in steps:
+        clock.set(inputs['now'][step])
+        autotune.run(inputs['input'][step], inputs['set_point'][step], inputs['now'][step])
+        outputs.append(autotune.output)
+    return outputs
+
+
+@pytest.mark.parametrize('trace', AUTOTUNE_TRACES, ids=_name)
+def test_resumed_autotune_matches_the_trace(trace):
+    inputs = trace['inputs']
+    middle = len(inputs['now']) // 2
+    clock = VirtualClock()
+    autotune = PIDAutotune(time_func=clock, **trace['config'])
+    _run(autotune, clock, inputs, range(middle))
+    # The snapshot is saved as JSON by the storage of the entity
+    snapshot = json.loads(json.dumps(autotune.snapshot()))
+
+    resumed = PIDAutotune(time_func=clock, **trace['config'])
+    resumed.restore(snapshot)
+    assert resumed.snapshot() == snapshot
+    assert resumed.last_timestamp == autotune.last_timestamp
+    outputs = _run(resumed, clock, inputs, range(middle, len(inputs['now'])))
+    assert outputs == pytest.approx(trace['expected']['output'][middle:])
+    assert resumed.state == trace['final']['state']
+
+
+def test_restore_with_other_settings():
+    snapshot = PIDAutotune(out_step=10, lookback=60).snapshot()
+    with pytest.raises(ValueError, match='different tuning settings'):
+        PIDAutotune(out_step=20, lookback=60).restore(snapshot)
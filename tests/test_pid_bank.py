@@ -0,0 +1,55 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from custom_components.smart_thermostat.pid_controller import PID  # noqa: E402
+from custom_components.smart_thermostat.pid_controller.bank import PIDBank  # noqa: E402
+
+CONFIG = {'kp': 30, 'ki': 0.005, 'kd': 5000, 'ke': 0.6, 'out_min': 0, 'out_max': 100}
+
+
+def _run(controller, start, steps=10):
+    for step in range(start, start + steps):
+        controller.calc(19 + step * 0.05, 20.0, step * 60.0, (step - 1) * 60.0, 5.0)
+    return controller
+
+
+def test_controllers_are_computed_independently():
+    bank = PIDBank()
+    first = bank.add(**CONFIG)
+    second = bank.add(**CONFIG)
+    _run(first, 1)
+    assert second.snapshot()['input'] is None
+    assert bank.outputs[1] == 0
+
+
+def test_snapshot_matches_pid():
+    pid = _run(PID(**CONFIG), 1)
+    controller = _run(PIDBank().add(**CONFIG), 1)
+    assert controller.snapshot() == pytest.approx(pid.snapshot())
+
+
+@pytest.mark.parametrize('samples', [True, False])
+def test_restore_resumes_like_pid(samples):
+    snapshot = _run(PID(**CONFIG), 1).snapshot()
+    pid = PID(**CONFIG)
+    pid.restore(snapshot, samples)
+    bank = PIDBank()
+    bank.add(**CONFIG)
+    controller = bank.add(**CONFIG)
+    controller.restore(snapshot, samples)
+    assert controller.snapshot() == pytest.approx(pid.snapshot())
+    assert _run(controller, 11).snapshot() == pytest.approx(_run(pid, 11).snapshot())
+    assert bank[0].snapshot()['input'] is None
+
+
+def test_restore_clamps_the_output():
+    controller = PIDBank().add(**CONFIG)
+    controller.restore(dict(_run(PID(**CONFIG), 1).snapshot(), output=150.0))
+    assert controller.snapshot()['output'] == 100
+
+
+def test_restore_rejects_invalid_snapshot():
+    controller = PIDBank().add(**CONFIG)
+    with pytest.raises(ValueError):
+        controller.restore({'version': PID.SNAPSHOT_VERSION})
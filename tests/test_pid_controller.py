@@ -0,0 +1,78 @@
+import pytest
+
+from custom_components.smart_thermostat.const import PID_RESTORE_MAX_AGE
+from custom_components.smart_thermostat.pid_controller import PID
+
+CONFIG = {'kp': 30, 'ki': 0.005, 'kd': 5000, 'ke': 0.6, 'out_min': 0, 'out_max': 100}
+
+
+def _run(controller, start, steps=10):
+    for step in range(start, start + steps):
+        controller.calc(19 + step * 0.05, 20.0, step * 60.0, (step - 1) * 60.0, 5.0)
+    return controller
+
+
+def test_snapshot_round_trip():
+    pid = _run(PID(**CONFIG), 1)
+    snapshot = pid.snapshot()
+    restored = PID(1, 0, 0, out_min=0, out_max=100)
+    restored.restore(snapshot)
+    assert restored.snapshot() == snapshot
+    # The restored controller resumes exactly like the original one
+    assert _run(restored, 11).snapshot() == _run(pid, 11).snapshot()
+
+
+def test_restore_without_samples():
+    snapshot = _run(PID(**CONFIG), 1).snapshot()
+    restored = PID(**CONFIG)
+    restored.restore(snapshot, samples=False)
+    assert restored.integral == snapshot['integral']
+    assert restored.snapshot()['input'] is None
+    assert restored.snapshot()['input_time'] is None
+
+
+@pytest.mark.parametrize('snapshot', [
+    {'version': 2},
+    {'version': 1, 'mode': 'MANUAL'},
+    {'version': 1, 'mode': 'AUTO', 'kp': 1},
+])
+def test_invalid_snapshot(snapshot):
+    with pytest.raises(ValueError):
+        PID(**CONFIG).restore(snapshot)
+
+
+@pytest.mark.parametrize('input_time, fresh', [
+    (600.0, True),
+    (1000 - PID_RESTORE_MAX_AGE, True),
+    (999 - PID_RESTORE_MAX_AGE, False),
+    (None, False),
+    ('600', False),
+])
+def test_restore_expiry(input_time, fresh):
+    snapshot = {'input_time': input_time}
+    assert PID.has_fresh_samples(snapshot, 1000.0, PID_RESTORE_MAX_AGE) is fresh
+
+
+@pytest.mark.parametrize('ke, ext_temp, last_ext_temp, precision, negligible', [
+    (0.6, 5.1, 5.0, 1, True),
+    (0.6, 5.2, 5.0, 1, False),
+    (0.6, 4.9, 5.0, 1, True),
+    (0.6, 4.8, 5.0, 1, False),
+    (0.6, 5.1, 5.0, 2, False),
+    (0.6, 5.5, 5.0, 0, True),
+    (0.6, 6.7, 5.0, 0, False),
+    (0, 15.0, 5.0, 1, True),
+    (0.6, 5.0, None, 1, False),
+    (None, 5.0, 5.0, 1, False),
+])
+def test_negligible_ext_change(ke, ext_temp, last_ext_temp, precision, negligible):
+    assert PID.is_ext_change_negligible(ke, ext_temp, last_ext_temp, precision) is negligible
+
+
+def test_negligible_ext_change_moves_the_external_term_less_than_the_precision():
+    pid = PID(**CONFIG)
+    pid.calc(19.0, 20.0, 60.0, 0.0, 5.0)
+    external = pid.external
+    pid.calc(19.0, 20.0, 120.0, 60.0, 5.1)
+    assert PID.is_ext_change_negligible(CONFIG['ke'], 5.1, 5.0, 1)
+    assert abs(pid.external - external) < 0.1
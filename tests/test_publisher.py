@@ -0,0 +1,82 @@
+import pytest
+
+pytest.importorskip('homeassistant')
+
+from custom_components.smart_thermostat import publisher  # noqa: E402
+from custom_components.smart_thermostat.publisher import StatePublisher  # noqa: E402
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def delayed(monkeypatch):
+    """The writes delayed by async_call_later, as [delay, action, cancelled]."""
+    calls = []
+
+    def call_later(hass, delay, action):
+        call = [delay, action, False]
+        calls.append(call)
+        return lambda: call.__setitem__(2, True)
+    monkeypatch.setattr(publisher, 'async_call_later', call_later)
+    return calls
+
+
+def test_writes_of_a_cycle_are_coalesced(delayed):
+    writes = []
+    state_publisher = StatePublisher(None, lambda: writes.append(None))
+    with state_publisher.cycle():
+        state_publisher.publish()
+        with state_publisher.cycle():
+            state_publisher.publish()
+        assert writes == []
+        state_publisher.publish()
+    assert len(writes) == 1
+    state_publisher.publish()
+    assert len(writes) == 2
+    assert (state_publisher.requested, state_publisher.written) == (4, 2)
+
+
+def test_cycle_without_write():
+    writes = []
+    state_publisher = StatePublisher(None, lambda: writes.append(None))
+    with state_publisher.cycle():
+        pass
+    assert writes == []
+
+
+def test_minimum_interval(delayed):
+    clock = _Clock()
+    writes = []
+    state_publisher = StatePublisher(None, lambda: writes.append(clock.now), min_interval=10,
+                                     time_func=clock)
+    state_publisher.publish()
+    clock.now = 4
+    state_publisher.publish()
+    clock.now = 6
+    state_publisher.publish()
+    assert writes == [0]
+    assert len(delayed) == 1 and delayed[0][0] == 6
+
+    clock.now = 10
+    delayed[0][1](None)
+    assert writes == [0, 10]
+    assert (state_publisher.requested, state_publisher.written) == (3, 2)
+
+
+def test_cancel_delayed_write(delayed):
+    clock = _Clock()
+    writes = []
+    state_publisher = StatePublisher(None, lambda: writes.append(clock.now), min_interval=10,
+                                     time_func=clock)
+    state_publisher.publish()
+    clock.now = 1
+    state_publisher.publish()
+    state_publisher.cancel()
+    assert delayed[0][2]
+    assert writes == [0]
@@ -0,0 +1,95 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('homeassistant')
+
+from custom_components.smart_thermostat.coordinator import PwmScheduler, pwm_edge  # noqa: E402
+
+
+@pytest.fixture
+def scheduler():
+    waiters = []
+    hass = SimpleNamespace(async_create_task=waiters.append, waiters=waiters)
+    return PwmScheduler(hass)
+
+
+def test_phases_of_running_zones_are_kept(scheduler):
+    scheduler.async_register('a', 900)
+    unregister_b = scheduler.async_register('b', 900)
+    scheduler.async_register('c', 900)
+    scheduler.async_register('other', 600)
+    phases = dict(scheduler._phases)
+    assert phases == {'a': 0, 'b': 450, 'c': 675, 'other': 0}
+
+    unregister_b()
+    assert scheduler._phases == {'a': 0, 'c': 675, 'other': 0}
+    scheduler.async_register('d', 900)
+    assert scheduler._phases['a'] == 0
+    assert scheduler._phases['c'] == 675
+    assert scheduler._phases['d'] == 337.5
+
+
+def test_cycle_start_is_offset_by_the_phase(scheduler):
+    scheduler.async_register('a', 900)
+    scheduler.async_register('b', 900)
+    assert scheduler.cycle_start('a', 1000) == 900
+    assert scheduler.cycle_start('b', 1000) == 450
+    assert scheduler.cycle_start('b', 1400) == 1350
+
+
+def test_power_budget(scheduler):
+    scheduler.async_register('a', 900, power=1000, power_budget=2500)
+    scheduler.async_register('b', 900, power=1000)
+    scheduler.async_register('c', 900, power=1000)
+    waiter = object()
+    assert scheduler.async_acquire('a')
+    assert scheduler.async_acquire('b')
+    assert not scheduler.async_acquire('c', lambda: waiter)
+    scheduler.async_release('a')
+    assert scheduler._hass.waiters == [waiter]
+    assert scheduler.async_acquire('c')
+
+
+def test_unknown_power_counts_as_the_whole_budget(scheduler):
+    scheduler.async_register('a', 900, power=1000, power_budget=2500)
+    scheduler.async_register('unknown', 900)
+    assert scheduler.async_acquire('a')
+    assert not scheduler.async_acquire('unknown')
+    scheduler.async_release('a')
+    assert scheduler.async_acquire('unknown')
+    assert not scheduler.async_acquire('a')
+
+
+def test_max_active(scheduler):
+    scheduler.async_register('a', 900, max_active=1)
+    scheduler.async_register('b', 900)
+    assert scheduler.max_active == 1
+    assert scheduler.power_budget is None
+    assert scheduler.async_acquire('a')
+    assert not scheduler.async_acquire('b')
+
+
+@pytest.mark.parametrize('active, time_passed, force, expected', [
+    (True, 100, False, (False, 200)),
+    (True, 300, False, (True, 600)),
+    (True, 100, True, (True, 600)),
+    (False, 100, False, (False, 500)),
+    (False, 650, False, (True, 300)),
+    (False, 100, True, (True, 300)),
+])
+def test_pwm_edge(active, time_passed, force, expected):
+    assert pwm_edge(active, 300, 600, time_passed, force) == expected
+
+
+def test_pwm_edges_keep_the_duty_cycle():
+    # Run the control loop only on the edges it schedules
+    active, now, changed, time_on = False, 0, -600, 0
+    while now < 9000:
+        switch, delay = pwm_edge(active, 300, 600, now - changed)
+        if switch:
+            active, changed = not active, now
+        time_on += delay if active else 0
+        now += delay
+    assert now == 9000
+    assert time_on == 3000